@@ -0,0 +1,89 @@
+"""JSON responses for the message list API.
+
+/api/timeline, /api/users/<id>/messages and /api/users/<id>/likes answer
+with one page of messages and a `next_cursor`, the same keyset cursor the
+HTML pages use, to send back as `?before=`.
+
+With `?format=ndjson` (or `Accept: application/x-ndjson`) they instead
+stream every message from the cursor on, one JSON object per line, for
+exports. Rows are fetched STREAM_BATCH_SIZE at a time (from a server-side
+cursor where the driver has one) and each batch is written out as soon as
+it arrives, so memory stays flat and the first line goes out before the
+query has finished.
+"""
+
+import json
+from itertools import islice
+
+from flask import Response, g, jsonify, request, stream_with_context
+
+import media
+import pagination
+
+NDJSON = 'application/x-ndjson'
+
+STREAM_BATCH_SIZE = 500
+
+
+def wants_ndjson():
+    """Did the client ask for an NDJSON stream rather than a JSON page?"""
+
+    if request.args.get('format') == 'ndjson':
+        return True
+    return request.accept_mimetypes.best == NDJSON
+
+
+def message_json(message, liked_ids):
+    """A message as a JSON-able dict; `liked` is from the viewer's view."""
+
+    return {
+        'id': message.id,
+        'text': message.text,
+        'timestamp': message.timestamp.isoformat(),
+        'like_count': message.like_count,
+        'liked': message.id in liked_ids,
+        'user': {
+            'id': message.user.id,
+            'username': message.user.username,
+            'image_url': media.avatar_url(message.user),
+        },
+    }
+
+
+def unauthorized():
+    return jsonify(error="Access unauthorized."), 401
+
+
+def _stream(query):
+    """Yield NDJSON text for every row of `query`, a batch at a time."""
+
+    rows = iter(query.yield_per(STREAM_BATCH_SIZE))
+
+    while True:
+        batch = list(islice(rows, STREAM_BATCH_SIZE))
+        if not batch:
+            return
+
+        liked_ids = g.user.liked_message_ids([msg.id for msg in batch])
+        yield ''.join(json.dumps(message_json(msg, liked_ids)) + '\n'
+                      for msg in batch)
+
+
+def message_list(query, columns):
+    """Respond with `query` as a JSON page or, if asked, an NDJSON stream.
+
+    `query` must already start at the request's cursor and be ordered
+    newest first on `columns` (see pagination.keyset).
+    """
+
+    if wants_ndjson():
+        return Response(stream_with_context(_stream(query)), mimetype=NDJSON)
+
+    size = pagination.page_size()
+    page = pagination.make_page(query.limit(size + 1).all(), size, columns)
+    liked_ids = g.user.liked_message_ids([msg.id for msg in page.items])
+
+    return jsonify(
+        messages=[message_json(msg, liked_ids) for msg in page.items],
+        next_cursor=page.next_cursor,
+    )
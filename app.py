@@ -1,45 +1,131 @@
-from models import db, connect_db, User, Message, Like
+from models import db, connect_db, User, Message, Like, Follows, Suggestion
+import api
+import assets
+import auth
+import caching
+import counters
+import fragments
+import graph
+import instrumentation
+import jobs
+import likes
+import media
+import pagination
+import passwords
+import purge
+import replicas
+import search
+import timeline
+import trending
+from config import PROFILES
 from forms import UserAddForm, LoginForm, MessageForm, EditUserForm
 import os
 
-from flask import Flask, render_template, request, flash, redirect, session, g, jsonify, abort
-from flask_debugtoolbar import DebugToolbarExtension
+from flask import (Blueprint, Flask, render_template, request, flash, redirect,
+                   session, g, jsonify, abort, current_app)
 from sqlalchemy.exc import IntegrityError
-from sqlalchemy import or_
-from flask_cors import CORS, cross_origin
+from sqlalchemy.orm import contains_eager, joinedload
+from flask_cors import CORS
 
 CURR_USER_KEY = "curr_user"
 
-database_url = os.environ.get('DATABASE_URL', 'postgresql:///warbler')
+# Everything below is defined on this blueprint and added to each app
+# create_app() makes
+views = Blueprint('views', __name__, cli_group=None)
+views.add_app_template_global(pagination.older_url, 'older_url')
 
-database_url = database_url.replace('postgres://', 'postgresql://')
-app = Flask(__name__)
-CORS(app)
-app.config['CORS_HEADERS'] = 'Content-Type'
 
-# Get DB_URI from environ variable (useful for production/testing) or,
-# if not set there, use development local db.
-app.config['SQLALCHEMY_DATABASE_URI'] = database_url
+def route(rule, **options):
+    """Like @views.route, but the endpoint is just the view's name, as
+    caching.py, replicas.py and /metrics refer to routes by it."""
 
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.config['SQLALCHEMY_ECHO'] = False
-app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
-app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'shh')
-toolbar = DebugToolbarExtension(app)
+    def register(view):
+        views.record(lambda state: state.app.add_url_rule(
+            rule, view.__name__, view, **options))
+        return view
 
-connect_db(app)
+    return register
+
+
+def create_app(config=None, **overrides):
+    """Make a Warbler app.
+
+    `config` is a profile from config.py, by name or class (by default the
+    one named by FLASK_ENV, else production); `overrides` replace single
+    settings, e.g. create_app('testing', SQLALCHEMY_DATABASE_URI=...).
+    """
+
+    if config is None:
+        config = os.environ.get('FLASK_ENV', 'production')
+    if isinstance(config, str):
+        config = PROFILES[config]
+
+    app = Flask(__name__)
+    app.config.from_object(config)
+    app.config.update(overrides)
+
+    if app.config['REPLICA_DATABASE_URL']:
+        app.config.setdefault('SQLALCHEMY_BINDS', {
+            replicas.REPLICA_BIND: app.config['REPLICA_DATABASE_URL'],
+        })
+
+    if not app.config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite'):
+        app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', {
+            'pool_size': app.config['DB_POOL_SIZE'],
+            'max_overflow': app.config['DB_MAX_OVERFLOW'],
+            'pool_timeout': app.config['DB_POOL_TIMEOUT'],
+            'pool_recycle': app.config['DB_POOL_RECYCLE'],
+            'pool_pre_ping': app.config['DB_POOL_PRE_PING'],
+        })
+
+    if app.config['DEBUG_TOOLBAR']:
+        # imported here so other profiles never load it
+        from flask_debugtoolbar import DebugToolbarExtension
+        DebugToolbarExtension(app)
+
+    CORS(app)
+    connect_db(app)
+    instrumentation.init_app(app)
+    replicas.init_app(app, db)
+    caching.init_app(app)
+    assets.init_app(app)
+    media.init_app(app)
+    fragments.init_app(app)
+    graph.init_app(app, lambda: db.engine)
+    trending.init_app(app, lambda: db.engine)
+    likes.init_app(app, lambda: db.engine)
+    jobs.init_app(app)
+
+    app.register_blueprint(views)
+
+    return app
+
+
+def __getattr__(name):
+    """Make the default app the first time `app.app` is asked for (by
+    gunicorn app:app, `flask` or scripts), rather than on import."""
+
+    if name == 'app':
+        globals()['app'] = create_app()
+        return globals()['app']
+
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 ##############################################################################
 # User signup/login/logout
 
 
-@app.before_request
+@views.before_app_request
 def add_user_to_g():
-    """If we're logged in, add curr user to Flask global."""
+    """If we're logged in, add curr user to Flask global.
+
+    The user is a lazy proxy: nothing is queried unless the request uses it
+    (see auth.py).
+    """
 
     if CURR_USER_KEY in session:
-        g.user = User.query.get(session[CURR_USER_KEY])
+        g.user = auth.current_user_proxy(session[CURR_USER_KEY])
 
     else:
         g.user = None
@@ -58,7 +144,73 @@ def do_logout():
         del session[CURR_USER_KEY]
 
 
-@app.route('/signup', methods=["GET", "POST"])
+def password_pool_busy(template, form):
+    """Turn a request away while the password hashing pool is saturated."""
+
+    flash("We're busy right now, please try again in a moment.", 'danger')
+    return render_template(template, form=form), 503
+
+
+def viewer_liked_ids(messages):
+    """Ids of `messages` liked by the current user, as a set.
+
+    Lets templates check like state per message without a query each.
+    """
+
+    if not g.user:
+        return set()
+
+    return g.user.liked_message_ids([msg.id for msg in messages])
+
+
+def viewer_following_ids(users):
+    """Ids of `users` followed by the current user, as a set."""
+
+    if not g.user:
+        return set()
+
+    return g.user.following_ids([user.id for user in users])
+
+
+def suggested_users(user, limit=None):
+    """Users suggested for `user` to follow, best first.
+
+    Read from the list `flask recommend` stored (see recommendations.py),
+    leaving out anyone deleted or followed since it ran.
+    """
+
+    suggestion = Suggestion.query.get(user.id)
+    if suggestion is None:
+        return []
+
+    by_id = {other.id: other for other
+             in User.query.filter(User.id.in_(suggestion.user_ids),
+                                  User.deleted_at.is_(None))}
+    followed = user.following_ids(list(by_id))
+    users = [by_id[user_id] for user_id in suggestion.user_ids
+             if user_id in by_id and user_id not in followed]
+
+    return users[:limit]
+
+
+def trending_messages(limit=None):
+    """The trending messages (see trending.py), hottest first."""
+
+    ids = trending.current_ids(limit)
+    if not ids:
+        return []
+
+    # the list is refreshed periodically; deleted accounts drop out at once
+    by_id = {msg.id: msg for msg
+             in Message.query.join(Message.user)
+                             .options(contains_eager(Message.user))
+                             .filter(Message.id.in_(ids),
+                                     User.deleted_at.is_(None))}
+
+    return [by_id[message_id] for message_id in ids if message_id in by_id]
+
+
+@route('/signup', methods=["GET", "POST"])
 def signup():
     """Handle user signup.
 
@@ -80,12 +232,25 @@ def signup():
                 email=form.email.data,
                 image_url=form.image_url.data or User.image_url.default.arg,
             )
+            db.session.flush()
+            search.index_user(user)
+            if form.image_file.data:
+                media.save_upload(user, 'avatar', form.image_file.data)
             db.session.commit()
 
         except IntegrityError:
+            db.session.rollback()
             flash("Username already taken", 'danger')
             return render_template('users/signup.html', form=form)
 
+        except media.InvalidImage as error:
+            db.session.rollback()
+            flash(str(error), 'danger')
+            return render_template('users/signup.html', form=form)
+
+        except passwords.PasswordHasherBusy:
+            return password_pool_busy('users/signup.html', form)
+
         do_login(user)
 
         return redirect("/")
@@ -94,17 +259,22 @@ def signup():
         return render_template('users/signup.html', form=form)
 
 
-@app.route('/login', methods=["GET", "POST"])
+@route('/login', methods=["GET", "POST"])
 def login():
     """Handle user login."""
 
     form = LoginForm()
 
     if form.validate_on_submit():
-        user = User.authenticate(form.username.data,
-                                 form.password.data)
+        try:
+            user = User.authenticate(form.username.data,
+                                     form.password.data)
+        except passwords.PasswordHasherBusy:
+            return password_pool_busy('users/login.html', form)
 
         if user:
+            # saves an upgraded password hash, if authenticate made one
+            db.session.commit()
             do_login(user)
             flash(f"Hello, {user.username}!", "success")
             return redirect("/")
@@ -114,7 +284,7 @@ def login():
     return render_template('users/login.html', form=form)
 
 
-@app.route('/logout')
+@route('/logout')
 def logout():
     """Handle logout of user."""
 
@@ -128,24 +298,47 @@ def logout():
 ##############################################################################
 # General user routes:
 
-@app.route('/users')
+@route('/users')
 def list_users():
-    """Page with listing of users.
+    """Page with listing of users, newest first.
 
-    Can take a 'q' param in querystring to search by that username.
+    Can take a 'q' param in querystring to search by username or bio (best
+    matches first), and a 'before' cursor for later pages.
     """
 
-    search = request.args.get('q')
+    query = request.args.get('q')
 
-    if not search:
-        users = User.query.all()
+    if query:
+        page = search.search_users(query, request.args.get('before'))
     else:
-        users = User.query.filter(User.username.like(f"%{search}%")).all()
+        page = pagination.paginate(User.query.filter_by(deleted_at=None),
+                                   (User.id,))
+
+    return render_template('users/index.html',
+                           users=page.items,
+                           following_ids=viewer_following_ids(page.items),
+                           next_cursor=page.next_cursor)
+
+
+@route('/users/<int:user_id>/suggestions')
+def users_suggestions(user_id):
+    """Show the people suggested for a user to follow; only to that user."""
+
+    if not g.user:
+        flash("Access unauthorized.", "danger")
+        return redirect("/")
+
+    user = User.get_active_or_404(user_id)
+    if user.id != g.user.id:
+        flash("Access unauthorized.", "danger")
+        return redirect("/")
 
-    return render_template('users/index.html', users=users)
+    return render_template('users/index.html',
+                           users=suggested_users(user),
+                           following_ids=set())
 
 
-@app.route('/users/<int:user_id>')
+@route('/users/<int:user_id>')
 def users_show(user_id):
     """Show user profile."""
 
@@ -153,12 +346,28 @@ def users_show(user_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    user = User.query.get_or_404(user_id)
+    user = User.get_active_or_404(user_id)
+    page = pagination.paginate(Message.query.filter_by(user_id=user.id),
+                               (Message.timestamp, Message.id))
+    liked_ids = viewer_liked_ids(page.items)
 
-    return render_template('users/show.html', user=user)
+    not_modified = caching.check_etag(
+        user.id, user.updated_at,
+        user.message_count, user.following_count,
+        user.follower_count, user.liked_count,
+        g.user.id != user.id and g.user.is_following(user),
+        [msg.id for msg in page.items], page.next_cursor, sorted(liked_ids))
+    if not_modified:
+        return not_modified
 
+    return render_template('users/show.html',
+                           user=user,
+                           messages=page.items,
+                           liked_ids=liked_ids,
+                           next_cursor=page.next_cursor)
 
-@app.route('/users/<int:user_id>/following')
+
+@route('/users/<int:user_id>/following')
 def show_following(user_id):
     """Show list of people this user is following."""
 
@@ -166,11 +375,22 @@ def show_following(user_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    user = User.query.get_or_404(user_id)
-    return render_template('users/following.html', user=user)
+    user = User.get_active_or_404(user_id)
+    following = (User
+                 .query
+                 .join(Follows, Follows.user_being_followed_id == User.id)
+                 .filter(Follows.user_following_id == user.id,
+                         User.deleted_at.is_(None)))
+    page = pagination.paginate(following, (User.id,))
+
+    return render_template('users/following.html',
+                           user=user,
+                           users=page.items,
+                           following_ids=viewer_following_ids(page.items),
+                           next_cursor=page.next_cursor)
 
 
-@app.route('/users/<int:user_id>/followers')
+@route('/users/<int:user_id>/followers')
 def users_followers(user_id):
     """Show list of followers of this user."""
 
@@ -178,11 +398,22 @@ def users_followers(user_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    user = User.query.get_or_404(user_id)
-    return render_template('users/followers.html', user=user)
+    user = User.get_active_or_404(user_id)
+    followers = (User
+                 .query
+                 .join(Follows, Follows.user_following_id == User.id)
+                 .filter(Follows.user_being_followed_id == user.id,
+                         User.deleted_at.is_(None)))
+    page = pagination.paginate(followers, (User.id,))
+
+    return render_template('users/followers.html',
+                           user=user,
+                           users=page.items,
+                           following_ids=viewer_following_ids(page.items),
+                           next_cursor=page.next_cursor)
 
 
-@app.route('/users/follow/<int:follow_id>', methods=['POST'])
+@route('/users/follow/<int:follow_id>', methods=['POST'])
 def add_follow(follow_id):
     """Add a follow for the currently-logged-in user."""
 
@@ -190,14 +421,19 @@ def add_follow(follow_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    followed_user = User.query.get_or_404(follow_id)
+    followed_user = User.get_active_or_404(follow_id)
     g.user.following.append(followed_user)
+    db.session.flush()
+    counters.bump(User, g.user.id, following_count=1)
+    counters.bump(User, followed_user.id, follower_count=1)
+    timeline.backfill_follow(g.user, followed_user)
     db.session.commit()
+    graph.follow(g.user.id, followed_user.id)
 
     return redirect(f"/users/{g.user.id}/following")
 
 
-@app.route('/users/stop-following/<int:follow_id>', methods=['POST'])
+@route('/users/stop-following/<int:follow_id>', methods=['POST'])
 def stop_following(follow_id):
     """Have currently-logged-in-user stop following this user."""
 
@@ -207,12 +443,16 @@ def stop_following(follow_id):
 
     followed_user = User.query.get(follow_id)
     g.user.following.remove(followed_user)
+    counters.bump(User, g.user.id, following_count=-1)
+    counters.bump(User, followed_user.id, follower_count=-1)
+    timeline.prune_follow(g.user, followed_user)
     db.session.commit()
+    graph.unfollow(g.user.id, followed_user.id)
 
     return redirect(f"/users/{g.user.id}/following")
 
 
-@app.route('/users/profile', methods=["GET", "POST"])
+@route('/users/profile', methods=["GET", "POST"])
 def profile():
     """Update profile for current user."""
     if not g.user:
@@ -223,31 +463,67 @@ def profile():
     form = EditUserForm(obj=user)
 
     if form.validate_on_submit():
+        # check against the row we already have rather than looking the
+        # user up again through User.authenticate
+        try:
+            is_auth = passwords.check_password(user.password, form.password.data)
+        except passwords.PasswordHasherBusy:
+            return password_pool_busy('users/edit.html', form)
+
+        if not is_auth:
+            flash("Invalid credentials.", 'danger')
+            return redirect('/')
+
+        image_url = form.image_url.data or User.image_url.default.arg
+        header_image_url = (form.header_image_url.data
+                            or User.header_image_url.default.arg)
+
         try:
             user.username = form.username.data
-            password = form.password.data
             user.email = form.email.data
-            user.image_url = form.image_url.data or User.image_url.default.arg
             user.bio = form.bio.data
-            user.header_image_url = form.header_image_url.data or User.header_image_url.default.arg
 
-            if User.authenticate(user.username, password):
-                db.session.commit()
-                return redirect(f'/users/{user.id}')
-            else:
-                flash("Invalid credentials.", 'danger')
-                return redirect('/')
+            # a new URL replaces an uploaded picture; a new upload shows
+            # once its variants are made (see media.py)
+            if image_url != user.image_url:
+                user.image_url = image_url
+                user.image_key = None
+            if header_image_url != user.header_image_url:
+                user.header_image_url = header_image_url
+                user.header_image_key = None
+
+            uploads = [(kind, field.data) for kind, field
+                       in (('avatar', form.image_file),
+                           ('header', form.header_image_file))
+                       if field.data]
+            for kind, upload in uploads:
+                media.save_upload(user, kind, upload)
+
+            search.index_user(user)
+            db.session.commit()
+            auth.invalidate(user.id)
+            fragments.forget_author(user.id)
+            if uploads:
+                flash("Your new picture will show in a moment.", 'success')
+            return redirect(f'/users/{user.id}')
 
         except IntegrityError:
+            db.session.rollback()
             flash("Username already taken", 'danger')
             return render_template('users/edit.html', form=form)
 
+        except media.InvalidImage as error:
+            db.session.rollback()
+            flash(str(error), 'danger')
+            return render_template('users/edit.html', form=form)
+
     return render_template('/users/edit.html', form=form, user_id=user.id)
 
 
-@app.route('/users/delete', methods=["POST"])
+@route('/users/delete', methods=["POST"])
 def delete_user():
-    """Delete user."""
+    """Delete user: hidden at once, their rows removed by a background job
+    (see purge.py)."""
 
     if not g.user:
         flash("Access unauthorized.", "danger")
@@ -255,8 +531,12 @@ def delete_user():
 
     do_logout()
 
-    db.session.delete(g.user)
+    user_id = g.user.id
+    purge.delete_account(g.user)
     db.session.commit()
+    auth.invalidate(user_id)
+    fragments.forget_author(user_id)
+    graph.forget_user(user_id)
 
     return redirect("/signup")
 
@@ -264,7 +544,7 @@ def delete_user():
 ##############################################################################
 # Messages routes:
 
-@app.route('/messages/new', methods=["GET", "POST"])
+@route('/messages/new', methods=["GET", "POST"])
 def messages_add():
     """Add a message:
 
@@ -285,6 +565,10 @@ def messages_add():
         #     return redirect("/")
 
         g.user.messages.append(msg)
+        db.session.flush()
+        counters.bump(User, g.user.id, message_count=1)
+        timeline.fan_out_message(msg)
+        search.index_message(msg)
         db.session.commit()
 
         return redirect(f"/users/{g.user.id}")
@@ -292,15 +576,35 @@ def messages_add():
     return render_template('messages/new.html', form=form)
 
 
-@app.route('/messages/<int:message_id>', methods=["GET"])
+@route('/messages/trending')
+def messages_trending():
+    """Show the messages getting the most likes lately."""
+
+    messages = trending_messages()
+
+    return render_template('messages/trending.html',
+                           messages=messages,
+                           liked_ids=viewer_liked_ids(messages))
+
+
+@route('/messages/<int:message_id>', methods=["GET"])
 def messages_show(message_id):
     """Show a message."""
 
-    msg = Message.query.get(message_id)
+    msg = Message.query.options(joinedload(Message.user)).get_or_404(message_id)
+    if msg.user.deleted_at:
+        abort(404)
+
+    not_modified = caching.check_etag(
+        msg.id, msg.user.id, msg.user.updated_at,
+        bool(g.user) and g.user.id != msg.user_id and g.user.is_following(msg.user))
+    if not_modified:
+        return not_modified
+
     return render_template('messages/show.html', message=msg)
 
 
-@app.route('/messages/<int:message_id>/delete', methods=["POST"])
+@route('/messages/<int:message_id>/delete', methods=["POST"])
 def messages_destroy(message_id):
     """Delete a message."""
 
@@ -312,8 +616,11 @@ def messages_destroy(message_id):
     if msg.user_id != g.user.id:
         flash("Access unauthorized.", "danger")
         return redirect("/")
+    counters.forget_message(msg)
+    search.unindex_message(msg.id)
     db.session.delete(msg)
     db.session.commit()
+    fragments.forget_message(message_id)
 
     return redirect(f"/users/{g.user.id}")
 
@@ -321,22 +628,14 @@ def messages_destroy(message_id):
 # Like routes:
 
 
-# @app.route('/like/<int:message_id>', methods=['POST'])
-# @cross_origin(origin='*', headers=['Content-Type', 'Authorization'])
-@app.route('/messages/<int:message_id>/like', methods=['POST'])
+@route('/messages/<int:message_id>/like', methods=['POST'])
 def add_like(message_id):
-    """Allows user to like a message"""
-    # user = g.user
-    # print('user', user)
-    # if not g.user:
-    #     flash("Sign in to like.")
-    #     return redirect("/")
-
-    # liked_message = Message.query.get_or_404(message_id)
-    # g.user.liked_messages.append(liked_message)
-    # db.session.commit()
-    #  json
-    print('here')
+    """Toggle the current user's like of a message.
+
+    The like star's form falls back to this when script.js isn't running;
+    the script uses /api/messages/<id>/like instead.
+    """
+
     if not g.user:
         flash("Access unauthorized.", "danger")
         return redirect("/")
@@ -345,19 +644,13 @@ def add_like(message_id):
     if liked_message.user_id == g.user.id:
         return abort(403)
 
-    if liked_message in g.user.liked_messages:
-        g.user.liked_messages.remove(liked_message)
-    else:
-        g.user.liked_messages.append(liked_message)
-
-    db.session.commit()
-
-    return redirect("/")
+    liked = Like.query.get((g.user.id, liked_message.id)) is not None
+    likes.set_like(g.user.id, liked_message, not liked)
 
-    # return jsonify(result="like")
+    return redirect(request.referrer or "/")
 
 
-@app.route('/like/stop-liking/<int:message_id>', methods=['POST'])
+@route('/like/stop-liking/<int:message_id>', methods=['POST'])
 def remove_like(message_id):
     """Allows user to remove a like on a message"""
 
@@ -366,13 +659,12 @@ def remove_like(message_id):
         return redirect("/")
 
     liked_message = Message.query.get_or_404(message_id)
-    g.user.liked_messages.remove(liked_message)
-    db.session.commit()
+    likes.set_like(g.user.id, liked_message, False)
 
     return jsonify(result="dislike")
 
 
-@app.route('/users/<int:user_id>/likes', methods=["GET"])
+@route('/users/<int:user_id>/likes', methods=["GET"])
 def show_likes(user_id):
     """Shows all liked messages"""
 
@@ -381,47 +673,232 @@ def show_likes(user_id):
         return redirect("/")
 
     # user = g.user
-    user = User.query.get_or_404(user_id)
-    return render_template('/likes/show.html', user=user)
+    user = User.get_active_or_404(user_id)
+    liked = (Message
+             .query
+             .options(joinedload(Message.user))
+             .join(Like, Like.message_id == Message.id)
+             .filter(Like.user_id == user.id))
+    page = pagination.paginate(liked, (Message.id,))
+
+    return render_template('/likes/show.html',
+                           user=user,
+                           messages=page.items,
+                           liked_ids=viewer_liked_ids(page.items),
+                           next_cursor=page.next_cursor)
+
+##############################################################################
+# Search
+
+
+@route('/search')
+def search_all():
+    """Search users or messages.
+
+    Takes 'q' (the search text), 'kind' ('users', the default, or
+    'messages') and a 'before' cursor for later pages; best matches first.
+    """
+
+    query = request.args.get('q', '')
+    kind = request.args.get('kind', 'users')
+
+    if kind == 'messages':
+        page = search.search_messages(query, request.args.get('before'))
+        return render_template('messages/search.html',
+                               q=query,
+                               messages=page.items,
+                               liked_ids=viewer_liked_ids(page.items),
+                               next_cursor=page.next_cursor)
+
+    page = search.search_users(query, request.args.get('before'))
+    return render_template('users/index.html',
+                           q=query,
+                           users=page.items,
+                           following_ids=viewer_following_ids(page.items),
+                           next_cursor=page.next_cursor)
+
+
+##############################################################################
+# JSON API: pages of messages, or NDJSON streams of them (see api.py), and
+# liking
+
+
+@route('/api/timeline')
+def api_timeline():
+    """The logged-in user's home timeline."""
+
+    if not g.user:
+        return api.unauthorized()
+
+    columns = (Message.timestamp, Message.id)
+    limit = None if api.wants_ndjson() else pagination.page_size() + 1
+    query = timeline.timeline_query(g.user,
+                                    before=pagination.request_cursor(columns),
+                                    limit=limit)
+
+    return api.message_list(query, columns)
+
+
+@route('/api/users/<int:user_id>/messages')
+def api_user_messages(user_id):
+    """A user's messages, newest first."""
+
+    if not g.user:
+        return api.unauthorized()
+
+    user = User.get_active_or_404(user_id)
+    columns = (Message.timestamp, Message.id)
+    query = pagination.keyset(Message
+                              .query
+                              .options(joinedload(Message.user))
+                              .filter_by(user_id=user.id),
+                              columns,
+                              pagination.request_cursor(columns))
+
+    return api.message_list(query, columns)
+
+
+@route('/api/users/<int:user_id>/likes')
+def api_user_likes(user_id):
+    """Messages a user has liked, in the same order as their likes page."""
+
+    if not g.user:
+        return api.unauthorized()
+
+    user = User.get_active_or_404(user_id)
+    columns = (Message.id,)
+    query = pagination.keyset(Message
+                              .query
+                              .options(joinedload(Message.user))
+                              .join(Like, Like.message_id == Message.id)
+                              .filter(Like.user_id == user.id),
+                              columns,
+                              pagination.request_cursor(columns))
+
+    return api.message_list(query, columns)
+
+
+@route('/api/messages/<int:message_id>/like', methods=['PUT', 'DELETE'])
+def api_like(message_id):
+    """Like (PUT) or unlike (DELETE) a message; repeating either is harmless.
+
+    Answers with the new state and like count.
+    """
+
+    if not g.user:
+        return api.unauthorized()
+
+    message = Message.query.get(message_id)
+    if message is None:
+        return jsonify(error="No such message."), 404
+    if message.user_id == g.user.id:
+        return jsonify(error="You can't like your own message."), 403
+
+    try:
+        liked, like_count = likes.set_like(g.user.id, message,
+                                           request.method == 'PUT')
+    except IntegrityError:
+        return jsonify(error="No such message."), 404
+
+    return jsonify(message_id=message.id, liked=liked, like_count=like_count)
+
 
 ##############################################################################
 # Homepage and error pages
 
 
-@app.route('/')
+@route('/')
 def homepage():
     """Show homepage:
 
     - anon users: no messages
-    - logged in: 100 most recent messages of followed_users
+    - logged in: most recent messages of the user and followed_users,
+      read from their timeline inbox (see timeline.py), a page at a time
     """
 
     if g.user:
-        follower_ids = [user.id for user in g.user.followers]
-        messages = (Message
-                    .query
-                    .filter(or_(Message.user_id == g.user.id, Message.user_id.in_(follower_ids)))
-                    .order_by(Message.timestamp.desc())
-                    .limit(100)
-                    .all())
-
-        return render_template('home.html', messages=messages)
+        columns = (Message.timestamp, Message.id)
+        size = pagination.page_size()
+        messages = timeline.home_timeline(g.user,
+                                          limit=size + 1,
+                                          before=pagination.request_cursor(columns))
+        page = pagination.make_page(messages, size, columns)
+
+        return render_template('home.html',
+                               messages=page.items,
+                               liked_ids=viewer_liked_ids(page.items),
+                               suggestions=suggested_users(g.user, limit=5),
+                               next_cursor=page.next_cursor)
 
     else:
-        return render_template('home-anon.html')
+        return render_template('home-anon.html',
+                               messages=trending_messages(limit=20))
+
+
+##############################################################################
+# Metrics
+
+
+@route('/metrics')
+def show_metrics():
+    """Per-route SQL totals and other runtime stats, as JSON; only with the
+    metrics token."""
+
+    if not instrumentation.metrics_allowed():
+        abort(404)
+
+    return jsonify(instrumentation.metrics())
 
 
 ##############################################################################
-# Turn off all caching in Flask
-#   (useful for dev; in production, this kind of stuff is typically
-#   handled elsewhere)
-#
-# https://stackoverflow.com/questions/34066804/disabling-caching-in-flask
-
-@app.after_request
-def add_header(response):
-    """Add non-caching headers on every request."""
-
-    # https://developer.mozilla.org/en-US/docs/Web/HTTP/Headers/Cache-Control
-    response.cache_control.no_store = True
-    return response
+# Maintenance commands
+
+
+@views.cli.command('reconcile-counters')
+def reconcile_counters():
+    """Recompute the denormalized message/follow/like counters."""
+
+    counters.reconcile()
+    db.session.commit()
+
+
+@views.cli.command('rebuild-timelines')
+def rebuild_timelines():
+    """Recompute every home timeline from messages and follows."""
+
+    timeline.rebuild_timelines()
+    db.session.commit()
+
+
+@views.cli.command('recommend')
+def recommend():
+    """Recompute every user's "who to follow" suggestions."""
+
+    # numpy and scipy are only needed wherever this job runs
+    import recommendations
+
+    recommendations.compute_all()
+
+
+@views.cli.command('run-jobs')
+def run_jobs():
+    """Run every background job that is due, then stop (see worker.py)."""
+
+    print(f"ran {jobs.run_pending()} jobs")
+
+
+@views.cli.command('build-assets')
+def build_assets():
+    """Fingerprint and compress the static files (see assets.py)."""
+
+    manifest = assets.build_app(current_app)
+    print(f"built {len(manifest)} assets into {current_app.config['ASSETS_DIR']}")
+
+
+@views.cli.command('init-search')
+def init_search():
+    """Create (or on SQLite, rebuild) the search indexes."""
+
+    search.install()
+    db.session.commit()
+
@@ -0,0 +1,250 @@
+"""Fingerprinted, precompressed static assets.
+
+`flask build-assets` (run on deploy by bin/post_compile) copies everything
+under static/ into ASSETS_DIR with a hash of its content in the name
+(stylesheets/style.css -> stylesheets/style.1b2c3d4e5f60.css), after:
+
+- shrinking JPEGs and PNGs wider than ASSETS_MAX_IMAGE_WIDTH and
+  recompressing them, when Pillow is installed
+- pointing stylesheets' url(/static/...) references at the built files
+
+Text files (CSS, JS, SVG, icons) also get .gz and, when Brotli is
+installed, .br variants next to them, if those are smaller. manifest.json
+maps each original name to its built name and variants.
+
+Templates link static files with `static_url(name)`, which gives the
+built file's /assets/ URL when there is a manifest and the plain /static/
+one otherwise (development, tests). It also takes /static/ URLs, such as
+the default avatar stored in users' rows, and leaves any other URL alone.
+
+/assets/ files never change, so they are served with a year's max-age and
+`immutable`, through send_file (so the server can use sendfile, or
+X-Sendfile with USE_X_SENDFILE), picking the smallest variant the
+browser's Accept-Encoding allows.
+"""
+
+import gzip
+import hashlib
+import io
+import json
+import logging
+import mimetypes
+import os
+import re
+
+from flask import current_app, request, send_from_directory, url_for
+
+logger = logging.getLogger('warbler.assets')
+
+URL_PREFIX = '/assets/'
+MANIFEST = 'manifest.json'
+
+# a year: built files are never changed, only replaced by new names
+MAX_AGE = 365 * 24 * 60 * 60
+
+COMPRESSIBLE = {'.css', '.js', '.svg', '.ico', '.txt', '.json'}
+IMAGES = {'.jpg': 'JPEG', '.jpeg': 'JPEG', '.png': 'PNG'}
+JPEG_QUALITY = 82
+
+# best first
+ENCODINGS = [('br', '.br'), ('gzip', '.gz')]
+
+STYLESHEET_URL = re.compile(r'''url\(\s*(['"]?)/static/([^'")?#]+)\1\s*\)''')
+
+
+def fingerprinted(name, data):
+    """`name` with a hash of `data` before its extension."""
+
+    base, ext = os.path.splitext(name)
+    return f"{base}.{hashlib.sha256(data).hexdigest()[:12]}{ext}"
+
+
+def optimize_image(data, ext, max_width):
+    """`data` resized to at most `max_width` and recompressed, if that
+    makes it smaller (and Pillow is installed)."""
+
+    try:
+        from PIL import Image
+    except ImportError:
+        logger.warning("Pillow isn't installed; images are copied as they are")
+        return data
+
+    image = Image.open(io.BytesIO(data))
+    if image.width > max_width:
+        height = round(image.height * max_width / image.width)
+        image = image.resize((max_width, height), Image.LANCZOS)
+
+    out = io.BytesIO()
+    if IMAGES[ext] == 'JPEG':
+        image.convert('RGB').save(out, 'JPEG', quality=JPEG_QUALITY,
+                                  optimize=True, progressive=True)
+    else:
+        image.save(out, 'PNG', optimize=True)
+
+    smaller = out.getvalue()
+    return smaller if len(smaller) < len(data) else data
+
+
+def compress(data, encoding):
+    if encoding == 'gzip':
+        # mtime=0 so the same input always builds the same file
+        return gzip.compress(data, compresslevel=9, mtime=0)
+
+    try:
+        import brotli
+    except ImportError:
+        return None
+    return brotli.compress(data, quality=11)
+
+
+def rewrite_stylesheet(data, manifest):
+    """Point the url(/static/...) references in a stylesheet at built files."""
+
+    def replace(match):
+        entry = manifest.get(match.group(2))
+        if entry is None:
+            return match.group(0)
+        return f'url("{URL_PREFIX}{entry["file"]}")'
+
+    return STYLESHEET_URL.sub(replace, data.decode('UTF-8')).encode('UTF-8')
+
+
+def build(source, target, max_image_width):
+    """Build every file under `source` into `target`; returns the manifest.
+
+    Files already in `target` are left alone, but a deploy builds into a
+    fresh ASSETS_DIR, so pages rendered before it may link files the new
+    build doesn't have. Page ETags carry the manifest's `version()` (see
+    caching.py) so such pages aren't revalidated as current.
+    """
+
+    names = sorted(os.path.relpath(os.path.join(directory, filename), source)
+                   .replace(os.sep, '/')
+                   for directory, _, filenames in os.walk(source)
+                   for filename in filenames)
+    manifest = {}
+
+    # stylesheets last, so they can point at the built images
+    for name in sorted(names, key=lambda name: name.endswith('.css')):
+        ext = os.path.splitext(name)[1].lower()
+        with open(os.path.join(source, name), 'rb') as file:
+            data = file.read()
+
+        if ext in IMAGES:
+            data = optimize_image(data, ext, max_image_width)
+        elif ext == '.css':
+            data = rewrite_stylesheet(data, manifest)
+
+        built = fingerprinted(name, data)
+        path = os.path.join(target, built)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as file:
+            file.write(data)
+
+        encodings = []
+        if ext in COMPRESSIBLE:
+            for encoding, suffix in ENCODINGS:
+                compressed = compress(data, encoding)
+                if compressed is not None and len(compressed) < len(data):
+                    with open(path + suffix, 'wb') as file:
+                        file.write(compressed)
+                    encodings.append(encoding)
+
+        manifest[name] = {'file': built, 'encodings': encodings}
+
+    # written whole and then swapped in, so a running worker never reads
+    # half a manifest
+    manifest_path = os.path.join(target, MANIFEST)
+    with open(manifest_path + '.tmp', 'w') as file:
+        json.dump(manifest, file, indent=2, sort_keys=True)
+    os.replace(manifest_path + '.tmp', manifest_path)
+
+    return manifest
+
+
+def build_app(app):
+    """Build `app`'s static folder into its ASSETS_DIR."""
+
+    return build(app.static_folder, app.config['ASSETS_DIR'],
+                 app.config['ASSETS_MAX_IMAGE_WIDTH'])
+
+
+def _manifest():
+    """This app's manifest, read once; {} if assets haven't been built."""
+
+    state = current_app.extensions['assets']
+    if state.get('manifest') is None:
+        path = os.path.join(current_app.config['ASSETS_DIR'], MANIFEST)
+        try:
+            with open(path) as file:
+                manifest = json.load(file)
+        except FileNotFoundError:
+            manifest = {}
+        state['manifest'] = manifest
+        state['by_file'] = {entry['file']: entry for entry in manifest.values()}
+        state['version'] = hashlib.sha256(
+            json.dumps(manifest, sort_keys=True).encode('UTF-8')).hexdigest()[:12]
+
+    return state['manifest']
+
+
+def version():
+    """A digest of this app's manifest, which changes with every build that
+    changes a file."""
+
+    _manifest()
+    return current_app.extensions['assets']['version']
+
+
+def static_url(name):
+    """URL for static file `name` (or a /static/ URL): the built file's when
+    there is one (Jinja global)."""
+
+    if not name:
+        return name
+    if name.startswith('/static/'):
+        name = name[len('/static/'):]
+    elif name.startswith(('/', 'http:', 'https:', 'data:')):
+        return name
+
+    entry = _manifest().get(name)
+    if entry is None:
+        return url_for('static', filename=name)
+
+    return URL_PREFIX + entry['file']
+
+
+def serve(filename):
+    """Send a built file, in the best encoding the browser accepts."""
+
+    _manifest()
+    entry = current_app.extensions['assets']['by_file'].get(filename)
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+
+    chosen = None
+    for encoding, suffix in ENCODINGS:
+        if (entry and encoding in entry['encodings']
+                and request.accept_encodings[encoding]):
+            chosen = encoding, suffix
+            break
+
+    response = send_from_directory(
+        current_app.config['ASSETS_DIR'],
+        filename + (chosen[1] if chosen else ''),
+        mimetype=mimetype,
+        max_age=MAX_AGE)
+
+    if chosen:
+        response.headers['Content-Encoding'] = chosen[0]
+    if entry and entry['encodings']:
+        response.vary.add('Accept-Encoding')
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+
+    return response
+
+
+def init_app(app):
+    app.extensions['assets'] = {}
+    app.add_url_rule(URL_PREFIX + '<path:filename>', 'assets', serve)
+    app.jinja_env.globals['static_url'] = static_url
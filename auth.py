@@ -0,0 +1,106 @@
+"""Lazy loading of the logged-in user.
+
+`g.user` is a proxy that only touches the database the first time a view or
+template actually uses it, so static files, redirects and anonymous pages
+never pay for it. The first load fetches just the identity columns nearly
+every page uses (IDENTITY_COLUMNS); any other attribute, such as the bio or
+the counters, hydrates the rest of the row on first access.
+
+Identity columns are kept in a small per-worker cache for
+CURRENT_USER_CACHE_TTL seconds. Views that change them (profile edits,
+account deletion) must call `invalidate(user_id)`.
+"""
+
+import threading
+import time
+
+from flask import current_app, g
+from sqlalchemy.orm import make_transient_to_detached
+from werkzeug.local import LocalProxy
+
+from models import db, User
+
+IDENTITY_COLUMNS = ('id', 'username', 'image_url', 'header_image_url',
+                    'image_key', 'header_image_key', 'updated_at')
+
+# cap on cached identities; the cache is simply emptied when it is reached
+CACHE_MAX_ENTRIES = 10000
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def _cached_identity(user_id):
+    """Identity column values for `user_id` if cached and fresh, else None."""
+
+    if current_app.config['CURRENT_USER_CACHE_TTL'] <= 0:
+        return None
+
+    with _cache_lock:
+        entry = _cache.get(user_id)
+
+    if entry is None:
+        return None
+
+    expires_at, values = entry
+    if expires_at < time.monotonic():
+        return None
+
+    return values
+
+
+def _remember_identity(user_id, values):
+    ttl = current_app.config['CURRENT_USER_CACHE_TTL']
+    if ttl <= 0:
+        return
+
+    with _cache_lock:
+        if len(_cache) >= CACHE_MAX_ENTRIES:
+            _cache.clear()
+        _cache[user_id] = (time.monotonic() + ttl, values)
+
+
+def invalidate(user_id):
+    """Forget the cached identity of `user_id` in this worker."""
+
+    with _cache_lock:
+        _cache.pop(user_id, None)
+
+
+def load_user(user_id):
+    """Load `user_id` with only its identity columns, or None if missing.
+
+    Served from the identity cache when possible. Either way the values are
+    merged into the session as a partly loaded User whose remaining columns
+    are expired, so they all load together in one query on first access
+    (deferred columns would each load on their own).
+    """
+
+    values = _cached_identity(user_id)
+
+    if values is None:
+        row = (db.session
+               .query(*(getattr(User, column) for column in IDENTITY_COLUMNS))
+               .filter(User.id == user_id, User.deleted_at.is_(None))
+               .first())
+
+        if row is None:
+            return None
+
+        values = dict(row._mapping)
+        _remember_identity(user_id, values)
+
+    user = User(**values)
+    make_transient_to_detached(user)
+    return db.session.merge(user, load=False)
+
+
+def current_user_proxy(user_id):
+    """A proxy for `g.user` that loads `user_id` on first use, once."""
+
+    def get_user():
+        if '_current_user' not in g:
+            g._current_user = load_user(user_id)
+        return g._current_user
+
+    return LocalProxy(get_user)
@@ -0,0 +1,73 @@
+"""Microbenchmark: bcrypt hashes per second per core.
+
+Use it to pick BCRYPT_LOG_ROUNDS for the hardware you deploy on. Run from
+the repo root:
+
+    python -m bench.bench_bcrypt --rounds 10 12 --seconds 3
+
+For each cost factor it times hashing on one core and then across a process
+pool with one process per core, and prints both rates.
+"""
+
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import bcrypt
+
+PASSWORD = b'correct horse battery staple'
+
+
+def _hash(rounds):
+    return bcrypt.hashpw(PASSWORD, bcrypt.gensalt(rounds))
+
+
+def single_core_rate(rounds, seconds):
+    """Hashes per second on one core at `rounds`."""
+
+    done = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        _hash(rounds)
+        done += 1
+
+    return done / (time.perf_counter() - start)
+
+
+def pool_rate(rounds, seconds, processes):
+    """Hashes per second across a pool of `processes` at `rounds`."""
+
+    per_core = single_core_rate(rounds, 0.5)
+    jobs = max(processes, int(per_core * processes * seconds))
+
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        # warm the pool up so process start-up isn't timed
+        list(pool.map(_hash, [4] * processes))
+
+        start = time.perf_counter()
+        list(pool.map(_hash, [rounds] * jobs, chunksize=1))
+        elapsed = time.perf_counter() - start
+
+    return jobs / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rounds', type=int, nargs='+', default=[10, 11, 12, 13])
+    parser.add_argument('--seconds', type=float, default=3)
+    parser.add_argument('--processes', type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    print(f"{'rounds':>6}  {'1 core/s':>9}  {'pool/s':>9}  {'pool/core/s':>11}  "
+          f"{'ms/hash':>8}")
+
+    for rounds in args.rounds:
+        single = single_core_rate(rounds, args.seconds)
+        pooled = pool_rate(rounds, args.seconds, args.processes)
+        print(f"{rounds:>6}  {single:>9.1f}  {pooled:>9.1f}  "
+              f"{pooled / args.processes:>11.1f}  {1000 / single:>8.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,270 @@
+"""Benchmark: latency and SQL statements per request for each route.
+
+Seeds a generated dataset of the given size into DATABASE_URL (default
+postgresql:///warbler-bench, which is dropped and recreated), then drives
+every route through the Flask test client as a logged-in user and records
+p50/p95/p99 latency and statements per request. Run from the repo root:
+
+    python -m bench.bench_routes --users 2000 --messages 20000 \\
+        --follows 50000 --likes 30000 --requests 200 --out before.json
+
+    python -m bench.bench_routes --reuse --out after.json --baseline before.json
+
+--reuse skips seeding and benchmarks the data already in the database.
+Results are written as JSON (with the git commit they were taken at) so runs
+can be compared; --baseline prints the change against an earlier file.
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+# Set up the app for benchmarking before it is imported. Hashing cost is
+# benchmarked separately (bench_bcrypt), so keep it cheap here.
+os.environ.setdefault('DATABASE_URL', 'postgresql:///warbler-bench')
+os.environ.setdefault('BCRYPT_LOG_ROUNDS', '4')
+
+from app import create_app, CURR_USER_KEY  # noqa: E402
+from instrumentation import count_queries  # noqa: E402
+from models import db, User, Message  # noqa: E402
+from generator.helpers import WORDS  # noqa: E402
+import seed  # noqa: E402
+
+app = create_app('production', WTF_CSRF_ENABLED=False)
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+BENCH_PASSWORD = 'benchmark'
+
+
+def seed_database(args):
+    """Generate CSVs of the requested size and load them with seed.py."""
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        subprocess.run([
+            sys.executable, os.path.join(ROOT, 'generator', 'create_csvs.py'),
+            '--users', str(args.users),
+            '--messages', str(args.messages),
+            '--follows', str(args.follows),
+            '--likes', str(args.likes),
+            '--seed', str(args.seed),
+            '--out-dir', data_dir,
+        ], check=True)
+
+        seed.seed(data_dir, batch_size=10000, resume=False)
+
+
+def prepare():
+    """Pick the benchmark viewer and create a user for the login route.
+
+    The viewer is whoever follows the most users, so the home timeline is as
+    busy as the dataset allows.
+    """
+
+    with app.app_context():
+        viewer = User.query.order_by(User.following_count.desc(), User.id).first()
+
+        login_user = User.query.filter_by(username='benchlogin').first()
+        if login_user is None:
+            login_user = User.signup('benchlogin', 'benchlogin@example.com',
+                                     BENCH_PASSWORD, None)
+            db.session.commit()
+
+        return {
+            'viewer_id': viewer.id,
+            'max_user_id': db.session.query(db.func.max(User.id)).scalar(),
+            'max_message_id': db.session.query(db.func.max(Message.id)).scalar(),
+        }
+
+
+def scenarios(context, rng):
+    """(name, method, make request kwargs) for each benchmarked route."""
+
+    def any_user():
+        return rng.randint(1, context['max_user_id'])
+
+    def any_message():
+        return rng.randint(1, context['max_message_id'])
+
+    def signup():
+        username = f"bench{rng.getrandbits(48):x}"
+        return {'path': '/signup',
+                'data': {'username': username,
+                         'email': f'{username}@example.com',
+                         'password': BENCH_PASSWORD},
+                'logged_in': False}
+
+    return [
+        ('homepage', 'GET', lambda: {'path': '/'}),
+        ('list_users', 'GET', lambda: {'path': '/users'}),
+        ('list_users_search', 'GET',
+         lambda: {'path': '/users', 'query_string': {'q': rng.choice(WORDS)}}),
+        ('users_show', 'GET', lambda: {'path': f'/users/{any_user()}'}),
+        ('users_followers', 'GET',
+         lambda: {'path': f'/users/{any_user()}/followers'}),
+        ('show_following', 'GET',
+         lambda: {'path': f'/users/{any_user()}/following'}),
+        ('show_likes', 'GET', lambda: {'path': f'/users/{any_user()}/likes'}),
+        ('messages_show', 'GET', lambda: {'path': f'/messages/{any_message()}'}),
+        ('search_messages', 'GET',
+         lambda: {'path': '/search',
+                  'query_string': {'kind': 'messages', 'q': rng.choice(WORDS)}}),
+        ('messages_add', 'POST',
+         lambda: {'path': '/messages/new',
+                  'data': {'text': ' '.join(rng.choices(WORDS, k=8))}}),
+        ('add_like', 'POST',
+         lambda: {'path': f'/messages/{any_message()}/like'}),
+        ('login', 'POST',
+         lambda: {'path': '/login',
+                  'data': {'username': 'benchlogin', 'password': BENCH_PASSWORD},
+                  'logged_in': False}),
+        ('signup', 'POST', signup),
+    ]
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+
+    index = max(0, min(len(sorted_values) - 1,
+                       round(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def run_route(make_request, method, context, requests, warmup):
+    """Time `requests` calls of one route; return its summary stats."""
+
+    latencies = []
+    statements = []
+    errors = 0
+
+    for number in range(warmup + requests):
+        kwargs = make_request()
+        logged_in = kwargs.pop('logged_in', True)
+
+        # a fresh client per request, so every request starts with just the
+        # session cookie, like a returning browser
+        client = app.test_client()
+        if logged_in:
+            with client.session_transaction() as session:
+                session[CURR_USER_KEY] = context['viewer_id']
+
+        with count_queries() as stats:
+            start = time.perf_counter()
+            response = client.open(method=method, **kwargs)
+            elapsed = time.perf_counter() - start
+
+        if number < warmup:
+            continue
+
+        # the like route answers 403 for the viewer's own messages, which
+        # is still a full request
+        if response.status_code >= 400 and response.status_code != 403:
+            errors += 1
+
+        latencies.append(elapsed * 1000)
+        statements.append(stats.count)
+
+    latencies.sort()
+
+    return {
+        'requests': requests,
+        'errors': errors,
+        'p50_ms': round(percentile(latencies, 50), 3),
+        'p95_ms': round(percentile(latencies, 95), 3),
+        'p99_ms': round(percentile(latencies, 99), 3),
+        'mean_ms': round(statistics.fmean(latencies), 3),
+        'statements_mean': round(statistics.fmean(statements), 2),
+        'statements_max': max(statements),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'],
+                              cwd=ROOT, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(results, baseline=None):
+    print(f"{'route':<20} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+          f"{'stmts':>6} {'errors':>6}" + ("  p95 vs base  stmts vs base"
+                                           if baseline else ""))
+
+    for name, stats in results['routes'].items():
+        line = (f"{name:<20} {stats['p50_ms']:>8.2f} {stats['p95_ms']:>8.2f} "
+                f"{stats['p99_ms']:>8.2f} {stats['statements_mean']:>6.1f} "
+                f"{stats['errors']:>6}")
+
+        old = baseline['routes'].get(name) if baseline else None
+        if old:
+            p95_change = (stats['p95_ms'] / old['p95_ms'] - 1) * 100
+            line += (f"  {p95_change:>+10.1f}%  "
+                     f"{stats['statements_mean'] - old['statements_mean']:>+12.1f}")
+
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--messages', type=int, default=10000)
+    parser.add_argument('--follows', type=int, default=20000)
+    parser.add_argument('--likes', type=int, default=20000)
+    parser.add_argument('--seed', default='warbler')
+    parser.add_argument('--reuse', action='store_true',
+                        help="benchmark the data already in the database")
+    parser.add_argument('--requests', type=int, default=100,
+                        help="timed requests per route")
+    parser.add_argument('--warmup', type=int, default=5)
+    parser.add_argument('--routes', nargs='+', help="only these routes")
+    parser.add_argument('--out', default='bench-routes.json')
+    parser.add_argument('--baseline', help="earlier results to compare with")
+    args = parser.parse_args()
+
+    if not args.reuse:
+        seed_database(args)
+
+    context = prepare()
+    rng = random.Random(args.seed)
+
+    results = {
+        'commit': git_commit(),
+        'taken_at': datetime.now(timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'database': db.engine.dialect.name,
+        'dataset': None if args.reuse else {
+            'users': args.users, 'messages': args.messages,
+            'follows': args.follows, 'likes': args.likes, 'seed': args.seed},
+        'routes': {},
+    }
+
+    for name, method, make_request in scenarios(context, rng):
+        if args.routes and name not in args.routes:
+            continue
+        print(f"benchmarking {name}", file=sys.stderr, flush=True)
+        results['routes'][name] = run_route(make_request, method, context,
+                                            args.requests, args.warmup)
+
+    with open(args.out, 'w') as out:
+        json.dump(results, out, indent=2)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as source:
+            baseline = json.load(source)
+
+    print_results(results, baseline)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,197 @@
+"""Benchmark: throughput and tail latency of sync vs gevent gunicorn workers.
+
+Starts gunicorn with gunicorn.conf.py once per worker class, with the same
+number of workers on the same machine, and drives it over HTTP from
+--clients concurrent logged-in clients for --seconds, each request a random
+read route (or --routes). Records requests per second, p50/p95/p99 latency
+and errors per worker class. Seed the database first (bench_routes does it),
+then run from the repo root:
+
+    python -m bench.bench_routes --routes homepage
+    python -m bench.bench_serving --workers 2 --clients 64 --out serving.json
+
+Needs gunicorn, and gevent with psycogreen for the gevent run.
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from bench.bench_routes import (ROOT, app, git_commit, percentile, prepare,
+                                scenarios)
+from app import CURR_USER_KEY
+from models import db
+
+# read routes only, so every run sees the same data
+DEFAULT_ROUTES = ['homepage', 'list_users', 'users_show', 'users_followers',
+                  'show_following', 'show_likes', 'messages_show']
+
+
+def session_cookie(viewer_id):
+    """A signed session cookie logging in as `viewer_id`."""
+
+    serializer = app.session_interface.get_signing_serializer(app)
+    return f"{app.session_cookie_name}={serializer.dumps({CURR_USER_KEY: viewer_id})}"
+
+
+def start_server(worker_class, args):
+    env = dict(os.environ,
+               WORKER_CLASS=worker_class,
+               WEB_CONCURRENCY=str(args.workers),
+               WORKER_CONNECTIONS=str(args.worker_connections),
+               BIND=f"127.0.0.1:{args.port}")
+
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'app:app'],
+        cwd=ROOT, env=env)
+
+    # wait until it answers
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{args.port}/login", timeout=1)
+            return server
+        except (OSError, urllib.error.URLError):
+            time.sleep(0.2)
+
+    server.terminate()
+    raise RuntimeError(f"gunicorn ({worker_class}) didn't start")
+
+
+def stop_server(server):
+    server.terminate()
+    try:
+        server.wait(10)
+    except subprocess.TimeoutExpired:
+        server.kill()
+
+
+def drive(args, requests, cookie):
+    """Send requests from `args.clients` threads for `args.seconds`; return
+    (latencies in ms, errors, seconds taken)."""
+
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+    stop_at = time.monotonic() + args.seconds
+
+    def client(number):
+        nonlocal errors
+        rng = random.Random(f"{args.seed}-{number}")
+        mine = []
+        failed = 0
+
+        while time.monotonic() < stop_at:
+            request = urllib.request.Request(
+                f"http://127.0.0.1:{args.port}{rng.choice(requests)()}",
+                headers={'Cookie': cookie})
+            start = time.perf_counter()
+            try:
+                with urllib.request.urlopen(request, timeout=args.timeout) as response:
+                    response.read()
+            except (OSError, urllib.error.URLError):
+                failed += 1
+                continue
+            mine.append((time.perf_counter() - start) * 1000)
+
+        with lock:
+            latencies.extend(mine)
+            errors += failed
+
+    started = time.monotonic()
+    with ThreadPoolExecutor(args.clients) as pool:
+        list(pool.map(client, range(args.clients)))
+
+    return latencies, errors, time.monotonic() - started
+
+
+def run_mode(worker_class, args, requests, cookie):
+    server = start_server(worker_class, args)
+    try:
+        # warm up each worker's pool, caches and graph
+        warm = argparse.Namespace(**dict(vars(args), seconds=args.warmup))
+        drive(warm, requests, cookie)
+
+        latencies, errors, seconds = drive(args, requests, cookie)
+    finally:
+        stop_server(server)
+
+    latencies.sort()
+
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'requests_per_second': round(len(latencies) / seconds, 1),
+        'p50_ms': round(percentile(latencies, 50), 3),
+        'p95_ms': round(percentile(latencies, 95), 3),
+        'p99_ms': round(percentile(latencies, 99), 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--modes', nargs='+', default=['sync', 'gevent'])
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--worker-connections', type=int, default=100)
+    parser.add_argument('--clients', type=int, default=64,
+                        help="concurrent clients")
+    parser.add_argument('--seconds', type=float, default=30)
+    parser.add_argument('--warmup', type=float, default=5)
+    parser.add_argument('--timeout', type=float, default=30,
+                        help="seconds before a request counts as an error")
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--routes', nargs='+', default=DEFAULT_ROUTES)
+    parser.add_argument('--seed', default='warbler')
+    parser.add_argument('--out', default='bench-serving.json')
+    args = parser.parse_args()
+
+    context = prepare()
+    cookie = session_cookie(context['viewer_id'])
+
+    # a path for each route; query strings aren't needed by the read routes
+    rng = random.Random(args.seed)
+    requests = [lambda make_request=make_request: make_request()['path']
+                for name, method, make_request in scenarios(context, rng)
+                if name in args.routes and method == 'GET']
+
+    results = {
+        'commit': git_commit(),
+        'taken_at': datetime.now(timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'cpus': os.cpu_count(),
+        'database': db.engine.dialect.name,
+        'workers': args.workers,
+        'clients': args.clients,
+        'seconds': args.seconds,
+        'routes': args.routes,
+        'modes': {},
+    }
+
+    for worker_class in args.modes:
+        print(f"benchmarking {worker_class} workers", file=sys.stderr, flush=True)
+        results['modes'][worker_class] = run_mode(worker_class, args,
+                                                  requests, cookie)
+
+    with open(args.out, 'w') as out:
+        json.dump(results, out, indent=2)
+
+    print(f"{'workers':<10} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} "
+          f"{'p99 ms':>8} {'errors':>6}")
+    for worker_class, stats in results['modes'].items():
+        print(f"{worker_class:<10} {stats['requests_per_second']:>8.1f} "
+              f"{stats['p50_ms']:>8.2f} {stats['p95_ms']:>8.2f} "
+              f"{stats['p99_ms']:>8.2f} {stats['errors']:>6}")
+
+
+if __name__ == '__main__':
+    main()
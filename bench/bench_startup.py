@@ -0,0 +1,134 @@
+"""Benchmark: cold start of a worker, from a fresh interpreter.
+
+Each run is a new Python process that imports app, calls create_app() and
+serves its first requests through the test client, timing each stage:
+
+- import: `import app` (models, views and what they import)
+- create_app: configuring the app and its extensions
+- first_request: GET /login, which renders a template but needs no data
+- first_page: GET / logged out, the first page that queries the database
+
+Runs every profile asked for --runs times against DATABASE_URL (default
+postgresql:///warbler-bench) and reports the median and worst of each
+stage, plus the modules each profile imports. Run from the repo root:
+
+    python -m bench.bench_startup --runs 10 --out startup.json
+    python -m bench.bench_startup --budget 1.5
+
+With --budget, exits non-zero if a profile's median import + create_app +
+first request takes longer than that many seconds.
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+from datetime import datetime, timezone
+
+from bench.bench_routes import ROOT, git_commit
+
+STAGES = ['import', 'create_app', 'first_request', 'first_page']
+
+# run in the fresh interpreter; prints one JSON line
+PROBE = '''
+import json, sys, time
+
+started = time.perf_counter()
+import app as module
+imported = time.perf_counter()
+app = module.create_app(sys.argv[1], TRENDING_REFRESH=0,
+                        FOLLOW_GRAPH_ENABLED=False)
+created = time.perf_counter()
+client = app.test_client()
+statuses = [client.get('/login').status_code]
+first_request = time.perf_counter()
+statuses.append(client.get('/').status_code)
+first_page = time.perf_counter()
+
+print(json.dumps({
+    'import': imported - started,
+    'create_app': created - imported,
+    'first_request': first_request - created,
+    'first_page': first_page - first_request,
+    'statuses': statuses,
+    'modules': len(sys.modules),
+    'debug_toolbar': 'flask_debugtoolbar' in sys.modules,
+}))
+'''
+
+
+def probe(profile, env):
+    result = subprocess.run([sys.executable, '-c', PROBE, profile],
+                            cwd=ROOT, env=env, capture_output=True,
+                            text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def run_profile(profile, runs, env):
+    samples = [probe(profile, env) for _ in range(runs)]
+    report = {}
+
+    for stage in STAGES:
+        seconds = sorted(sample[stage] for sample in samples)
+        report[stage] = {'median_ms': round(statistics.median(seconds) * 1000, 1),
+                         'max_ms': round(seconds[-1] * 1000, 1)}
+
+    report['cold_start_ms'] = round(statistics.median(
+        sample['import'] + sample['create_app'] + sample['first_request']
+        for sample in samples) * 1000, 1)
+    report['modules'] = samples[-1]['modules']
+    report['debug_toolbar'] = samples[-1]['debug_toolbar']
+    report['statuses'] = samples[-1]['statuses']
+
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--profiles', nargs='+',
+                        default=['production', 'development'])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--budget', type=float,
+                        help="most seconds a profile's median cold start may take")
+    parser.add_argument('--out', default='bench-startup.json')
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    env.setdefault('DATABASE_URL', 'postgresql:///warbler-bench')
+
+    results = {
+        'commit': git_commit(),
+        'taken_at': datetime.now(timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'runs': args.runs,
+        'profiles': {},
+    }
+
+    for profile in args.profiles:
+        print(f"starting {profile} x{args.runs}", file=sys.stderr, flush=True)
+        results['profiles'][profile] = run_profile(profile, args.runs, env)
+
+    with open(args.out, 'w') as out:
+        json.dump(results, out, indent=2)
+
+    print(f"{'profile':<12} " + ' '.join(f"{stage:>14}" for stage in STAGES)
+          + f" {'cold start':>11} {'modules':>8}")
+    over = []
+    for profile, report in results['profiles'].items():
+        print(f"{profile:<12} "
+              + ' '.join(f"{report[stage]['median_ms']:>11.1f} ms"
+                         for stage in STAGES)
+              + f" {report['cold_start_ms']:>8.1f} ms {report['modules']:>8}")
+        if args.budget and report['cold_start_ms'] > args.budget * 1000:
+            over.append(profile)
+
+    if over:
+        print(f"over the {args.budget}s cold start budget: {', '.join(over)}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
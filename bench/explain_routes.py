@@ -0,0 +1,155 @@
+"""Check with EXPLAIN that every read route's queries are served by indexes.
+
+Seeds the benchmark database the same way as bench_routes (by default with
+over a million messages, follows and likes), requests each GET route once
+as the benchmark viewer, captures every SELECT it runs along with its
+parameters and has PostgreSQL EXPLAIN them. A sequential scan of one of
+HOT_TABLES fails the check; small tables may be scanned. Run from the repo
+root:
+
+    python -m bench.explain_routes
+    python -m bench.explain_routes --reuse --routes users_show show_likes
+
+Exits non-zero if any query scans a hot table.
+"""
+
+import argparse
+import random
+import sys
+
+from sqlalchemy import event, text
+
+from bench.bench_routes import app, prepare, scenarios, seed_database
+from app import CURR_USER_KEY
+from models import db
+import trending
+
+# tables big enough that a sequential scan on a request path is a bug
+HOT_TABLES = {'messages', 'follows', 'likes', 'timeline_entries'}
+
+
+def capture_selects(run):
+    """Call `run()`; return the (statement, parameters) of its SELECTs."""
+
+    captured = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context,
+                              executemany):
+        if statement.lstrip().upper().startswith('SELECT'):
+            captured.append((statement, parameters))
+
+    event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        run()
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+
+    return captured
+
+
+def scans(plan):
+    """Yield (node type, relation, index) for every scan in a plan tree."""
+
+    if plan['Node Type'].endswith('Scan'):
+        yield plan['Node Type'], plan.get('Relation Name'), plan.get('Index Name')
+
+    for child in plan.get('Plans', []):
+        yield from scans(child)
+
+
+def explain(statement, parameters):
+    connection = db.engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        cursor.execute('EXPLAIN (FORMAT JSON) ' + statement, parameters)
+        return cursor.fetchone()[0][0]['Plan']
+    finally:
+        connection.close()
+
+
+def route_runs(context, rng):
+    """(name, callable) for each read route, plus the trending refresh."""
+
+    def request(make_request):
+        def run():
+            client = app.test_client()
+            with client.session_transaction() as session:
+                session[CURR_USER_KEY] = context['viewer_id']
+            response = client.get(**make_request())
+            if response.status_code >= 400:
+                print(f"  answered {response.status_code}", file=sys.stderr)
+        return run
+
+    runs = [(name, request(make_request))
+            for name, method, make_request in scenarios(context, rng)
+            if method == 'GET']
+
+    def refresh_trending():
+        with app.app_context():
+            trending.compute_app(app, db.engine)
+            trending.refresh(db.engine)
+
+    runs.append(('trending_refresh', refresh_trending))
+
+    return runs
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=50000)
+    parser.add_argument('--messages', type=int, default=1000000)
+    parser.add_argument('--follows', type=int, default=1000000)
+    parser.add_argument('--likes', type=int, default=1000000)
+    parser.add_argument('--seed', default='warbler')
+    parser.add_argument('--reuse', action='store_true',
+                        help="check the data already in the database")
+    parser.add_argument('--routes', nargs='+', help="only these routes")
+    parser.add_argument('--verbose', action='store_true',
+                        help="print every statement, not just failures")
+    args = parser.parse_args()
+
+    if db.engine.dialect.name != 'postgresql':
+        parser.error("EXPLAIN plans are only checked on PostgreSQL")
+
+    if not args.reuse:
+        seed_database(args)
+
+    with app.app_context():
+        db.session.execute(text('ANALYZE'))
+        db.session.commit()
+
+    context = prepare()
+    rng = random.Random(args.seed)
+    failures = 0
+
+    for name, run in route_runs(context, rng):
+        if args.routes and name not in args.routes:
+            continue
+
+        statements = capture_selects(run)
+        bad = 0
+
+        for statement, parameters in statements:
+            found = list(scans(explain(statement, parameters)))
+            seq_scans = [relation for node, relation, _ in found
+                         if node == 'Seq Scan' and relation in HOT_TABLES]
+            bad += bool(seq_scans)
+
+            if seq_scans or args.verbose:
+                print(f"  {'SEQ SCAN of ' + ', '.join(seq_scans) if seq_scans else 'ok'}:"
+                      f" {' '.join(statement.split())[:160]}")
+                for node, relation, index in found:
+                    print(f"      {node} on {relation}"
+                          + (f" using {index}" if index else ""))
+
+        failures += bad
+        print(f"{name:<20} {len(statements):>3} selects  "
+              f"{'FAIL' if bad else 'ok'}", flush=True)
+
+    if failures:
+        print(f"{failures} queries scan a hot table sequentially")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+"""HTTP caching policy.
+
+Cache-Control is set per endpoint from CACHE_RULES after each request.
+Anything not listed stays `no-store`, since most pages mix in per-user and
+flashed content.
+
+The message page and user profiles are `private, no-cache`: browsers keep
+them but revalidate every time. Their views call `check_etag(...)` with the
+values the page is built from (row versions, counters, the viewer's own
+state) before rendering anything; a matching If-None-Match is answered with
+a 304, so a revisit costs a few indexed queries instead of a render. The
+ETag also covers the asset build, so pages linking fingerprinted files from
+before a deploy are rendered again.
+
+Static files get `public, max-age=STATIC_MAX_AGE` from Flask's
+SEND_FILE_MAX_AGE_DEFAULT, along with its own ETag/Last-Modified handling;
+built /assets/ files and uploaded /media/ pictures set their own (see
+assets.py and media.py).
+"""
+
+import hashlib
+
+from flask import current_app, g, request, session
+
+import assets
+
+CACHE_RULES = {
+    'messages_show': 'private, no-cache',
+    'users_show': 'private, no-cache',
+}
+
+DEFAULT_RULE = 'no-store'
+
+
+def check_etag(*parts):
+    """Set this response's ETag from `parts`; 304 if the client has it.
+
+    `parts` must cover everything the page shows besides the logged-in
+    user, who is added here. Returns the 304 response to send, or None to
+    carry on rendering. Pages with flashed messages pending are one-offs, so
+    they get no ETag.
+    """
+
+    if session.get('_flashes'):
+        return None
+
+    viewer = (g.user.id, g.user.updated_at) if g.user else None
+    key = repr((current_app.config['CACHE_VERSION'], assets.version(),
+                request.endpoint, viewer) + parts)
+    g._etag = hashlib.sha1(key.encode('UTF-8')).hexdigest()
+
+    if request.if_none_match.contains(g._etag):
+        return current_app.response_class(status=304)
+
+    return None
+
+
+def apply_policy(response):
+    """after_request hook: Cache-Control by endpoint, plus any ETag."""
+
+    if request.endpoint in ('static', 'assets', 'media'):
+        return response
+
+    response.headers['Cache-Control'] = CACHE_RULES.get(request.endpoint,
+                                                        DEFAULT_RULE)
+
+    etag = g.pop('_etag', None)
+    if etag is not None and response.status_code in (200, 304):
+        response.set_etag(etag)
+        # the same URL is a different page for each session
+        response.vary.add('Cookie')
+
+    return response
+
+
+def init_app(app):
+    app.after_request(apply_policy)
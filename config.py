@@ -0,0 +1,175 @@
+"""Configuration profiles for create_app() (see app.py).
+
+Config holds every setting, read from the environment when this module is
+imported; the profiles below adjust it. create_app() picks one by name
+('development', 'production' or 'testing'), by default from FLASK_ENV.
+"""
+
+import os
+
+import passwords
+
+
+def database_url(url):
+    """`url` with Heroku's postgres:// scheme renamed for SQLAlchemy."""
+
+    return url.replace('postgres://', 'postgresql://') if url else url
+
+
+class Config:
+    """Settings shared by every profile."""
+
+    # Get DB_URI from environ variable (useful for production/testing) or,
+    # if not set there, use development local db.
+    SQLALCHEMY_DATABASE_URI = database_url(
+        os.environ.get('DATABASE_URL', 'postgresql:///warbler'))
+
+    # Optional read replica (see replicas.py): some GET pages read from it,
+    # except for users who wrote something within REPLICA_STICKY_SECONDS
+    REPLICA_DATABASE_URL = database_url(os.environ.get('REPLICA_DATABASE_URL'))
+    REPLICA_STICKY_SECONDS = float(os.environ.get('REPLICA_STICKY_SECONDS', 5))
+
+    # Connection pools, per worker and per database (SQLite doesn't pool):
+    # connections kept open, extra ones allowed under load, seconds a
+    # request waits for one when all are busy, seconds before a connection
+    # is replaced, and whether to test each one before use (sizing: see
+    # gunicorn.conf.py)
+    DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 5))
+    DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 10))
+    DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 30))
+    DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', 1800))
+    DB_POOL_PRE_PING = os.environ.get('DB_POOL_PRE_PING', '1') == '1'
+
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+    SQLALCHEMY_ECHO = False
+    SECRET_KEY = os.environ.get('SECRET_KEY', 'shh')
+    CORS_HEADERS = 'Content-Type'
+
+    # The debug toolbar is only ever imported when this is on
+    DEBUG_TOOLBAR = False
+    DEBUG_TB_INTERCEPT_REDIRECTS = False
+
+    # Home timelines: authors with more followers than this are pulled at
+    # read time rather than fanned out on write; new follows backfill this
+    # many messages.
+    TIMELINE_FANOUT_LIMIT = int(os.environ.get('TIMELINE_FANOUT_LIMIT', 10000))
+    TIMELINE_BACKFILL = int(os.environ.get('TIMELINE_BACKFILL', 100))
+
+    # Password hashing: bcrypt cost for new hashes (older hashes are
+    # upgraded on login), processes in each worker's hashing pool (0 hashes
+    # inline), how many hashes may queue before logins are turned away with
+    # a 503, and seconds a request waits for its hash before the same 503
+    BCRYPT_LOG_ROUNDS = int(os.environ.get('BCRYPT_LOG_ROUNDS', 12))
+    BCRYPT_POOL_SIZE = int(os.environ.get(
+        'BCRYPT_POOL_SIZE', passwords.DEFAULTS['BCRYPT_POOL_SIZE']))
+    BCRYPT_MAX_PENDING = int(os.environ.get('BCRYPT_MAX_PENDING', 32))
+    BCRYPT_TIMEOUT = float(os.environ.get('BCRYPT_TIMEOUT', 10))
+
+    # Seconds a worker may reuse the logged-in user's identity columns
+    # (username, avatar, ...) without querying; 0 disables the cache
+    CURRENT_USER_CACHE_TTL = float(os.environ.get('CURRENT_USER_CACHE_TTL', 10))
+
+    # Rows per page for every paginated list view
+    PAGE_SIZE = int(os.environ.get('PAGE_SIZE', 100))
+
+    # A request running the same parameterized statement more than this
+    # many times is logged as a likely N+1 (see instrumentation.py);
+    # whether responses carry their query count and database time as
+    # headers; and the bearer token /metrics asks for (unset: no one)
+    SQL_REPEAT_LIMIT = int(os.environ.get('SQL_REPEAT_LIMIT', 5))
+    SQL_TIMING_HEADERS = os.environ.get('SQL_TIMING_HEADERS', '0') == '1'
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
+    # HTTP caching (see caching.py): seconds browsers may keep static files,
+    # and a version mixed into every ETag; change it when templates change
+    # so pages cached by an older release aren't revalidated as current
+    SEND_FILE_MAX_AGE_DEFAULT = int(
+        os.environ.get('STATIC_MAX_AGE', 7 * 24 * 60 * 60))
+    CACHE_VERSION = os.environ.get('CACHE_VERSION', '1')
+
+    # Built static files (see assets.py): where `flask build-assets` writes
+    # them, how wide images may be, and whether to hand files to the front
+    # server with X-Sendfile rather than send them from the worker
+    ASSETS_DIR = os.environ.get(
+        'ASSETS_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                   'dist'))
+    ASSETS_MAX_IMAGE_WIDTH = int(os.environ.get('ASSETS_MAX_IMAGE_WIDTH', 1600))
+    USE_X_SENDFILE = os.environ.get('USE_X_SENDFILE', '0') == '1'
+
+    # Uploaded pictures (see media.py): the blob store, where the local one
+    # keeps files (shared by web and worker processes), and the largest
+    # picture taken; bigger request bodies are refused with a 413
+    MEDIA_STORE = os.environ.get('MEDIA_STORE', 'local')
+    MEDIA_ROOT = os.environ.get(
+        'MEDIA_ROOT', os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                   'uploads'))
+    MEDIA_MAX_BYTES = int(os.environ.get('MEDIA_MAX_BYTES', 5 * 2 ** 20))
+    MAX_CONTENT_LENGTH = 2 * MEDIA_MAX_BYTES + 2 ** 20
+
+    # In-memory follow graph (see graph.py): on/off, seconds between
+    # rebuilds (0, the default, builds once per worker; each rebuild rereads
+    # the follows table in every worker, so keep it long), and the most
+    # seconds a build may take before it is abandoned
+    FOLLOW_GRAPH_ENABLED = os.environ.get('FOLLOW_GRAPH_ENABLED', '1') == '1'
+    FOLLOW_GRAPH_REFRESH = float(os.environ.get('FOLLOW_GRAPH_REFRESH', 0))
+    FOLLOW_GRAPH_BUDGET = float(os.environ.get('FOLLOW_GRAPH_BUDGET', 10))
+
+    # Rendered message cards kept per worker (see fragments.py); 0 disables
+    FRAGMENT_CACHE_SIZE = int(os.environ.get('FRAGMENT_CACHE_SIZE', 10000))
+
+    # Trending (see trending.py): seconds for a like's weight to halve, how
+    # far back messages may be to rank, how many to keep, and seconds
+    # between computing the list (job worker) and reloading it (web
+    # workers); 0 disables both threads
+    TRENDING_HALF_LIFE = float(os.environ.get('TRENDING_HALF_LIFE', 6 * 60 * 60))
+    TRENDING_WINDOW = float(os.environ.get('TRENDING_WINDOW', 7 * 24 * 60 * 60))
+    TRENDING_SIZE = int(os.environ.get('TRENDING_SIZE', 50))
+    TRENDING_REFRESH = float(os.environ.get('TRENDING_REFRESH', 30))
+
+    # Likes can be written in batches (see likes.py): at most this many per
+    # transaction, gathered for at most this many seconds. 0 writes each at
+    # once, the default: a sync worker has one request in flight, so it
+    # would only wait for nothing to batch with. gunicorn.conf.py sets 0.01
+    # for gevent workers.
+    LIKE_BATCH_SIZE = int(os.environ.get('LIKE_BATCH_SIZE', 200))
+    LIKE_BATCH_WAIT = float(os.environ.get('LIKE_BATCH_WAIT', 0))
+
+    # Background jobs (see jobs.py): seconds before a silent worker's job is
+    # taken over, tries before a job fails, base seconds between retries
+    # (doubling each time) and seconds an idle worker waits between polls;
+    # and rows removed per batch when purging a deleted account
+    JOB_LEASE = int(os.environ.get('JOB_LEASE', 300))
+    JOB_MAX_ATTEMPTS = int(os.environ.get('JOB_MAX_ATTEMPTS', 5))
+    JOB_RETRY_DELAY = float(os.environ.get('JOB_RETRY_DELAY', 10))
+    JOB_POLL_INTERVAL = float(os.environ.get('JOB_POLL_INTERVAL', 1))
+    PURGE_BATCH_SIZE = int(os.environ.get('PURGE_BATCH_SIZE', 1000))
+
+
+class DevelopmentConfig(Config):
+    """`flask run` on a laptop: the debug toolbar is available."""
+
+    DEBUG_TOOLBAR = True
+    SQL_TIMING_HEADERS = True
+
+
+class ProductionConfig(Config):
+    """Web and worker processes."""
+
+
+class TestingConfig(Config):
+    """The test suite: its own database, no CSRF tokens, no trending
+    refresh thread, and query counts in response headers."""
+
+    TESTING = True
+    SQLALCHEMY_DATABASE_URI = 'postgresql:///warbler-test'
+    REPLICA_DATABASE_URL = None
+    WTF_CSRF_ENABLED = False
+    TRENDING_REFRESH = 0
+    SQL_TIMING_HEADERS = True
+
+
+PROFILES = {
+    'development': DevelopmentConfig,
+    'production': ProductionConfig,
+    'testing': TestingConfig,
+}
@@ -0,0 +1,101 @@
+"""Denormalized engagement counters.
+
+Users carry message_count, following_count, follower_count and liked_count;
+messages carry like_count. The write paths in app.py adjust them with
+atomic `UPDATE ... SET n = n + delta` statements in the same transaction as
+the change itself, so pages can show stats without loading the related rows.
+Batched writers (likes.py) apply many rows' deltas at once with `bump_each`.
+
+`reconcile()` recomputes every counter from the source tables, for use after
+bulk loads or if they ever drift (`flask reconcile-counters`).
+"""
+
+from sqlalchemy import bindparam, func, select
+
+from models import db, Follows, Like, Message, User
+
+
+def _keep_version(model, values):
+    """Stop an UPDATE of `values` from moving the row's updated_at.
+
+    Counters are shown alongside, not part of, the profile version.
+    """
+
+    if hasattr(model, 'updated_at'):
+        values[model.updated_at] = model.updated_at
+
+    return values
+
+
+def bump(model, row_id, **deltas):
+    """Add `deltas` (column name -> amount) to the counters of one row."""
+
+    bump_where(model, model.id == row_id, **deltas)
+
+
+def bump_where(model, criterion, **deltas):
+    """Add `deltas` to the counters of every row matching `criterion`."""
+
+    values = {getattr(model, name): getattr(model, name) + delta
+              for name, delta in deltas.items()}
+
+    (model
+     .query
+     .filter(criterion)
+     .update(_keep_version(model, values), synchronize_session=False))
+
+
+def bump_each(connection, model, deltas):
+    """Add per-row deltas ({row id: {column name: amount}}) on `connection`,
+    as one executemany; for writers outside the request's session.
+
+    Rows are updated in id order, so concurrent batches lock them in the
+    same order and can't deadlock each other.
+    """
+
+    if not deltas:
+        return
+
+    table = model.__table__
+    names = sorted({name for row in deltas.values() for name in row})
+
+    values = {name: table.c[name] + bindparam(f'delta_{name}') for name in names}
+    if 'updated_at' in table.c:
+        values['updated_at'] = table.c.updated_at
+
+    connection.execute(
+        table.update().where(table.c.id == bindparam('row_id')).values(values),
+        [dict({f'delta_{name}': row.get(name, 0) for name in names}, row_id=row_id)
+         for row_id, row in sorted(deltas.items())])
+
+
+def forget_message(message):
+    """Adjust counters for a message that is about to be deleted."""
+
+    bump(User, message.user_id, message_count=-1)
+
+    likers = select(Like.user_id).where(Like.message_id == message.id)
+    bump_where(User, User.id.in_(likers), liked_count=-1)
+
+
+def _count(column, criterion):
+    return (select(func.count(column))
+            .where(criterion)
+            .scalar_subquery())
+
+
+def reconcile():
+    """Recompute every counter from the source tables in bulk."""
+
+    User.query.update(_keep_version(User, {
+        User.message_count: _count(Message.id, Message.user_id == User.id),
+        User.following_count: _count(Follows.user_being_followed_id,
+                                     Follows.user_following_id == User.id),
+        User.follower_count: _count(Follows.user_following_id,
+                                    Follows.user_being_followed_id == User.id),
+        User.liked_count: _count(Like.message_id, Like.user_id == User.id),
+    }), synchronize_session=False)
+
+    Message.query.update({
+        Message.like_count: _count(Like.user_id, Like.message_id == Message.id),
+    }, synchronize_session=False)
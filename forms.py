@@ -1,7 +1,11 @@
 from flask_wtf import FlaskForm
+from flask_wtf.file import FileAllowed, FileField
 from wtforms import StringField, PasswordField, TextAreaField
 from wtforms.validators import DataRequired, Email, Length
 
+PICTURE_TYPES = FileAllowed(['jpg', 'jpeg', 'png', 'gif', 'webp'],
+                            "Pictures must be JPEG, PNG, GIF or WebP images.")
+
 
 class MessageForm(FlaskForm):
     """Form for adding/editing messages."""
@@ -16,12 +20,15 @@ class UserAddForm(FlaskForm):
     email = StringField('E-mail', validators=[DataRequired(), Email()])
     password = PasswordField('Password', validators=[Length(min=6)])
     image_url = StringField('(Optional) Image URL')
+    image_file = FileField('(Optional) Upload an image', validators=[PICTURE_TYPES])
 
 class EditUserForm(UserAddForm):
     """Form for editing users."""
 
     bio = StringField('Bio')
     header_image_url = StringField('(Optional) Background Image URL')
+    header_image_file = FileField('(Optional) Upload a background image',
+                                  validators=[PICTURE_TYPES])
 
 
 class LoginForm(FlaskForm):
@@ -0,0 +1,87 @@
+"""Cache of rendered message cards.
+
+Every message list (home, profiles, likes, search) shows each message as
+the same card: author avatar and username, date and text. `message_card`
+renders it from templates/messages/card.html once and then serves the HTML
+from a per-worker LRU of FRAGMENT_CACHE_SIZE entries (0 disables it).
+
+Cards are keyed by message id and the author's updated_at, so a profile
+change is never served stale, even by another worker. Nothing per-viewer
+goes in a card: the like star is drawn around it by the list template.
+Views still call `forget_message` / `forget_author` when messages, profiles
+or accounts change, to drop entries that can no longer be hit.
+
+Hit and miss counts are reported in /metrics.
+"""
+
+import threading
+from collections import OrderedDict
+
+from flask import current_app
+from markupsafe import Markup
+
+import instrumentation
+
+CARD_TEMPLATE = 'messages/card.html'
+
+_cards = OrderedDict()
+_lock = threading.Lock()
+_stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+
+def message_card(message):
+    """The card HTML for `message` (Jinja global)."""
+
+    size = current_app.config['FRAGMENT_CACHE_SIZE']
+    key = (message.id, message.user_id, message.user.updated_at)
+
+    with _lock:
+        html = _cards.get(key)
+        if html is not None:
+            _cards.move_to_end(key)
+            _stats['hits'] += 1
+            return html
+        _stats['misses'] += 1
+
+    template = current_app.jinja_env.get_template(CARD_TEMPLATE)
+    html = Markup(template.render(message=message))
+
+    if size > 0:
+        with _lock:
+            _cards[key] = html
+            while len(_cards) > size:
+                _cards.popitem(last=False)
+                _stats['evictions'] += 1
+
+    return html
+
+
+def _forget(matches):
+    with _lock:
+        for key in [key for key in _cards if matches(key)]:
+            del _cards[key]
+
+
+def forget_message(message_id):
+    """Drop the card of a deleted message."""
+
+    _forget(lambda key: key[0] == message_id)
+
+
+def forget_author(user_id):
+    """Drop every card by `user_id` (profile edited or account deleted)."""
+
+    _forget(lambda key: key[1] == user_id)
+
+
+def stats():
+    with _lock:
+        lookups = _stats['hits'] + _stats['misses']
+        return dict(_stats,
+                    entries=len(_cards),
+                    hit_rate=round(_stats['hits'] / lookups, 4) if lookups else None)
+
+
+def init_app(app):
+    app.jinja_env.globals['message_card'] = message_card
+    instrumentation.register_metrics('fragments', stats)
@@ -2,29 +2,62 @@
 
 Students won't need to run this for the exercise; they will just use the CSV
 files that this generates. You should only need to run this if you wanted to
-tweak the CSV formats or generate fewer/more rows.
+tweak the CSV formats or generate fewer/more rows, e.g. for load testing:
+
+    python generator/create_csvs.py --users 1000000 --messages 10000000 \\
+        --follows 20000000 --likes 30000000 --workers 8 --out-dir data/big
+
+and then `python seed.py --data-dir data/big`.
+
+Everything is generated offline from --seed, so the same arguments always
+give the same files, whatever --workers is. Rows are produced in chunks by
+worker processes and streamed into the output files, so memory stays flat
+however many rows are asked for.
+
+Follower counts, posting rates and likes per message follow Zipf (power law)
+distributions with exponent --zipf: a few accounts get most followers, a few
+users post most warbles and a few warbles get most likes. Follow and like
+pairs are sampled per chunk of followers/likers and de-duplicated within the
+chunk, without ever building the list of all possible pairs. A message's
+author is a function of its id, so like chunks can leave out users liking
+their own messages just as follow chunks leave out users following
+themselves.
 """
 
+import argparse
 import csv
-from random import choice, randint, sample
-from itertools import permutations
-import requests
-from faker import Faker
-from helpers import get_random_datetime
+import os
+import random
+import shutil
+import sys
+import tempfile
+from datetime import datetime, timedelta
+from multiprocessing import Pool
+
+from helpers import CITIES, WORDS, paragraph, scatter, scatter_stride, sentence, zipf_rank
 
 MAX_WARBLER_LENGTH = 140
 
 USERS_CSV_HEADERS = ['email', 'username', 'image_url', 'password', 'bio', 'header_image_url', 'location']
 MESSAGES_CSV_HEADERS = ['text', 'timestamp', 'user_id']
 FOLLOWS_CSV_HEADERS = ['user_being_followed_id', 'user_following_id']
+LIKES_CSV_HEADERS = ['user_id', 'message_id']
 
 NUM_USERS = 300
 NUM_MESSAGES = 1000
 NUM_FOLLWERS = 5000
+NUM_LIKES = 3000
+
+# rows (or, for follows and likes, followers/likers) per worker task
+CHUNK_SIZE = 10000
+
+# messages are spread over this many days before --now
+HISTORY_DAYS = 2 * 365
 
-fake = Faker()
+# bcrypt hash of "password"
+PASSWORD_HASH = '$2b$12$Q1PUFjhN/AWRQ21LbGYvjeLpZZB6lfZ1BPwifHALGO6oIbyC3CmJe'
 
-# Generate random profile image URLs to use for users
+# Random profile image URLs to use for users (hotlinked, never fetched here)
 
 image_urls = [
     f"https://randomuser.me/api/portraits/{kind}/{i}.jpg"
@@ -32,46 +65,184 @@ image_urls = [
     for i in range(count)
 ]
 
-# Generate random header image URLs to use for users
+header_image_urls = ["/static/images/warbler-hero.jpg"]
+
+
+def users_rows(rng, start, end, count, settings):
+    for user_id in range(start + 1, end + 1):
+        username = f"{rng.choice(WORDS)}{rng.choice(WORDS)}{user_id}"
+        yield [
+            f"{username}@example.com",
+            username,
+            rng.choice(image_urls),
+            PASSWORD_HASH,
+            sentence(rng),
+            rng.choice(header_image_urls),
+            rng.choice(CITIES),
+        ]
+
+
+def message_author(message_id, settings, stride):
+    """The user who posts `message_id`: the same in every chunk and process."""
+
+    users = settings['users']
+    rng = random.Random(f"{settings['seed']}:author:{message_id}")
+
+    return scatter(zipf_rank(rng, users, settings['zipf']), users, stride)
+
+
+def messages_rows(rng, start, end, count, settings):
+    stride = scatter_stride(settings['users'])
+    now = settings['now']
+
+    for message_id in range(start + 1, end + 1):
+        posted = now - timedelta(seconds=rng.uniform(0, HISTORY_DAYS * 86400))
+        yield [
+            paragraph(rng, MAX_WARBLER_LENGTH),
+            str(posted),
+            message_author(message_id, settings, stride),
+        ]
+
+
+def sample_pairs(rng, start, end, count, targets, owner):
+    """`count` distinct (target, source) pairs with sources in [start, end).
+
+    Sources are uniform; targets come from `targets()`. A pair whose source
+    is `owner(target)` is skipped. Gives up after a bounded number of
+    attempts if the chunk is nearly saturated.
+    """
+
+    seen = set()
+    attempts = 0
+
+    while len(seen) < count and attempts < count * 20:
+        attempts += 1
+        source = rng.randrange(start, end) + 1
+        target = targets()
+        if source == owner(target):
+            continue
+        pair = (target, source)
+        if pair not in seen:
+            seen.add(pair)
+            yield pair
+
+
+def follows_rows(rng, start, end, count, settings):
+    users = settings['users']
+    stride = scatter_stride(users)
+
+    def followed():
+        return scatter(zipf_rank(rng, users, settings['zipf']), users, stride)
+
+    # nobody follows themselves
+    for followed_user, follower in sample_pairs(rng, start, end, count,
+                                                followed, lambda user: user):
+        yield [followed_user, follower]
+
+
+def likes_rows(rng, start, end, count, settings):
+    messages = settings['messages']
+    stride = scatter_stride(messages)
+    author_stride = scatter_stride(settings['users'])
+
+    def liked():
+        return scatter(zipf_rank(rng, messages, settings['zipf']), messages, stride)
+
+    def author(message_id):
+        return message_author(message_id, settings, author_stride)
+
+    # nobody likes their own messages
+    for message_id, user_id in sample_pairs(rng, start, end, count,
+                                            liked, author):
+        yield [user_id, message_id]
+
+
+KINDS = {
+    'users': (USERS_CSV_HEADERS, users_rows),
+    'messages': (MESSAGES_CSV_HEADERS, messages_rows),
+    'follows': (FOLLOWS_CSV_HEADERS, follows_rows),
+    'likes': (LIKES_CSV_HEADERS, likes_rows),
+}
+
+
+def write_chunk(task):
+    """Write one chunk of rows to its own part file and return the path."""
+
+    kind, index, start, end, count, settings, path = task
+    rng = random.Random(f"{settings['seed']}:{kind}:{index}")
+    _, rows = KINDS[kind]
+
+    with open(path, 'w', newline='') as part:
+        csv.writer(part).writerows(rows(rng, start, end, count, settings))
+
+    return path
+
+
+def chunk_tasks(kind, total, key_range, settings, tmp_dir):
+    """Split `total` rows of `kind` into tasks over chunks of `key_range`.
+
+    Users and messages are chunked by their own ids; follows and likes by
+    follower/liker id, each chunk getting its share of `total`.
+    """
+
+    for index, start in enumerate(range(0, key_range, CHUNK_SIZE)):
+        end = min(start + CHUNK_SIZE, key_range)
+        count = total * end // key_range - total * start // key_range
+        path = os.path.join(tmp_dir, f"{kind}-{index:06d}.csv")
+        yield (kind, index, start, end, count, settings, path)
+
+
+def generate(kind, total, key_range, settings, out_dir, pool):
+    headers, _ = KINDS[kind]
+    out_path = os.path.join(out_dir, f"{kind}.csv")
+
+    with tempfile.TemporaryDirectory(dir=out_dir) as tmp_dir, \
+            open(out_path, 'w', newline='') as out:
+        csv.writer(out).writerow(headers)
+
+        tasks = chunk_tasks(kind, total, key_range, settings, tmp_dir)
+        for done, path in enumerate(pool.imap(write_chunk, tasks), start=1):
+            with open(path, newline='') as part:
+                shutil.copyfileobj(part, out)
+            os.remove(path)
+            print(f"{kind}: {done} chunks", file=sys.stderr, flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate Warbler CSV data.")
+    parser.add_argument('--users', type=int, default=NUM_USERS)
+    parser.add_argument('--messages', type=int, default=NUM_MESSAGES)
+    parser.add_argument('--follows', type=int, default=NUM_FOLLWERS)
+    parser.add_argument('--likes', type=int, default=NUM_LIKES)
+    parser.add_argument('--zipf', type=float, default=1.2,
+                        help="power law exponent (not 1); higher is more skewed")
+    parser.add_argument('--seed', default='warbler')
+    parser.add_argument('--now', type=datetime.fromisoformat,
+                        default=datetime(2021, 8, 1),
+                        help="latest message timestamp (ISO date)")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--out-dir', default='generator')
+    args = parser.parse_args()
+
+    if args.zipf == 1:
+        parser.error("--zipf must not be exactly 1")
+
+    settings = {
+        'users': args.users,
+        'messages': args.messages,
+        'zipf': args.zipf,
+        'seed': args.seed,
+        'now': args.now,
+    }
+
+    os.makedirs(args.out_dir, exist_ok=True)
+
+    with Pool(args.workers) as pool:
+        generate('users', args.users, args.users, settings, args.out_dir, pool)
+        generate('messages', args.messages, args.messages, settings, args.out_dir, pool)
+        generate('follows', args.follows, args.users, settings, args.out_dir, pool)
+        generate('likes', args.likes, args.users, settings, args.out_dir, pool)
 
-header_image_urls = [
-    requests.get(f"http://www.splashbase.co/api/v1/images/{i}").json()['url']
-    for i in range(1, 46)
-]
 
-with open('generator/users.csv', 'w') as users_csv:
-    users_writer = csv.DictWriter(users_csv, fieldnames=USERS_CSV_HEADERS)
-    users_writer.writeheader()
-
-    for i in range(NUM_USERS):
-        users_writer.writerow(dict(
-            email=fake.email(),
-            username=fake.user_name(),
-            image_url=choice(image_urls),
-            password='$2b$12$Q1PUFjhN/AWRQ21LbGYvjeLpZZB6lfZ1BPwifHALGO6oIbyC3CmJe',
-            bio=fake.sentence(),
-            header_image_url=choice(header_image_urls),
-            location=fake.city()
-        ))
-
-with open('generator/messages.csv', 'w') as messages_csv:
-    messages_writer = csv.DictWriter(messages_csv, fieldnames=MESSAGES_CSV_HEADERS)
-    messages_writer.writeheader()
-
-    for i in range(NUM_MESSAGES):
-        messages_writer.writerow(dict(
-            text=fake.paragraph()[:MAX_WARBLER_LENGTH],
-            timestamp=get_random_datetime(),
-            user_id=randint(1, NUM_USERS)
-        ))
-
-# Generate follows.csv from random pairings of users
-
-with open('generator/follows.csv', 'w') as follows_csv:
-    all_pairs = list(permutations(range(1, NUM_USERS + 1), 2))
-
-    users_writer = csv.DictWriter(follows_csv, fieldnames=FOLLOWS_CSV_HEADERS)
-    users_writer.writeheader()
-
-    for followed_user, follower in sample(all_pairs, NUM_FOLLWERS):
-        users_writer.writerow(dict(user_being_followed_id=followed_user, user_following_id=follower))
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,52 @@
 """Support functions for CSV generation."""
 
 from datetime import datetime
+from math import gcd
 from random import uniform
 
+WORDS = """
+    able about above across act add afternoon again age ago agree air all
+    almost alone along already also always among amount animal answer any
+    appear apple area arm around arrive art ask autumn away baby back bad bag
+    ball bank bar base basket beach bean bear beat bed bell below best better
+    big bird bit black blue boat body bone book born both bottom box boy
+    bread break bridge bright bring brother brown build burn busy buy cake
+    call calm camp car card care carry case cat catch cause center chair
+    chance change charge check child city class clean clear climb clock close
+    cloud coast coat cold color come common cook cool corner count country
+    course cover cow crowd cup current cut dance dark day deal deep desk dog
+    door down draw dream dress drink drive drop dry duck dust early earth
+    east easy eat edge egg end enjoy even evening event every face fact fall
+    family far farm fast father feel field fight fill find fine fire fish
+    flat floor flower fly follow food foot forest forget form free fresh
+    friend front fruit full game garden gate gentle gift girl give glad glass
+    go gold good grass great green ground group grow half hand happy hard hat
+    head hear heart heavy help high hill hold home hope horse hot hour house
+    idea island join jump keep key kind king kitchen lake land large late
+    laugh lead leaf learn leave letter life light line lion list listen
+    little live long look lose loud love low lucky main make map market meet
+    milk mind minute moon morning mountain move music name near need nest new
+    night noise north note ocean old open orange other paper park party pass
+    path pen people picture piece place plan plant play point pond pool poor
+    quick quiet rain read ready red remember rest rich ride right river road
+    rock roof room rope round run safe sail salt sand save school sea season
+    seat see send shade shape share ship shoe shop short show side sign
+    silver simple sing sister sit sky sleep slow small smile snow soft song
+    sound south space speak spring square stand star start station stay step
+    stone stop store story street strong summer sun sweet swim table tail
+    talk tall tea teach team tell test thank thing think tiny today together
+    tomorrow top touch town toy train tree trip true turn under until up use
+    valley very visit voice wait walk wall warm wash watch water wave way
+    weather week welcome west wet wheel white wide wild wind window winter
+    wish wood word work world write yard year yellow young
+""".split()
+
+CITIES = """
+    Springfield Riverside Fairview Franklin Greenville Bristol Clinton Salem
+    Madison Georgetown Arlington Ashland Burlington Manchester Oxford Milton
+    Newport Auburn Dayton Lexington Milford Winchester Hudson Kingston
+""".split()
+
 
 def get_random_datetime(year_gap=2):
     """Get a random datetime within the last few years."""
@@ -12,3 +56,52 @@ def get_random_datetime(year_gap=2):
     random_timestamp = uniform(then.timestamp(), now.timestamp())
 
     return datetime.fromtimestamp(random_timestamp)
+
+
+def zipf_rank(rng, n, s):
+    """Draw a rank in [0, n) with P(rank k) roughly proportional to 1/(k+1)**s.
+
+    Inverts the CDF of a continuous power law on [1, n + 1), so it needs
+    no table of weights and costs the same for any `n`. `s` must not be 1.
+    """
+
+    u = rng.random()
+    power = 1 - s
+    x = ((pow(n + 1, power) - 1) * u + 1) ** (1 / power)
+
+    return min(int(x) - 1, n - 1)
+
+
+def scatter_stride(n):
+    """A stride coprime to `n`, for `scatter`."""
+
+    stride = 2654435761 % n or 1
+    while gcd(stride, n) != 1:
+        stride += 1
+
+    return stride
+
+
+def scatter(rank, n, stride):
+    """Map a popularity rank onto an id in [1, n], one-to-one.
+
+    Keeps the most popular rows from all being the lowest ids.
+    """
+
+    # rank n - 1 is the one sent to id 1, so the most popular rank isn't
+    return ((rank + 1) * stride) % n + 1
+
+
+def sentence(rng, min_words=4, max_words=12):
+    """A random capitalised sentence from WORDS."""
+
+    words = rng.choices(WORDS, k=rng.randint(min_words, max_words))
+    return ' '.join(words).capitalize() + '.'
+
+
+def paragraph(rng, max_length):
+    """Random sentences, cut to at most `max_length` characters."""
+
+    text = ' '.join(sentence(rng) for _ in range(rng.randint(1, 4)))
+    return text[:max_length]
+
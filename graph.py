@@ -0,0 +1,368 @@
+"""In-memory index of who follows whom.
+
+Each worker keeps the follows table as two CSR (compressed sparse row)
+adjacency structures, one per direction: a flat array of user ids with,
+for every user, the offset where their sorted list starts. Membership is a
+binary search in one slice and degree is a subtraction, so follow-state
+checks cost microseconds and a few bytes per edge instead of a query or a
+list of User objects.
+
+The index is built once, on a background thread on the first request.
+A build reads the whole follows table (twice, once per direction), so it
+is not repeated by default. FOLLOW_GRAPH_REFRESH rebuilds it every that
+many seconds; if set, it should be long (an hour or more), since every web
+worker rereads the table each time. A build that overruns
+FOLLOW_GRAPH_BUDGET seconds is abandoned and logged. Until a build
+succeeds, every lookup returns None and callers fall back to SQL. Build
+times are reported in /metrics.
+
+The index only answers "does the viewer follow X?", so the changes that
+matter are the viewer's own. `follow` / `unfollow` apply this worker's
+changes at once through a small overlay of added and removed edges. They
+also stamp the session, so from then on that user's lookups go to SQL in
+every worker whose index was read before the change. A follow made from
+another session shows up after the next build.
+"""
+
+import logging
+import threading
+import time
+from array import array
+from bisect import bisect_left
+
+from flask import current_app, has_request_context, session
+from sqlalchemy import text
+
+import instrumentation
+
+logger = logging.getLogger('warbler.graph')
+
+# session key: when this user last followed or unfollowed someone
+FOLLOW_WRITE_KEY = 'follows_changed_at'
+
+# the deadline is checked every this many edges while building
+BUDGET_CHECK_EVERY = 65536
+
+
+class BuildBudgetExceeded(Exception):
+    """Building the follow graph took longer than FOLLOW_GRAPH_BUDGET."""
+
+
+class Adjacency:
+    """Sorted neighbour lists for user ids 0..size-1 in two flat arrays."""
+
+    def __init__(self, offsets, targets):
+        self.offsets = offsets
+        self.targets = targets
+
+    @classmethod
+    def from_sorted_pairs(cls, pairs, size, deadline):
+        """Build from (source, target) pairs sorted by source then target."""
+
+        counts = array('q', bytes(8 * (size + 1)))
+        targets = array('i')
+
+        for number, (source, target) in enumerate(pairs):
+            if source >= size:
+                continue
+            targets.append(target)
+            counts[source + 1] += 1
+            if number % BUDGET_CHECK_EVERY == 0:
+                if time.monotonic() > deadline:
+                    raise BuildBudgetExceeded()
+                # let requests run meanwhile under gevent workers, where
+                # this thread is a greenlet that never waits otherwise
+                time.sleep(0)
+
+        for user_id in range(1, size + 1):
+            counts[user_id] += counts[user_id - 1]
+
+        return cls(counts, targets)
+
+    def neighbours(self, user_id):
+        if user_id + 1 >= len(self.offsets):
+            return self.targets[0:0]
+        return self.targets[self.offsets[user_id]:self.offsets[user_id + 1]]
+
+    def contains(self, source, target):
+        if source + 1 >= len(self.offsets):
+            return False
+
+        start, end = self.offsets[source], self.offsets[source + 1]
+        index = bisect_left(self.targets, target, start, end)
+        return index < end and self.targets[index] == target
+
+    def degree(self, user_id):
+        if user_id + 1 >= len(self.offsets):
+            return 0
+        return self.offsets[user_id + 1] - self.offsets[user_id]
+
+
+class FollowGraph:
+    """Both directions of the follows table, plus this worker's changes.
+
+    The overlay maps each edge added or removed since the build started to
+    when that happened (monotonic time). `read_at` is when the build began
+    reading the table (wall-clock time).
+    """
+
+    def __init__(self, following, followers, read_at=0):
+        self.following = following
+        self.followers = followers
+        self.read_at = read_at
+        self._added = {}
+        self._removed = {}
+        self._lock = threading.Lock()
+
+    def is_following(self, follower_id, followed_id):
+        edge = (follower_id, followed_id)
+
+        with self._lock:
+            if edge in self._added:
+                return True
+            if edge in self._removed:
+                return False
+
+        return self.following.contains(follower_id, followed_id)
+
+    def following_ids(self, follower_id, user_ids):
+        """Which of `user_ids` is `follower_id` following? Returns a set."""
+
+        return {user_id for user_id in user_ids
+                if self.is_following(follower_id, user_id)}
+
+    def _overlay_delta(self, user_id=None, position=0):
+        """Edges the overlay adds minus those it removes, for `user_id` in
+        `position` (0 follower, 1 followed) or for everyone."""
+
+        with self._lock:
+            added = list(self._added)
+            removed = list(self._removed)
+
+        def counts(edge):
+            return user_id is None or edge[position] == user_id
+
+        return (sum(counts(edge) and not self.following.contains(*edge)
+                    for edge in added)
+                - sum(counts(edge) and self.following.contains(*edge)
+                      for edge in removed))
+
+    def following_count(self, user_id):
+        return self.following.degree(user_id) + self._overlay_delta(user_id, 0)
+
+    def follower_count(self, user_id):
+        return self.followers.degree(user_id) + self._overlay_delta(user_id, 1)
+
+    def mutual_ids(self, user_id):
+        """Ids of users `user_id` follows who follow them back, in order."""
+
+        candidates = set(self.following.neighbours(user_id))
+        with self._lock:
+            candidates.update(followed for follower, followed in self._added
+                              if follower == user_id)
+
+        return [other for other in sorted(candidates)
+                if self.is_following(user_id, other)
+                and self.is_following(other, user_id)]
+
+    def add(self, follower_id, followed_id, at=None):
+        edge = (follower_id, followed_id)
+        with self._lock:
+            self._removed.pop(edge, None)
+            self._added[edge] = at or time.monotonic()
+
+    def remove(self, follower_id, followed_id, at=None):
+        edge = (follower_id, followed_id)
+        with self._lock:
+            self._added.pop(edge, None)
+            self._removed[edge] = at or time.monotonic()
+
+    def adopt_changes(self, older, since):
+        """Replay `older`'s overlay changes made at or after `since`.
+
+        A build reads a snapshot; changes made while it ran may be missing
+        from it.
+        """
+
+        with older._lock:
+            changes = ([(at, self.add, edge) for edge, at in older._added.items()]
+                       + [(at, self.remove, edge) for edge, at in older._removed.items()])
+
+        for at, apply, edge in sorted(changes, key=lambda change: change[0]):
+            if at >= since:
+                apply(*edge, at=at)
+
+    def forget_user(self, user_id):
+        for followed_id in self.following.neighbours(user_id):
+            self.remove(user_id, followed_id)
+        for follower_id in self.followers.neighbours(user_id):
+            self.remove(follower_id, user_id)
+        with self._lock:
+            for edge in [edge for edge in self._added if user_id in edge]:
+                del self._added[edge]
+
+    def edge_count(self):
+        return len(self.following.targets) + self._overlay_delta()
+
+
+_graph = None
+_stats = {'state': 'not started', 'builds': 0, 'failures': 0,
+          'build_seconds': None, 'built_at': None}
+_started = False
+_start_lock = threading.Lock()
+
+
+def _rows(connection, sql):
+    result = connection.execution_options(stream_results=True).execute(text(sql))
+    for row in result:
+        yield row[0], row[1]
+
+
+def build(engine, budget):
+    """A FollowGraph of the follows table; BuildBudgetExceeded if too slow."""
+
+    started = time.monotonic()
+    deadline = started + budget
+    read_at = time.time()
+
+    with engine.connect() as connection:
+        size = (connection.execute(text("SELECT max(id) FROM users")).scalar() or 0) + 1
+
+        following = Adjacency.from_sorted_pairs(_rows(connection, """
+            SELECT user_following_id, user_being_followed_id FROM follows
+            ORDER BY user_following_id, user_being_followed_id"""), size, deadline)
+
+        followers = Adjacency.from_sorted_pairs(_rows(connection, """
+            SELECT user_being_followed_id, user_following_id FROM follows
+            ORDER BY user_being_followed_id, user_following_id"""), size, deadline)
+
+    return (FollowGraph(following, followers, read_at),
+            time.monotonic() - started)
+
+
+def refresh(engine, budget):
+    """Rebuild the index, replacing the current one if the build succeeds."""
+
+    global _graph
+
+    started = time.monotonic()
+
+    try:
+        graph, seconds = build(engine, budget)
+    except BuildBudgetExceeded:
+        _stats['failures'] += 1
+        _stats['state'] = 'over budget' if _graph is None else _stats['state']
+        logger.warning("follow graph build abandoned after %.1fs budget", budget)
+        return
+    except Exception:
+        _stats['failures'] += 1
+        logger.exception("follow graph build failed")
+        return
+
+    if _graph is not None:
+        graph.adopt_changes(_graph, since=started)
+    _graph = graph
+    _stats.update(state='ready', builds=_stats['builds'] + 1,
+                  build_seconds=round(seconds, 3), built_at=time.time())
+    logger.info("follow graph built: %d edges in %.3fs",
+                len(graph.following.targets), seconds)
+
+
+def _refresh_forever(engine, budget, interval):
+    refresh(engine, budget)
+    while interval > 0:
+        time.sleep(interval)
+        refresh(engine, budget)
+
+
+def start(app, engine):
+    """Start building (and, if configured, refreshing) the index for this
+    worker, once."""
+
+    global _started
+
+    with _start_lock:
+        if _started:
+            return
+        _started = True
+
+    _stats['state'] = 'building'
+    thread = threading.Thread(
+        target=_refresh_forever,
+        args=(engine,
+              app.config['FOLLOW_GRAPH_BUDGET'],
+              app.config['FOLLOW_GRAPH_REFRESH']),
+        name='follow-graph',
+        daemon=True)
+    thread.start()
+
+
+def current():
+    """The index if it can answer for this request's user, else None."""
+
+    if _graph is None or not has_request_context():
+        return None
+
+    if not current_app.config['FOLLOW_GRAPH_ENABLED']:
+        return None
+
+    # the index may not have this user's latest follows
+    changed_at = session.get(FOLLOW_WRITE_KEY)
+    if changed_at and changed_at >= _graph.read_at:
+        return None
+
+    return _graph
+
+
+def following_ids(follower_id, user_ids):
+    """Which of `user_ids` `follower_id` follows, or None to ask SQL."""
+
+    graph = current()
+    if graph is None:
+        return None
+    return graph.following_ids(follower_id, user_ids)
+
+
+def follow(follower_id, followed_id):
+    """Record a follow made by this request's user."""
+
+    if _graph is not None:
+        _graph.add(follower_id, followed_id)
+    session[FOLLOW_WRITE_KEY] = time.time()
+
+
+def unfollow(follower_id, followed_id):
+    """Record an unfollow made by this request's user."""
+
+    if _graph is not None:
+        _graph.remove(follower_id, followed_id)
+    session[FOLLOW_WRITE_KEY] = time.time()
+
+
+def forget_user(user_id):
+    """Drop every edge of a deleted user."""
+
+    if _graph is not None:
+        _graph.forget_user(user_id)
+
+
+def stats():
+    report = dict(_stats)
+    if _graph is not None:
+        report['edges'] = _graph.edge_count()
+    return report
+
+
+def init_app(app, engine_getter):
+    """Build the index when `app` serves its first request.
+
+    `engine_getter` returns the engine to read follows from; it is called
+    then rather than now, after any fork.
+    """
+
+    def start_on_first_request():
+        if app.config['FOLLOW_GRAPH_ENABLED']:
+            start(app, engine_getter())
+
+    app.before_request(start_on_first_request)
+    instrumentation.register_metrics('follow_graph', stats)
@@ -0,0 +1,64 @@
+"""Gunicorn settings for the web process (see the Procfile).
+
+Two worker profiles, picked with WORKER_CLASS:
+
+- sync (default): each worker process serves one request at a time, so
+  WEB_CONCURRENCY processes serve that many requests at once.
+- gevent: each worker serves up to WORKER_CONNECTIONS requests at once as
+  greenlets, switching whenever one waits on the network or the database.
+  psycogreen makes psycopg2 wait cooperatively; without it a query would
+  block every request in the worker. Worth it when requests mostly wait on
+  PostgreSQL rather than burn CPU. bcrypt on login and signup runs in the
+  password process pool (see passwords.py), so the worker keeps serving
+  while a hash is computed. Only with BCRYPT_POOL_SIZE=0, which hashes
+  inline, does a login hold up every request in its worker.
+
+Pool sizing: every worker has its own connection pool per database, so the
+most connections the web process can open is
+
+    WEB_CONCURRENCY * (DB_POOL_SIZE + DB_MAX_OVERFLOW)
+
+for the primary, and again for the replica if there is one. Together with
+the job worker and anything else connecting, that has to stay below the
+server's max_connections. A sync worker never uses more than one connection
+for requests (plus one for each background thread: follow graph, trending,
+like flusher), so the defaults of 5 + 10 are plenty. A gevent worker uses up
+to one per in-flight request; requests beyond the pool wait up to
+DB_POOL_TIMEOUT seconds for a connection, which caps how many run queries at
+once. Pick DB_POOL_SIZE for the usual number of concurrent requests per
+worker (the gevent default here is 10) and keep WORKER_CONNECTIONS well
+above it: the rest of a request (templates, the network) doesn't need a
+connection. If the total gets too big for the server, put PgBouncer in
+front in transaction mode rather than raising max_connections.
+
+The numbers above (5 + 10 for sync, 10 + 10 for gevent) are starting
+points reasoned from how each worker uses connections, not measurements:
+they haven't been benchmarked against PostgreSQL. bench/bench_serving.py
+compares throughput and tail latency of the two profiles on the same
+machine; run it against the real database and tune from its results.
+"""
+
+import os
+
+worker_class = os.environ.get('WORKER_CLASS', 'sync')
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+worker_connections = int(os.environ.get('WORKER_CONNECTIONS', 100))
+timeout = int(os.environ.get('WORKER_TIMEOUT', 30))
+bind = os.environ.get('BIND', f"0.0.0.0:{os.environ.get('PORT', 8000)}")
+
+if worker_class == 'gevent':
+    # more requests in flight per worker need more connections per worker,
+    # and give concurrent likes something to be batched with; read by
+    # config.py when the worker imports the app
+    os.environ.setdefault('DB_POOL_SIZE', '10')
+    os.environ.setdefault('DB_MAX_OVERFLOW', '10')
+    os.environ.setdefault('LIKE_BATCH_WAIT', '0.01')
+
+
+def post_fork(server, worker):
+    """Make psycopg2 cooperative in gevent workers, before the app (and its
+    connection pool) is loaded."""
+
+    if worker_class == 'gevent':
+        from psycogreen.gevent import patch_psycopg
+        patch_psycopg()
@@ -0,0 +1,202 @@
+"""Per-request SQL instrumentation and the metrics registry.
+
+Engine events count, for each request, the SQL statements run, the time
+spent in the database and how often each statement shape (the parameterized
+SQL text) repeats. After the request:
+
+- with SQL_TIMING_HEADERS on (development, tests), X-Query-Count and
+  X-DB-Time (milliseconds) response headers are added,
+- one JSON line with the endpoint, status and those numbers is logged to
+  the `warbler.sql` logger,
+- if any one shape ran more than SQL_REPEAT_LIMIT times the request is
+  flagged as a likely N+1: the line is logged as a warning and lists the
+  repeated statements.
+
+Per-endpoint totals are kept for /metrics, which other modules extend with
+`register_metrics`. It is only served to requests bearing METRICS_TOKEN
+(`Authorization: Bearer <token>`), and is a 404 for everyone else, or for
+everyone when no token is set. Tests can hold a route to a query budget
+with `count_queries()`.
+"""
+
+import hmac
+import json
+import logging
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from flask import current_app, g, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger('warbler.sql')
+
+# statement shapes are cut to this many characters in logs
+SHAPE_LOG_LENGTH = 200
+
+_active = threading.local()
+
+_totals = {}
+_totals_lock = threading.Lock()
+
+_providers = {}
+
+
+class QueryStats:
+    """Statements seen while this collector was active."""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.shapes = Counter()
+
+    def record(self, statement, seconds):
+        self.count += 1
+        self.seconds += seconds
+        self.shapes[statement] += 1
+
+    def repeated(self, limit):
+        """(shape, times) for statements run more than `limit` times."""
+
+        return [(shape, times) for shape, times in self.shapes.most_common()
+                if times > limit]
+
+
+def _collectors():
+    if not hasattr(_active, 'stack'):
+        _active.stack = []
+    return _active.stack
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context,
+                           executemany):
+    conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    seconds = time.perf_counter() - conn.info['query_started'].pop()
+
+    for stats in _collectors():
+        stats.record(statement, seconds)
+
+
+@contextmanager
+def count_queries():
+    """Collect the statements run inside the block.
+
+        with count_queries() as stats:
+            client.get('/')
+        self.assertLessEqual(stats.count, 6)
+    """
+
+    stats = QueryStats()
+    _collectors().append(stats)
+
+    try:
+        yield stats
+    finally:
+        _collectors().remove(stats)
+
+
+def register_metrics(name, provider):
+    """Serve `provider()` (a JSON-able dict) under `name` in /metrics."""
+
+    _providers[name] = provider
+
+
+def metrics_allowed():
+    """Does this request carry the METRICS_TOKEN?"""
+
+    token = current_app.config['METRICS_TOKEN']
+    if not token:
+        return False
+
+    given = request.headers.get('Authorization', '')
+    return hmac.compare_digest(given.encode('UTF-8'),
+                               f"Bearer {token}".encode('UTF-8'))
+
+
+def metrics():
+    """Everything /metrics reports."""
+
+    with _totals_lock:
+        routes = {endpoint: dict(totals) for endpoint, totals in _totals.items()}
+
+    report = {'routes': routes}
+    for name, provider in _providers.items():
+        report[name] = provider()
+
+    return report
+
+
+def _start_request():
+    g._query_stats = QueryStats()
+    _collectors().append(g._query_stats)
+
+
+def _finish_request(response):
+    stats = g.pop('_query_stats', None)
+    if stats is None:
+        return response
+
+    _collectors().remove(stats)
+
+    limit = current_app.config['SQL_REPEAT_LIMIT']
+    repeated = stats.repeated(limit)
+    db_ms = round(stats.seconds * 1000, 3)
+    endpoint = request.endpoint or 'unknown'
+
+    if current_app.config['SQL_TIMING_HEADERS']:
+        response.headers['X-Query-Count'] = str(stats.count)
+        response.headers['X-DB-Time'] = f"{db_ms:.3f}"
+
+    with _totals_lock:
+        totals = _totals.setdefault(endpoint, {
+            'requests': 0, 'statements': 0, 'db_ms': 0.0, 'n_plus_one': 0})
+        totals['requests'] += 1
+        totals['statements'] += stats.count
+        totals['db_ms'] = round(totals['db_ms'] + db_ms, 3)
+        totals['n_plus_one'] += bool(repeated)
+
+    line = {
+        'endpoint': endpoint,
+        'method': request.method,
+        'path': request.path,
+        'status': response.status_code,
+        'queries': stats.count,
+        'db_ms': db_ms,
+    }
+
+    if repeated:
+        line['n_plus_one'] = [{'statement': shape[:SHAPE_LOG_LENGTH],
+                               'times': times}
+                              for shape, times in repeated]
+        logger.warning(json.dumps(line))
+    else:
+        logger.info(json.dumps(line))
+
+    return response
+
+
+def _abandon_request(exc):
+    """Drop the collector of a request that failed before after_request."""
+
+    stats = g.pop('_query_stats', None)
+    if stats is not None and stats in _collectors():
+        _collectors().remove(stats)
+
+
+def init_app(app):
+    """Start instrumenting `app`'s requests (and every engine's statements)."""
+
+    if not event.contains(Engine, 'before_cursor_execute',
+                          _before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+    app.teardown_request(_abandon_request)
@@ -0,0 +1,205 @@
+"""Durable background jobs.
+
+Jobs are rows in the `jobs` table, so one is queued in the same transaction
+as the change that needs it and survives restarts. worker.py (the `worker`
+process in the Procfile) claims and runs them; `flask run-jobs` runs
+whatever is due once, in the foreground.
+
+Handlers are registered per kind with `@handler('kind')`. A handler is
+called as `handler(job)` over and over, each call doing one bounded step of
+work, until it returns True. The worker commits after every step, so locks
+are held briefly and progress a handler records in `job.progress` (assign
+a new dict; changes inside the old one aren't seen) survives a crash or a
+retry.
+
+A step that raises is rolled back and the job is queued again
+JOB_RETRY_DELAY * 2 ** (attempts - 1) seconds later, until it has been
+tried JOB_MAX_ATTEMPTS times; then it is marked failed with its last error.
+A running job whose worker hasn't checked in for JOB_LEASE seconds is
+presumed dead and claimed again. A worker that was only slow finds out when
+it next commits: each step's commit is conditional on the job still being
+locked by that worker, and if another worker has taken over, the step is
+rolled back and the job is left to the new owner.
+
+Job counts by state are reported in /metrics.
+"""
+
+import logging
+import os
+import socket
+import time
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import and_, func, or_
+
+import instrumentation
+from models import db, Job
+
+logger = logging.getLogger('warbler.jobs')
+
+HANDLERS = {}
+
+
+def handler(kind):
+    """Decorator: run `kind` jobs with the decorated function."""
+
+    def register(function):
+        HANDLERS[kind] = function
+        return function
+
+    return register
+
+
+def enqueue(kind, **payload):
+    """Queue a `kind` job; it is committed along with the caller's changes."""
+
+    job = Job(kind=kind, payload=payload, progress={})
+    db.session.add(job)
+    return job
+
+
+def default_worker_id():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def claim(worker_id):
+    """Take the next due job for `worker_id`; None if there is none."""
+
+    now = datetime.utcnow()
+    expired = now - timedelta(seconds=current_app.config['JOB_LEASE'])
+    due = or_(and_(Job.state == 'queued', Job.run_at <= now),
+              and_(Job.state == 'running', Job.locked_at < expired))
+
+    job = (Job
+           .query
+           .filter(due)
+           .order_by(Job.run_at, Job.id)
+           .with_for_update(skip_locked=True)
+           .first())
+
+    if job is None:
+        db.session.rollback()
+        return None
+
+    # attempts doubles as a version number: if another worker claimed the
+    # job since we read it (databases without row locks), this matches
+    # nothing
+    claimed = (Job
+               .query
+               .filter(Job.id == job.id, Job.attempts == job.attempts)
+               .update({Job.state: 'running',
+                        Job.locked_by: worker_id,
+                        Job.locked_at: now,
+                        Job.attempts: Job.attempts + 1},
+                       synchronize_session=False))
+    db.session.commit()
+
+    return Job.query.get(job.id) if claimed else None
+
+
+def _still_owned(job_id, worker_id, now):
+    """Renew `worker_id`'s lease on the job, in the current transaction;
+    False if another worker has claimed it since. The row stays locked
+    until the commit, so it can't be claimed in between."""
+
+    return bool(Job
+                .query
+                .filter(Job.id == job_id, Job.locked_by == worker_id)
+                .update({Job.locked_at: now}, synchronize_session=False))
+
+
+def _retry_or_fail(job_id, worker_id, error):
+    job = Job.query.get(job_id)
+    now = datetime.utcnow()
+
+    if job.locked_by != worker_id:
+        db.session.rollback()
+        return
+
+    job.last_error = f"{type(error).__name__}: {error}"
+    job.locked_by = job.locked_at = None
+
+    if job.attempts >= current_app.config['JOB_MAX_ATTEMPTS']:
+        job.state = 'failed'
+        job.finished_at = now
+        logger.error("job %d (%s) failed for good: %s",
+                     job.id, job.kind, job.last_error)
+    else:
+        delay = current_app.config['JOB_RETRY_DELAY'] * 2 ** (job.attempts - 1)
+        job.state = 'queued'
+        job.run_at = now + timedelta(seconds=delay)
+        logger.warning("job %d (%s) will be retried in %ds: %s",
+                       job.id, job.kind, delay, job.last_error)
+
+    db.session.commit()
+
+
+def run(job):
+    """Run a claimed job step by step until it finishes or a step fails."""
+
+    job_id = job.id
+    worker_id = job.locked_by
+
+    while True:
+        try:
+            finished = HANDLERS[job.kind](job)
+
+            now = datetime.utcnow()
+            if not _still_owned(job_id, worker_id, now):
+                db.session.rollback()
+                logger.warning("job %d was taken over by another worker; "
+                               "dropping this step", job_id)
+                return False
+
+            job.locked_at = now
+            if finished:
+                job.state = 'done'
+                job.finished_at = now
+                job.locked_by = None
+            db.session.commit()
+        except Exception as error:
+            logger.exception("job %d step failed", job_id)
+            db.session.rollback()
+            _retry_or_fail(job_id, worker_id, error)
+            return False
+
+        if finished:
+            return True
+
+
+def run_pending(worker_id=None, limit=None):
+    """Run due jobs until none are left (or `limit` ran); returns how many."""
+
+    worker_id = worker_id or default_worker_id()
+    ran = 0
+
+    while limit is None or ran < limit:
+        job = claim(worker_id)
+        if job is None:
+            break
+        run(job)
+        ran += 1
+
+    return ran
+
+
+def work_forever(worker_id=None):
+    """Run jobs as they come due, polling every JOB_POLL_INTERVAL seconds."""
+
+    worker_id = worker_id or default_worker_id()
+    logger.info("worker %s started", worker_id)
+
+    while True:
+        if not run_pending(worker_id):
+            db.session.remove()
+            time.sleep(current_app.config['JOB_POLL_INTERVAL'])
+
+
+def stats():
+    counts = db.session.query(Job.state, func.count()).group_by(Job.state)
+    return {state: count for state, count in counts}
+
+
+def init_app(app):
+    instrumentation.register_metrics('jobs', stats)
@@ -0,0 +1,300 @@
+"""Likes and unlikes, written in micro-batches.
+
+`set_like(user_id, message, liked)` makes the like exist or not (doing it
+twice is harmless) and returns the new state and the message's like count.
+It doesn't write by itself: each worker queues like changes and a flusher
+thread applies up to LIKE_BATCH_SIZE of them, whatever arrived within
+LIKE_BATCH_WAIT seconds of the first, in one transaction. Per batch that is
+one multi-row INSERT ... ON CONFLICT DO NOTHING, one DELETE, one executemany
+of counter updates per table and a single commit, however many users are
+clicking. Callers wait for their batch to commit, so a returned state is
+durable.
+
+Counters move by the rows the INSERT and DELETE report back (RETURNING),
+not by what was read beforehand: when two workers, or a worker and the
+purge, remove the same like, only the one whose DELETE found it counts it.
+
+Batching only pays when a worker has several requests in flight, i.e.
+under gevent: a sync worker serves one request at a time, so its batches
+would hold a single change and only add LIKE_BATCH_WAIT to each like.
+LIKE_BATCH_WAIT is therefore 0 by default, applying each change at once in
+the caller's thread, and gunicorn.conf.py turns batching on for gevent.
+
+Each like also adds its weight to the message's trending score (see
+trending.py), and its unlike takes the same weight back.
+"""
+
+import logging
+import queue
+import threading
+import time
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import bindparam, select, text, tuple_
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.exc import IntegrityError, OperationalError
+
+import counters
+import instrumentation
+import trending
+from models import Like, Message, User
+
+logger = logging.getLogger('warbler.likes')
+
+
+class LikeChange:
+    """One request to make (user_id, message_id) liked or not."""
+
+    def __init__(self, user_id, message_id, posted, liked):
+        self.user_id = user_id
+        self.message_id = message_id
+        self.posted = posted
+        self.liked = liked
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+    @property
+    def key(self):
+        return (self.user_id, self.message_id)
+
+
+_queue = queue.Queue()
+_engine_getter = None
+_stats = {'changes': 0, 'batches': 0, 'largest_batch': 0, 'retried_batches': 0}
+_stats_lock = threading.Lock()
+
+# PostgreSQL's deadlock_detected and serialization_failure: the batch lost
+# a race with another writer and can simply be tried again
+RETRYABLE_PGCODES = {'40P01', '40001'}
+_started = False
+_start_lock = threading.Lock()
+
+
+def _sqlite_returning(connection, sql, rows):
+    """Run `sql` with a RETURNING clause on SQLite (3.35+), which has it
+    even though SQLAlchemy 1.4 can't compile it there. `rows` give the
+    values of its numbered parameters (:user_id0, :message_id0, ...)."""
+
+    likes = Like.__table__
+    params = [bindparam(f'{name}{n}', value, type_=likes.c[name].type)
+              for n, row in enumerate(rows) for name, value in row.items()]
+
+    return connection.execute(
+        text(sql + " RETURNING user_id, message_id, timestamp")
+        .bindparams(*params)
+        .columns(likes.c.user_id, likes.c.message_id, likes.c.timestamp)
+    ).all()
+
+
+def _insert_likes(connection, rows):
+    """Insert like `rows`, skipping any that already exist; returns the
+    (user_id, message_id, timestamp) of those really inserted."""
+
+    likes = Like.__table__
+
+    if connection.dialect.name == 'postgresql':
+        return connection.execute(
+            postgresql.insert(likes).values(rows).on_conflict_do_nothing()
+            .returning(likes.c.user_id, likes.c.message_id, likes.c.timestamp)
+        ).all()
+
+    values = ', '.join(f"(:user_id{n}, :message_id{n}, :timestamp{n})"
+                       for n in range(len(rows)))
+    return _sqlite_returning(
+        connection,
+        f"INSERT INTO likes (user_id, message_id, timestamp) VALUES {values} "
+        "ON CONFLICT DO NOTHING",
+        rows)
+
+
+def _delete_likes(connection, keys):
+    """Delete the likes (user_id, message_id) in `keys`; returns the
+    (user_id, message_id, timestamp) of those really deleted."""
+
+    likes = Like.__table__
+
+    if connection.dialect.name == 'postgresql':
+        return connection.execute(
+            likes.delete()
+            .where(tuple_(likes.c.user_id, likes.c.message_id).in_(keys))
+            .returning(likes.c.user_id, likes.c.message_id, likes.c.timestamp)
+        ).all()
+
+    values = ', '.join(f"(:user_id{n}, :message_id{n})" for n in range(len(keys)))
+    return _sqlite_returning(
+        connection,
+        f"DELETE FROM likes WHERE (user_id, message_id) IN (VALUES {values})",
+        [{'user_id': user_id, 'message_id': message_id}
+         for user_id, message_id in keys])
+
+
+def apply_batch(engine, changes, half_life):
+    """Apply `changes` in one transaction and set each one's result to
+    (liked, like_count). The last change to each like wins."""
+
+    messages = Message.__table__
+
+    wanted = {}
+    for change in changes:
+        wanted[change.key] = change
+
+    with engine.begin() as connection:
+        now = datetime.utcnow()
+        # in key order, like the counter updates, so concurrent batches
+        # take their locks in the same order
+        inserts = [{'user_id': change.user_id,
+                    'message_id': change.message_id,
+                    'timestamp': now}
+                   for key, change in sorted(wanted.items()) if change.liked]
+        deletes = [key for key, change in sorted(wanted.items())
+                   if not change.liked]
+
+        inserted = _insert_likes(connection, inserts) if inserts else []
+        deleted = _delete_likes(connection, deletes) if deletes else []
+
+        message_deltas = {}
+        user_deltas = {}
+
+        for rows, delta in ((inserted, 1), (deleted, -1)):
+            for user_id, message_id, liked_at in rows:
+                posted = wanted[(user_id, message_id)].posted
+                weight = delta * trending.like_weight(posted, liked_at, half_life)
+
+                row = message_deltas.setdefault(message_id,
+                                                {'like_count': 0, 'trend_score': 0.0})
+                row['like_count'] += delta
+                row['trend_score'] += weight
+                user_deltas.setdefault(user_id, {'liked_count': 0})
+                user_deltas[user_id]['liked_count'] += delta
+
+        counters.bump_each(connection, Message, message_deltas)
+        counters.bump_each(connection, User, user_deltas)
+
+        like_counts = dict(connection.execute(
+            select(messages.c.id, messages.c.like_count)
+            .where(messages.c.id.in_({message_id for _, message_id in wanted})))
+            .all())
+
+    for change in changes:
+        change.result = (wanted[change.key].liked,
+                         like_counts.get(change.message_id, 0))
+
+
+def _conflicted(error):
+    """Did `error` come from losing a race with another writer?"""
+
+    if isinstance(error, IntegrityError):
+        return True
+    return (isinstance(error, OperationalError)
+            and getattr(error.orig, 'pgcode', None) in RETRYABLE_PGCODES)
+
+
+def flush(engine, changes, half_life):
+    """Apply a batch; if it conflicts with another writer (a deleted
+    message, a deadlock), retry each change on its own so one bad change
+    can't fail the rest."""
+
+    retried = False
+
+    try:
+        apply_batch(engine, changes, half_life)
+    except Exception as error:
+        if _conflicted(error):
+            retried = True
+            for change in changes:
+                try:
+                    apply_batch(engine, [change], half_life)
+                except Exception as error:
+                    change.error = error
+        else:
+            logger.exception("like batch of %d failed", len(changes))
+            for change in changes:
+                change.error = error
+
+    # callers flush in their own threads when LIKE_BATCH_WAIT is 0
+    with _stats_lock:
+        _stats['changes'] += len(changes)
+        _stats['batches'] += 1
+        _stats['largest_batch'] = max(_stats['largest_batch'], len(changes))
+        _stats['retried_batches'] += retried
+
+    for change in changes:
+        change.done.set()
+
+
+def _flush_forever(engine, size, wait, half_life):
+    while True:
+        batch = [_queue.get()]
+        deadline = time.monotonic() + wait
+
+        while len(batch) < size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(_queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+
+        flush(engine, batch, half_life)
+
+
+def _start(app, engine):
+    """Start this worker's flusher thread, once."""
+
+    global _started
+
+    with _start_lock:
+        if _started:
+            return
+        _started = True
+
+    thread = threading.Thread(
+        target=_flush_forever,
+        args=(engine,
+              app.config['LIKE_BATCH_SIZE'],
+              app.config['LIKE_BATCH_WAIT'],
+              app.config['TRENDING_HALF_LIFE']),
+        name='like-flusher',
+        daemon=True)
+    thread.start()
+
+
+def set_like(user_id, message, liked):
+    """Make `user_id`'s like of `message` exist (or not).
+
+    Returns (liked, like_count) once written; raises IntegrityError if the
+    message was deleted meanwhile.
+    """
+
+    app = current_app._get_current_object()
+    engine = _engine_getter()
+    change = LikeChange(user_id, message.id, message.timestamp, liked)
+
+    if app.config['LIKE_BATCH_WAIT'] <= 0:
+        flush(engine, [change], app.config['TRENDING_HALF_LIFE'])
+    else:
+        _start(app, engine)
+        _queue.put(change)
+        change.done.wait()
+
+    if change.error is not None:
+        raise change.error
+
+    return change.result
+
+
+def stats():
+    with _stats_lock:
+        return dict(_stats, queued=_queue.qsize())
+
+
+def init_app(app, engine_getter):
+    """Write likes for `app` through `engine_getter()`'s engine."""
+
+    global _engine_getter
+
+    _engine_getter = engine_getter
+    instrumentation.register_metrics('likes', stats)
@@ -0,0 +1,209 @@
+"""Uploaded avatars and header pictures.
+
+Signup and the profile form take an uploaded picture alongside the
+image_url / header_image_url fields. `save_upload` checks it is a JPEG,
+PNG, GIF or WebP of at most MEDIA_MAX_BYTES, keeps the original in the
+blob store under a key made from the user and a hash of the file, and
+queues a media_variants job (see jobs.py). The request does no image work.
+
+The job (in the worker, which needs Pillow) crops the original to each
+of the kind's VARIANTS and saves them as JPEGs, then points the user's
+image_key / header_image_key at the new key. It removes the previous
+upload's files one step later, after that change is committed. Until then
+the user keeps their old picture.
+
+Templates show pictures with `avatar_url(user, variant)` and
+`header_url(user, variant)`: the variant's /media/ URL for an upload, else
+the user's URL (through static_url, for the default pictures). Timelines
+and cards use the small `thumb` variants; profile pages use `display`. A
+key never changes its content, so /media/ files are cached as immutable.
+
+Blob stores are pluggable: MEDIA_STORE names one in STORES. The built-in
+`local` store keeps files under MEDIA_ROOT, which must be shared by the web
+and worker processes. A store for a service such as S3 needs put, get,
+delete_prefix and url methods. Its url returns the public URL of a key,
+and the local store's returns None so /media/ serves the file.
+"""
+
+import hashlib
+import io
+import os
+import shutil
+import tempfile
+
+from flask import abort, current_app, send_from_directory
+
+import assets
+import jobs
+from models import User
+
+URL_PREFIX = '/media/'
+
+# variant: (width, height) it is cropped to, twice the size it is shown at
+VARIANTS = {
+    'avatar': {'thumb': (96, 96), 'display': (400, 400)},
+    'header': {'thumb': (720, 240), 'display': (1920, 640)},
+}
+
+KEY_COLUMNS = {'avatar': 'image_key', 'header': 'header_image_key'}
+
+JPEG_QUALITY = 85
+
+SIGNATURES = [b'\xff\xd8\xff', b'\x89PNG\r\n\x1a\n', b'GIF87a', b'GIF89a']
+
+
+class InvalidImage(ValueError):
+    """An upload that isn't a picture we take."""
+
+
+class FileSystemStore:
+    """Blobs as files under `root`."""
+
+    def __init__(self, root):
+        self.root = root
+
+    def _path(self, key):
+        path = os.path.abspath(os.path.join(self.root, key))
+        if not path.startswith(os.path.abspath(self.root) + os.sep):
+            raise ValueError(f"bad key {key!r}")
+        return path
+
+    def put(self, key, data):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # written whole and then swapped in, so readers never see half
+        with tempfile.NamedTemporaryFile(dir=os.path.dirname(path),
+                                         delete=False) as file:
+            file.write(data)
+        os.replace(file.name, path)
+
+    def get(self, key):
+        with open(self._path(key), 'rb') as file:
+            return file.read()
+
+    def delete_prefix(self, prefix):
+        shutil.rmtree(self._path(prefix), ignore_errors=True)
+
+    def url(self, key):
+        return None
+
+
+STORES = {'local': lambda app: FileSystemStore(app.config['MEDIA_ROOT'])}
+
+
+def store():
+    """The current app's blob store."""
+
+    return current_app.extensions['media']
+
+
+def _is_image(data):
+    return (any(data.startswith(signature) for signature in SIGNATURES)
+            or (data[:4] == b'RIFF' and data[8:12] == b'WEBP'))
+
+
+def save_upload(user, kind, upload):
+    """Store `upload` (a FileStorage) as `user`'s new `kind` picture and
+    queue making its variants; the job is committed with the caller's
+    changes. Raises InvalidImage for anything but a small enough picture."""
+
+    limit = current_app.config['MEDIA_MAX_BYTES']
+    data = upload.read(limit + 1)
+
+    if len(data) > limit:
+        raise InvalidImage(f"Pictures can be at most {limit // 2 ** 20} MB.")
+    if not _is_image(data):
+        raise InvalidImage("Pictures must be JPEG, PNG, GIF or WebP images.")
+
+    key = f"{kind}/{user.id}/{hashlib.sha256(data).hexdigest()[:16]}"
+    store().put(f"{key}/original", data)
+
+    return jobs.enqueue('media_variants', user_id=user.id, picture=kind, key=key)
+
+
+def forget_user(user_id):
+    """Remove every picture `user_id` uploaded."""
+
+    for kind in VARIANTS:
+        store().delete_prefix(f"{kind}/{user_id}")
+
+
+@jobs.handler('media_variants')
+def make_variants(job):
+    """Save the variants of an upload and switch the user to it; then, as
+    a second step, remove the upload it replaced."""
+
+    if 'previous' in job.progress:
+        if job.progress['previous']:
+            store().delete_prefix(job.progress['previous'])
+        return True
+
+    # only the worker does image work
+    from PIL import Image, ImageOps
+
+    kind = job.payload['picture']
+    key = job.payload['key']
+    user = User.query.get(job.payload['user_id'])
+    if user is None or user.deleted_at is not None:
+        return True
+
+    blob = store()
+    original = Image.open(io.BytesIO(blob.get(f"{key}/original")))
+    original = ImageOps.exif_transpose(original).convert('RGB')
+
+    for variant, size in VARIANTS[kind].items():
+        out = io.BytesIO()
+        ImageOps.fit(original, size, Image.LANCZOS).save(
+            out, 'JPEG', quality=JPEG_QUALITY, optimize=True, progressive=True)
+        blob.put(f"{key}/{variant}.jpg", out.getvalue())
+
+    column = KEY_COLUMNS[kind]
+    previous = getattr(user, column)
+    setattr(user, column, key)
+
+    job.progress = {'previous': previous if previous != key else None}
+    return False
+
+
+def media_url(key, variant):
+    name = f"{key}/{variant}.jpg"
+    return store().url(name) or URL_PREFIX + name
+
+
+def avatar_url(user, variant='thumb'):
+    """URL of `user`'s avatar, as `variant` if it was uploaded (Jinja global)."""
+
+    if user.image_key:
+        return media_url(user.image_key, variant)
+    return assets.static_url(user.image_url)
+
+
+def header_url(user, variant='thumb'):
+    """URL of `user`'s header picture, like avatar_url (Jinja global)."""
+
+    if user.header_image_key:
+        return media_url(user.header_image_key, variant)
+    return assets.static_url(user.header_image_url)
+
+
+def serve(key, variant):
+    """Send a variant from the local store."""
+
+    kind = key.split('/', 1)[0]
+    if variant not in VARIANTS.get(kind, ()):
+        abort(404)
+
+    response = send_from_directory(current_app.config['MEDIA_ROOT'],
+                                   f"{key}/{variant}.jpg",
+                                   mimetype='image/jpeg',
+                                   max_age=assets.MAX_AGE)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+
+def init_app(app):
+    app.extensions['media'] = STORES[app.config['MEDIA_STORE']](app)
+    app.add_url_rule(URL_PREFIX + '<path:key>/<variant>.jpg', 'media', serve)
+    app.jinja_env.globals['avatar_url'] = avatar_url
+    app.jinja_env.globals['header_url'] = header_url
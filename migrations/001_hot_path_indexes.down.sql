@@ -0,0 +1,8 @@
+-- Reverts 001_hot_path_indexes.sql.
+--
+--    psql "$DATABASE_URL" -f migrations/001_hot_path_indexes.down.sql
+
+DROP INDEX CONCURRENTLY IF EXISTS ix_messages_user_timestamp;
+DROP INDEX CONCURRENTLY IF EXISTS ix_messages_timestamp;
+DROP INDEX CONCURRENTLY IF EXISTS ix_follows_following;
+DROP INDEX CONCURRENTLY IF EXISTS ix_likes_message;
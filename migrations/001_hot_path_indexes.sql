@@ -0,0 +1,33 @@
+-- Indexes for the hottest query paths (the same ones models.py declares, so
+-- databases made with db.create_all() or seed.py already have them).
+--
+--    psql "$DATABASE_URL" -f migrations/001_hot_path_indexes.sql
+--
+-- CONCURRENTLY builds each index without blocking writes, but can't run in
+-- a transaction: don't pass psql --single-transaction. If a build fails it
+-- leaves an INVALID index behind; drop it and run this file again.
+
+-- a user's messages, newest first (profile pages, fan-in timelines): the
+-- keyset columns are in the index, so pages are read in order, no sort
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_messages_user_timestamp
+    ON messages (user_id, timestamp, id);
+
+-- recent messages, for the trending refresh
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_messages_timestamp
+    ON messages (timestamp);
+
+-- who a user follows (following pages, follow state checks, the follow
+-- graph); the primary key only serves "who follows X"
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_follows_following
+    ON follows (user_following_id, user_being_followed_id);
+
+-- a message's likes (deleting messages and users, counter reconciliation);
+-- the primary key only serves "what did X like"
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_likes_message
+    ON likes (message_id, user_id);
+
+-- the indexes above cover their queries; index-only scans need the
+-- visibility map and the planner needs fresh statistics
+VACUUM ANALYZE messages;
+VACUUM ANALYZE follows;
+VACUUM ANALYZE likes;
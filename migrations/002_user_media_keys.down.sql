@@ -0,0 +1,6 @@
+-- Reverts 002_user_media_keys.sql.
+--
+--    psql "$DATABASE_URL" -f migrations/002_user_media_keys.down.sql
+
+ALTER TABLE users DROP COLUMN IF EXISTS header_image_key;
+ALTER TABLE users DROP COLUMN IF EXISTS image_key;
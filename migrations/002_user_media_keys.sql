@@ -0,0 +1,9 @@
+-- Uploaded avatars and headers (see media.py): the storage key of each
+-- user's current picture, NULL while they use image_url/header_image_url.
+--
+--    psql "$DATABASE_URL" -f migrations/002_user_media_keys.sql
+--
+-- Nullable columns without defaults are added without rewriting the table.
+
+ALTER TABLE users ADD COLUMN IF NOT EXISTS image_key text;
+ALTER TABLE users ADD COLUMN IF NOT EXISTS header_image_key text;
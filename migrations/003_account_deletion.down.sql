@@ -0,0 +1,7 @@
+-- Reverts 003_account_deletion.sql. Any queued jobs, including unfinished
+-- purges, are lost; accounts marked deleted become visible again.
+--
+--    psql "$DATABASE_URL" -f migrations/003_account_deletion.down.sql
+
+DROP TABLE IF EXISTS jobs;
+ALTER TABLE users DROP COLUMN IF EXISTS deleted_at;
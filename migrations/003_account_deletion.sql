@@ -0,0 +1,29 @@
+-- Account deletion and background jobs (see purge.py and jobs.py): when
+-- each user was deleted, NULL for live accounts, and the durable job queue
+-- the purge runs on.
+--
+--    psql "$DATABASE_URL" -f migrations/003_account_deletion.sql
+--
+-- Run it before deploying the code that reads these: every user query
+-- selects deleted_at. A nullable column without a default is added without
+-- rewriting the table.
+
+ALTER TABLE users ADD COLUMN IF NOT EXISTS deleted_at timestamp;
+
+CREATE TABLE IF NOT EXISTS jobs (
+    id serial PRIMARY KEY,
+    kind varchar(50) NOT NULL,
+    payload json NOT NULL,
+    state varchar(20) NOT NULL DEFAULT 'queued',
+    run_at timestamp NOT NULL,
+    attempts integer NOT NULL DEFAULT 0,
+    progress json NOT NULL,
+    locked_by varchar(100),
+    locked_at timestamp,
+    last_error text,
+    created_at timestamp NOT NULL,
+    finished_at timestamp
+);
+
+-- workers poll for the next queued job that is due
+CREATE INDEX IF NOT EXISTS ix_jobs_state_run_at ON jobs (state, run_at);
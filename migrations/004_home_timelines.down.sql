@@ -0,0 +1,6 @@
+-- Reverts 004_home_timelines.sql.
+--
+--    psql "$DATABASE_URL" -f migrations/004_home_timelines.down.sql
+
+ALTER TABLE users DROP COLUMN IF EXISTS fanout_on_read;
+DROP TABLE IF EXISTS timeline_entries;
@@ -0,0 +1,25 @@
+-- Materialized home timelines (see timeline.py): each user's inbox of
+-- delivered messages, and the flag marking authors whose messages are
+-- pulled at read time instead.
+--
+--    psql "$DATABASE_URL" -f migrations/004_home_timelines.sql
+--
+-- The inboxes start out empty, so home pages are blank until they are
+-- filled. Afterwards, once follower counts are right (005_engagement_counters),
+-- run:
+--
+--    flask rebuild-timelines
+
+CREATE TABLE IF NOT EXISTS timeline_entries (
+    user_id integer NOT NULL REFERENCES users (id) ON DELETE CASCADE,
+    message_id integer NOT NULL REFERENCES messages (id) ON DELETE CASCADE,
+    timestamp timestamp NOT NULL,
+    PRIMARY KEY (user_id, message_id)
+);
+
+-- a user's home page, newest first
+CREATE INDEX IF NOT EXISTS ix_timeline_entries_user_timestamp
+    ON timeline_entries (user_id, timestamp);
+
+-- a constant default: added without rewriting the table
+ALTER TABLE users ADD COLUMN IF NOT EXISTS fanout_on_read boolean NOT NULL DEFAULT false;
@@ -0,0 +1,9 @@
+-- Reverts 005_engagement_counters.sql.
+--
+--    psql "$DATABASE_URL" -f migrations/005_engagement_counters.down.sql
+
+ALTER TABLE messages DROP COLUMN IF EXISTS like_count;
+ALTER TABLE users DROP COLUMN IF EXISTS liked_count;
+ALTER TABLE users DROP COLUMN IF EXISTS follower_count;
+ALTER TABLE users DROP COLUMN IF EXISTS following_count;
+ALTER TABLE users DROP COLUMN IF EXISTS message_count;
@@ -0,0 +1,30 @@
+-- Denormalized engagement counters (see counters.py), filled in from the
+-- source tables as `flask reconcile-counters` would.
+--
+--    psql "$DATABASE_URL" -f migrations/005_engagement_counters.sql
+--
+-- Run it before deploying the code that reads these: every user and
+-- message query selects them. Constant defaults add the columns without
+-- rewriting the tables; the backfill below does rewrite them, and counts
+-- taken while the old code is still writing may be slightly off, so run
+-- `flask reconcile-counters` again after the deploy.
+
+ALTER TABLE users ADD COLUMN IF NOT EXISTS message_count integer NOT NULL DEFAULT 0;
+ALTER TABLE users ADD COLUMN IF NOT EXISTS following_count integer NOT NULL DEFAULT 0;
+ALTER TABLE users ADD COLUMN IF NOT EXISTS follower_count integer NOT NULL DEFAULT 0;
+ALTER TABLE users ADD COLUMN IF NOT EXISTS liked_count integer NOT NULL DEFAULT 0;
+ALTER TABLE messages ADD COLUMN IF NOT EXISTS like_count integer NOT NULL DEFAULT 0;
+
+UPDATE users SET
+    message_count = (SELECT count(*) FROM messages
+                     WHERE messages.user_id = users.id),
+    following_count = (SELECT count(*) FROM follows
+                       WHERE follows.user_following_id = users.id),
+    follower_count = (SELECT count(*) FROM follows
+                      WHERE follows.user_being_followed_id = users.id),
+    liked_count = (SELECT count(*) FROM likes
+                   WHERE likes.user_id = users.id);
+
+UPDATE messages SET
+    like_count = (SELECT count(*) FROM likes
+                  WHERE likes.message_id = messages.id);
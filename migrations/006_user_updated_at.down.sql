@@ -0,0 +1,5 @@
+-- Reverts 006_user_updated_at.sql.
+--
+--    psql "$DATABASE_URL" -f migrations/006_user_updated_at.down.sql
+
+ALTER TABLE users DROP COLUMN IF EXISTS updated_at;
@@ -0,0 +1,10 @@
+-- Profile versions (see caching.py and fragments.py): when each user row
+-- last changed, other than by counter bumps. ETags and cached message
+-- cards key on it.
+--
+--    psql "$DATABASE_URL" -f migrations/006_user_updated_at.sql
+--
+-- now() is fixed for the statement, so existing rows all get the time of
+-- the migration and the column is added without rewriting the table.
+
+ALTER TABLE users ADD COLUMN IF NOT EXISTS updated_at timestamp NOT NULL DEFAULT now();
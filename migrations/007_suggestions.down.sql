@@ -0,0 +1,5 @@
+-- Reverts 007_suggestions.sql.
+--
+--    psql "$DATABASE_URL" -f migrations/007_suggestions.down.sql
+
+DROP TABLE IF EXISTS suggestions;
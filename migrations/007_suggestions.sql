@@ -0,0 +1,14 @@
+-- Precomputed "who to follow" lists (see recommendations.py): one row per
+-- user, holding suggested user ids, best first.
+--
+--    psql "$DATABASE_URL" -f migrations/007_suggestions.sql
+--
+-- Users without a row are simply shown no suggestions; fill them in with
+--
+--    flask recommend
+
+CREATE TABLE IF NOT EXISTS suggestions (
+    user_id integer PRIMARY KEY REFERENCES users (id) ON DELETE CASCADE,
+    user_ids json NOT NULL,
+    computed_at timestamp NOT NULL
+);
@@ -0,0 +1,6 @@
+-- Reverts 008_trending.sql.
+--
+--    psql "$DATABASE_URL" -f migrations/008_trending.down.sql
+
+ALTER TABLE messages DROP COLUMN IF EXISTS trend_score;
+ALTER TABLE likes DROP COLUMN IF EXISTS timestamp;
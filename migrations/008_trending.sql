@@ -0,0 +1,20 @@
+-- Trending (see trending.py): when each like was made, and each message's
+-- forward-decayed like total.
+--
+--    psql "$DATABASE_URL" -f migrations/008_trending.sql
+--
+-- When existing likes were made isn't known, so they are dated to their
+-- message's posting. A like made then weighs exactly 1, so a message's
+-- starting score is its number of likes. An unlike later takes back the
+-- same 1, so scores never go negative. Both UPDATEs rewrite their tables.
+
+ALTER TABLE likes ADD COLUMN IF NOT EXISTS timestamp timestamp NOT NULL DEFAULT now();
+ALTER TABLE messages ADD COLUMN IF NOT EXISTS trend_score double precision NOT NULL DEFAULT 0;
+
+UPDATE likes SET timestamp = messages.timestamp
+    FROM messages
+    WHERE messages.id = likes.message_id;
+
+UPDATE messages SET
+    trend_score = (SELECT count(*) FROM likes
+                   WHERE likes.message_id = messages.id);
@@ -0,0 +1,8 @@
+-- Reverts 009_search_indexes.sql. pg_trgm itself is left installed; user
+-- search keeps using it, just without an index.
+--
+--    psql "$DATABASE_URL" -f migrations/009_search_indexes.down.sql
+
+DROP INDEX CONCURRENTLY IF EXISTS ix_messages_text_tsv;
+DROP INDEX CONCURRENTLY IF EXISTS ix_users_bio_trgm;
+DROP INDEX CONCURRENTLY IF EXISTS ix_users_username_trgm;
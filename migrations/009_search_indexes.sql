@@ -0,0 +1,24 @@
+-- Search indexes (see search.py), the same ones `flask init-search` makes:
+-- trigram indexes for user search and a text search index for messages.
+--
+--    psql "$DATABASE_URL" -f migrations/009_search_indexes.sql
+--
+-- Creating pg_trgm needs a role allowed to create extensions (Heroku's
+-- default role is). Until it exists, user search ranks by plain ILIKE
+-- matches; web workers started before this ran keep doing so until they
+-- restart.
+--
+-- Like 001, the indexes are built CONCURRENTLY: don't pass psql
+-- --single-transaction, and drop any INVALID index a failed build leaves
+-- before running this again.
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_users_username_trgm
+    ON users USING gin (username gin_trgm_ops);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_users_bio_trgm
+    ON users USING gin (bio gin_trgm_ops);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_messages_text_tsv
+    ON messages USING gin (to_tsvector('english', text));
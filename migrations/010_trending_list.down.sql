@@ -0,0 +1,5 @@
+-- Reverts 010_trending_list.sql.
+--
+--    psql "$DATABASE_URL" -f migrations/010_trending_list.down.sql
+
+DROP TABLE IF EXISTS trending_messages;
@@ -0,0 +1,12 @@
+-- The shared trending list (see trending.py): the job worker ranks recent
+-- messages and stores the best ids here; web workers only read these rows.
+--
+--    psql "$DATABASE_URL" -f migrations/010_trending_list.sql
+--
+-- The list fills in within TRENDING_REFRESH seconds of a worker.py starting.
+
+CREATE TABLE IF NOT EXISTS trending_messages (
+    position integer PRIMARY KEY,
+    message_id integer NOT NULL REFERENCES messages (id) ON DELETE CASCADE,
+    computed_at timestamp NOT NULL
+);
@@ -2,11 +2,11 @@
 
 from datetime import datetime
 
-from flask_bcrypt import Bcrypt
-from flask_sqlalchemy import SQLAlchemy
+import graph
+import passwords
+from replicas import RoutingSQLAlchemy
 
-bcrypt = Bcrypt()
-db = SQLAlchemy()
+db = RoutingSQLAlchemy()
 
 
 class Follows(db.Model):
@@ -26,6 +26,13 @@ class Follows(db.Model):
         primary_key=True,
     )
 
+    # the primary key leads with the followed user; this serves the other
+    # direction ("who does X follow?") without touching the table
+    __table_args__ = (
+        db.Index('ix_follows_following', 'user_following_id',
+                 'user_being_followed_id'),
+    )
+
 class Like(db.Model):
     """An individual like on a message."""
 
@@ -43,6 +50,47 @@ class Like(db.Model):
         primary_key=True
     )
 
+    timestamp = db.Column(
+        db.DateTime,
+        nullable=False,
+        default=datetime.utcnow,
+        server_default=db.func.now(),
+    )
+
+    # the primary key leads with the user; this serves a message's likes
+    # (counts, cascades) without touching the table
+    __table_args__ = (
+        db.Index('ix_likes_message', 'message_id', 'user_id'),
+    )
+
+class TimelineEntry(db.Model):
+    """A message delivered to a user's home timeline."""
+
+    __tablename__ = 'timeline_entries'
+
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='CASCADE'),
+        primary_key=True
+    )
+
+    message_id = db.Column(
+        db.Integer,
+        db.ForeignKey('messages.id', ondelete='CASCADE'),
+        primary_key=True
+    )
+
+    # copy of the message timestamp so the home page can be read straight
+    # off the (user_id, timestamp) index
+    timestamp = db.Column(
+        db.DateTime,
+        nullable=False,
+    )
+
+    __table_args__ = (
+        db.Index('ix_timeline_entries_user_timestamp', 'user_id', 'timestamp'),
+    )
+
 class Message(db.Model):
     """An individual message ("warble")."""
 
@@ -70,10 +118,34 @@ class Message(db.Model):
         nullable=False,
     )
 
+    # denormalized; kept in step by the write paths (see counters.py)
+    like_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    # forward-decayed like total, kept in step by the like routes (see
+    # trending.py)
+    trend_score = db.Column(
+        db.Float,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
     user = db.relationship('User')
 
     likes = db.relationship("Like")
 
+    __table_args__ = (
+        # a user's messages, newest first, in keyset order
+        db.Index('ix_messages_user_timestamp', 'user_id', 'timestamp', 'id'),
+        # recent messages, for the trending refresh
+        db.Index('ix_messages_timestamp', 'timestamp'),
+    )
+
 
 
 class User(db.Model):
@@ -108,6 +180,15 @@ class User(db.Model):
         default="/static/images/warbler-hero.jpg"
     )
 
+    # uploaded pictures (see media.py); shown instead of the URLs above
+    image_key = db.Column(
+        db.Text,
+    )
+
+    header_image_key = db.Column(
+        db.Text,
+    )
+
     bio = db.Column(
         db.Text,
     )
@@ -121,6 +202,60 @@ class User(db.Model):
         nullable=False,
     )
 
+    # denormalized counts, kept in step by the write paths (see counters.py)
+    message_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    following_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    follower_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    liked_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    # too many followers to fan out on write; followers pull this user's
+    # messages when reading their timeline instead
+    fanout_on_read = db.Column(
+        db.Boolean,
+        nullable=False,
+        default=False,
+        server_default=db.false(),
+    )
+
+    # profile version: changes whenever the row does, except for counter
+    # bumps (see counters.py); ETags and cached fragments key on it
+    updated_at = db.Column(
+        db.DateTime,
+        nullable=False,
+        default=datetime.utcnow,
+        onupdate=datetime.utcnow,
+        server_default=db.func.now(),
+    )
+
+    # set when the account is deleted: from then on the user is hidden, and
+    # a purge_user job removes their rows in the background (see purge.py)
+    deleted_at = db.Column(
+        db.DateTime,
+    )
+
     messages = db.relationship('Message', order_by='Message.timestamp.desc()')
 
     followers = db.relationship(
@@ -150,20 +285,55 @@ class User(db.Model):
     def is_followed_by(self, other_user):
         """Is this user followed by `other_user`?"""
 
-        found_user_list = [user for user in self.followers if user == other_user]
-        return len(found_user_list) == 1
+        return self.id in other_user.following_ids([self.id])
 
     def is_following(self, other_user):
         """Is this user following `other_use`?"""
-        
-        found_user_list = [user for user in self.following if user == other_user]
-        return len(found_user_list) == 1
+
+        return other_user.id in self.following_ids([other_user.id])
 
     def is_like(self, message):
+        """Has this user liked `message`?"""
+
+        return message.id in self.liked_message_ids([message.id])
 
-        liked_list = [liked_message for liked_message in self.liked_messages if message.id == liked_message.id]
+    def following_ids(self, user_ids):
+        """Which of `user_ids` is this user following?
+
+        Answered from the in-memory follow graph when it is ready (see
+        graph.py), else with one indexed query; returns a set.
+        """
 
-        return len(liked_list) == 1
+        if not user_ids:
+            return set()
+
+        known = graph.following_ids(self.id, user_ids)
+        if known is not None:
+            return known
+
+        rows = (db.session
+                .query(Follows.user_being_followed_id)
+                .filter(Follows.user_following_id == self.id,
+                        Follows.user_being_followed_id.in_(user_ids)))
+
+        return {user_id for (user_id,) in rows}
+
+    def liked_message_ids(self, message_ids):
+        """Which of `message_ids` has this user liked?
+
+        One indexed query instead of walking `self.liked_messages`; returns
+        a set.
+        """
+
+        if not message_ids:
+            return set()
+
+        rows = (db.session
+                .query(Like.message_id)
+                .filter(Like.user_id == self.id,
+                        Like.message_id.in_(message_ids)))
+
+        return {message_id for (message_id,) in rows}
 
     @classmethod
     def signup(cls, username, email, password, image_url):
@@ -172,7 +342,7 @@ class User(db.Model):
         Hashes password and adds user to system.
         """
 
-        hashed_pwd = bcrypt.generate_password_hash(password).decode('UTF-8')
+        hashed_pwd = passwords.hash_password(password)
 
         user = User(
             username=username,
@@ -184,6 +354,12 @@ class User(db.Model):
         db.session.add(user)
         return user
 
+    @classmethod
+    def get_active_or_404(cls, user_id):
+        """The user with `user_id`; 404 if missing or deleted."""
+
+        return cls.query.filter_by(id=user_id, deleted_at=None).first_or_404()
+
     @classmethod
     def authenticate(cls, username, password):
         """Find user with `username` and `password`.
@@ -193,13 +369,21 @@ class User(db.Model):
         and, if it finds such a user, returns that user object.
 
         If can't find matching user (or if password is wrong), returns False.
+
+        If the hash was made with an old cost factor, it is replaced with one
+        at the current cost; the caller should commit.
+
+        Hashing runs in the password pool and may raise
+        passwords.PasswordHasherBusy.
         """
 
-        user = cls.query.filter_by(username=username).first()
+        user = cls.query.filter_by(username=username, deleted_at=None).first()
 
         if user:
-            is_auth = bcrypt.check_password_hash(user.password, password)
+            is_auth = passwords.check_password(user.password, password)
             if is_auth:
+                if passwords.needs_rehash(user.password):
+                    user.password = passwords.hash_password(password)
                 return user
 
         return False
@@ -208,6 +392,134 @@ class User(db.Model):
 
 
 
+class Suggestion(db.Model):
+    """Precomputed "who to follow" list for one user (see recommendations.py)."""
+
+    __tablename__ = 'suggestions'
+
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='CASCADE'),
+        primary_key=True,
+    )
+
+    # suggested user ids, best first
+    user_ids = db.Column(
+        db.JSON,
+        nullable=False,
+    )
+
+    computed_at = db.Column(
+        db.DateTime,
+        nullable=False,
+        default=datetime.utcnow,
+    )
+
+
+class TrendingMessage(db.Model):
+    """One place in the shared trending list (see trending.py)."""
+
+    __tablename__ = 'trending_messages'
+
+    # 0 is the hottest
+    position = db.Column(
+        db.Integer,
+        primary_key=True,
+        autoincrement=False,
+    )
+
+    message_id = db.Column(
+        db.Integer,
+        db.ForeignKey('messages.id', ondelete='CASCADE'),
+        nullable=False,
+    )
+
+    computed_at = db.Column(
+        db.DateTime,
+        nullable=False,
+        default=datetime.utcnow,
+    )
+
+
+class Job(db.Model):
+    """A unit of background work, run by worker.py (see jobs.py)."""
+
+    __tablename__ = 'jobs'
+
+    id = db.Column(
+        db.Integer,
+        primary_key=True,
+    )
+
+    # which handler runs it, and that handler's arguments
+    kind = db.Column(
+        db.String(50),
+        nullable=False,
+    )
+
+    payload = db.Column(
+        db.JSON,
+        nullable=False,
+        default=dict,
+    )
+
+    # queued -> running -> done, or back to queued to retry, or failed
+    state = db.Column(
+        db.String(20),
+        nullable=False,
+        default='queued',
+        server_default='queued',
+    )
+
+    # not to be started before this
+    run_at = db.Column(
+        db.DateTime,
+        nullable=False,
+        default=datetime.utcnow,
+    )
+
+    attempts = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    # handler-defined, saved after every step so a retry carries on from it
+    progress = db.Column(
+        db.JSON,
+        nullable=False,
+        default=dict,
+    )
+
+    # which worker holds it, and when it last showed signs of life
+    locked_by = db.Column(
+        db.String(100),
+    )
+
+    locked_at = db.Column(
+        db.DateTime,
+    )
+
+    last_error = db.Column(
+        db.Text,
+    )
+
+    created_at = db.Column(
+        db.DateTime,
+        nullable=False,
+        default=datetime.utcnow,
+    )
+
+    finished_at = db.Column(
+        db.DateTime,
+    )
+
+    __table_args__ = (
+        db.Index('ix_jobs_state_run_at', 'state', 'run_at'),
+    )
+
+
 def connect_db(app):
     """Connect this database to provided Flask app.
 
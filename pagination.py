@@ -0,0 +1,123 @@
+"""Keyset (cursor) pagination for list views.
+
+Pages are ordered newest first on one or more columns, e.g. (timestamp, id)
+for messages or (id) for users. The `?before=` cursor holds the sort key of
+the last row on the previous page, so fetching any page is one index range
+read however deep it is, unlike OFFSET.
+"""
+
+from datetime import datetime
+
+from flask import abort, current_app, request, url_for
+from sqlalchemy import DateTime, Float, tuple_
+
+CURSOR_SEPARATOR = '_'
+
+
+class Page:
+    """One page of results and the cursor for the next (older) page."""
+
+    def __init__(self, items, next_cursor):
+        self.items = items
+        self.next_cursor = next_cursor
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+def page_size():
+    """Number of rows per page (PAGE_SIZE config)."""
+
+    return current_app.config['PAGE_SIZE']
+
+
+def encode_cursor(values):
+    """Turn a sort key tuple into a `before` query string value."""
+
+    return CURSOR_SEPARATOR.join(
+        value.isoformat() if isinstance(value, datetime) else repr(value)
+        for value in values)
+
+
+def decode_cursor(raw, columns):
+    """Parse a `before` value into a sort key tuple for `columns`.
+
+    Returns None for the first page; aborts with a 400 if malformed.
+    """
+
+    if not raw:
+        return None
+
+    parts = raw.split(CURSOR_SEPARATOR)
+    if len(parts) != len(columns):
+        abort(400)
+
+    try:
+        return tuple(_parse_part(part, column)
+                     for part, column in zip(parts, columns))
+    except ValueError:
+        abort(400)
+
+
+def _parse_part(part, column):
+    if isinstance(column.type, DateTime):
+        return datetime.fromisoformat(part)
+    if isinstance(column.type, Float):
+        return float(part)
+    return int(part)
+
+
+def request_cursor(columns):
+    """Sort key tuple from the current request's `before` argument."""
+
+    return decode_cursor(request.args.get('before'), columns)
+
+
+def keyset(query, columns, cursor):
+    """Filter `query` to rows strictly before `cursor`, newest first."""
+
+    if cursor is not None:
+        if len(columns) == 1:
+            query = query.filter(columns[0] < cursor[0])
+        else:
+            query = query.filter(tuple_(*columns) < tuple_(*cursor))
+
+    return query.order_by(*[column.desc() for column in columns])
+
+
+def make_page(rows, size, columns):
+    """Build a Page from up to `size` + 1 rows fetched in sort order."""
+
+    items = rows[:size]
+    next_cursor = None
+
+    if len(rows) > size:
+        last = items[-1]
+        next_cursor = encode_cursor(
+            getattr(last, column.key) for column in columns)
+
+    return Page(items, next_cursor)
+
+
+def paginate(query, columns):
+    """Return the Page of `query` before the current request's cursor."""
+
+    size = page_size()
+    rows = (keyset(query, columns, request_cursor(columns))
+            .limit(size + 1)
+            .all())
+
+    return make_page(rows, size, columns)
+
+
+def older_url(next_cursor):
+    """URL of the current view with its `before` set to `next_cursor`."""
+
+    args = dict(request.view_args)
+    args.update(request.args.to_dict())
+    args['before'] = next_cursor
+
+    return url_for(request.endpoint, **args)
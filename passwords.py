@@ -0,0 +1,152 @@
+"""Password hashing and checking, off the request thread.
+
+bcrypt is deliberately slow CPU work. Rather than run it inline on the web
+worker, each hash or check goes to a small per-worker process pool of
+BCRYPT_POOL_SIZE processes (0 runs inline). At most BCRYPT_MAX_PENDING jobs
+may be queued or running at once; past that PasswordHasherBusy is raised
+straight away so the view can answer 503 instead of piling up requests
+behind a login burst. A hash that takes longer than BCRYPT_TIMEOUT seconds,
+or a pool whose process died, is reported the same way; a broken pool is
+replaced on the next call.
+
+New hashes use BCRYPT_LOG_ROUNDS. `needs_rehash` spots hashes made with a
+different cost so User.authenticate can upgrade them on the next login.
+"""
+
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+import bcrypt
+from flask import current_app, has_app_context
+
+# used when there is no app (e.g. model tests, scripts)
+DEFAULTS = {
+    'BCRYPT_LOG_ROUNDS': 12,
+    'BCRYPT_POOL_SIZE': min(4, os.cpu_count() or 1),
+    'BCRYPT_MAX_PENDING': 32,
+    'BCRYPT_TIMEOUT': 10,
+}
+
+
+class PasswordHasherBusy(Exception):
+    """Too many password hashes are already queued in this worker."""
+
+
+_pool = None
+_pool_lock = threading.Lock()
+_pending = None
+
+
+def _setting(name):
+    if has_app_context():
+        return current_app.config.get(name, DEFAULTS[name])
+    return DEFAULTS[name]
+
+
+def _hash(password, rounds):
+    return bcrypt.hashpw(password, bcrypt.gensalt(rounds))
+
+
+def _check(password, pw_hash):
+    return bcrypt.checkpw(password, pw_hash)
+
+
+def _get_pool():
+    """This worker's pool, started on first use (i.e. after any fork)."""
+
+    global _pool, _pending
+
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=_setting('BCRYPT_POOL_SIZE'))
+        if _pending is None:
+            _pending = threading.BoundedSemaphore(_setting('BCRYPT_MAX_PENDING'))
+
+    return _pool
+
+
+def _drop_pool(pool):
+    """Forget `pool` after one of its processes died, so the next call
+    starts a new one. Its queued jobs fail and give back their slots."""
+
+    global _pool
+
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False)
+
+
+def shutdown():
+    """Stop this worker's pool; the next hash starts a new one with the
+    settings of the time."""
+
+    global _pool, _pending
+
+    with _pool_lock:
+        pool, _pool, _pending = _pool, None, None
+    if pool is not None:
+        pool.shutdown(wait=False)
+
+
+def _run(fn, *args):
+    """Run `fn(*args)` in the pool, or inline if the pool is disabled."""
+
+    if _setting('BCRYPT_POOL_SIZE') <= 0:
+        return fn(*args)
+
+    pool = _get_pool()
+    pending = _pending
+
+    if not pending.acquire(blocking=False):
+        raise PasswordHasherBusy()
+
+    try:
+        future = pool.submit(fn, *args)
+    except BrokenProcessPool:
+        pending.release()
+        _drop_pool(pool)
+        raise PasswordHasherBusy()
+    except Exception:
+        pending.release()
+        raise
+
+    # the slot is held until the hash really finishes, even after a timeout
+    future.add_done_callback(lambda _: pending.release())
+
+    try:
+        return future.result(timeout=_setting('BCRYPT_TIMEOUT'))
+    except TimeoutError:
+        raise PasswordHasherBusy()
+    except BrokenProcessPool:
+        _drop_pool(pool)
+        raise PasswordHasherBusy()
+
+
+def hash_password(password):
+    """Return a bcrypt hash (str) of `password` at the configured cost."""
+
+    pw_hash = _run(_hash,
+                   password.encode('UTF-8'),
+                   _setting('BCRYPT_LOG_ROUNDS'))
+    return pw_hash.decode('UTF-8')
+
+
+def check_password(pw_hash, password):
+    """Does `password` match the stored bcrypt `pw_hash`?"""
+
+    return _run(_check, password.encode('UTF-8'), pw_hash.encode('UTF-8'))
+
+
+def hash_rounds(pw_hash):
+    """Cost factor a bcrypt hash was made with, e.g. 12 for $2b$12$..."""
+
+    return int(pw_hash.split('$')[2])
+
+
+def needs_rehash(pw_hash):
+    """Was `pw_hash` made with a different cost than is configured now?"""
+
+    return hash_rounds(pw_hash) != _setting('BCRYPT_LOG_ROUNDS')
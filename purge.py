@@ -0,0 +1,200 @@
+"""Account deletion.
+
+`delete_account(user)` only hides the user: it stamps `deleted_at`, which
+logins, profile pages, user lists and search all filter on, and queues a
+purge_user job (see jobs.py). The job then removes everything of theirs at
+most PURGE_BATCH_SIZE rows at a time, each batch in its own short
+transaction and adjusting the counters of the rows it touches, so no
+request waits on a cascade and no lock is held for long:
+
+1. their messages, newest first, with the likes and timeline entries of
+   each (so what others see goes first)
+2. the likes they gave
+3. who they follow, then their followers
+4. their own home timeline
+5. the pictures they uploaded
+6. their suggestions and the user row itself
+
+The job's progress records the current step and how many rows each step
+has removed.
+"""
+
+from datetime import datetime
+
+from flask import current_app
+
+import counters
+import jobs
+import media
+import search
+import trending
+from models import (db, Follows, Like, Message, Suggestion, TimelineEntry,
+                    User)
+
+
+def delete_account(user):
+    """Hide `user` now and queue the removal of their rows."""
+
+    user.deleted_at = datetime.utcnow()
+    search.forget_user(user.id)
+    jobs.enqueue('purge_user', user_id=user.id)
+
+
+def _likes_of(message_ids, liked_by=None):
+    """Undo the likes on `message_ids` (or just those by `liked_by`):
+    delete them and take their counts and trending weight back."""
+
+    half_life = current_app.config['TRENDING_HALF_LIFE']
+    likes = (db.session
+             .query(Like.user_id, Like.message_id, Like.timestamp,
+                    Message.timestamp)
+             .join(Message, Message.id == Like.message_id)
+             .filter(Like.message_id.in_(message_ids)))
+    if liked_by is not None:
+        likes = likes.filter(Like.user_id == liked_by)
+
+    user_deltas = {}
+    message_deltas = {}
+    for user_id, message_id, liked_at, posted in likes:
+        user_deltas.setdefault(user_id, {'liked_count': 0})
+        user_deltas[user_id]['liked_count'] -= 1
+        message_deltas.setdefault(message_id, {'like_count': 0, 'trend_score': 0.0})
+        message_deltas[message_id]['like_count'] -= 1
+        message_deltas[message_id]['trend_score'] -= trending.like_weight(
+            posted, liked_at, half_life)
+
+    connection = db.session.connection()
+    counters.bump_each(connection, User, user_deltas)
+    counters.bump_each(connection, Message, message_deltas)
+
+    deleted = Like.query.filter(Like.message_id.in_(message_ids))
+    if liked_by is not None:
+        deleted = deleted.filter(Like.user_id == liked_by)
+    deleted.delete(synchronize_session=False)
+
+
+def _messages(user_id, size):
+    ids = [message_id for (message_id,) in (
+        db.session
+        .query(Message.id)
+        .filter(Message.user_id == user_id)
+        .order_by(Message.timestamp.desc(), Message.id.desc())
+        .limit(size))]
+
+    if ids:
+        _likes_of(ids)
+        (TimelineEntry
+         .query
+         .filter(TimelineEntry.message_id.in_(ids))
+         .delete(synchronize_session=False))
+        Message.query.filter(Message.id.in_(ids)).delete(synchronize_session=False)
+
+    return len(ids)
+
+
+def _likes_given(user_id, size):
+    ids = [message_id for (message_id,) in (
+        db.session
+        .query(Like.message_id)
+        .filter(Like.user_id == user_id)
+        .limit(size))]
+
+    if ids:
+        _likes_of(ids, liked_by=user_id)
+
+    return len(ids)
+
+
+def _following(user_id, size):
+    ids = [followed_id for (followed_id,) in (
+        db.session
+        .query(Follows.user_being_followed_id)
+        .filter(Follows.user_following_id == user_id)
+        .limit(size))]
+
+    if ids:
+        (Follows
+         .query
+         .filter(Follows.user_following_id == user_id,
+                 Follows.user_being_followed_id.in_(ids))
+         .delete(synchronize_session=False))
+        counters.bump_where(User, User.id.in_(ids), follower_count=-1)
+
+    return len(ids)
+
+
+def _followers(user_id, size):
+    ids = [follower_id for (follower_id,) in (
+        db.session
+        .query(Follows.user_following_id)
+        .filter(Follows.user_being_followed_id == user_id)
+        .limit(size))]
+
+    if ids:
+        (Follows
+         .query
+         .filter(Follows.user_being_followed_id == user_id,
+                 Follows.user_following_id.in_(ids))
+         .delete(synchronize_session=False))
+        counters.bump_where(User, User.id.in_(ids), following_count=-1)
+
+    return len(ids)
+
+
+def _timeline(user_id, size):
+    ids = [message_id for (message_id,) in (
+        db.session
+        .query(TimelineEntry.message_id)
+        .filter(TimelineEntry.user_id == user_id)
+        .limit(size))]
+
+    if ids:
+        (TimelineEntry
+         .query
+         .filter(TimelineEntry.user_id == user_id,
+                 TimelineEntry.message_id.in_(ids))
+         .delete(synchronize_session=False))
+
+    return len(ids)
+
+
+def _media(user_id, size):
+    media.forget_user(user_id)
+    return 0
+
+
+def _account(user_id, size):
+    Suggestion.query.filter_by(user_id=user_id).delete(synchronize_session=False)
+    return User.query.filter_by(id=user_id).delete(synchronize_session=False)
+
+
+STEPS = [
+    ('messages', _messages),
+    ('likes', _likes_given),
+    ('following', _following),
+    ('followers', _followers),
+    ('timeline', _timeline),
+    ('media', _media),
+    ('account', _account),
+]
+
+
+@jobs.handler('purge_user')
+def purge_user(job):
+    """One batch of removing a deleted user; True once they are gone."""
+
+    user_id = job.payload['user_id']
+    size = current_app.config['PURGE_BATCH_SIZE']
+    step = job.progress.get('step', 0)
+    deleted = dict(job.progress.get('deleted', {}))
+
+    name, purge_step = STEPS[step]
+    removed = purge_step(user_id, size)
+    deleted[name] = deleted.get(name, 0) + removed
+
+    # a short batch means this step has nothing left
+    if removed < size or name == 'account':
+        step += 1
+
+    job.progress = {'step': step, 'deleted': deleted}
+    return step == len(STEPS)
@@ -0,0 +1,144 @@
+"""Read replica routing and connection pool stats.
+
+With a `replica` bind configured (REPLICA_DATABASE_URL), GET requests to
+the pages in READ_ENDPOINTS run their SELECTs against the replica instead
+of the primary. Anything else (writes, and every statement after the
+session's first write) still goes to the primary.
+
+Replicas lag, so a user who has just changed something would often not see
+it. Every successful write request (any method but GET/HEAD/OPTIONS) stamps
+the session, and that user's reads stay on the primary for
+REPLICA_STICKY_SECONDS afterwards.
+
+Pool sizes, overflow, recycle and pre-ping come from
+SQLALCHEMY_ENGINE_OPTIONS and apply to both binds. The options and each
+pool's live state are reported in /metrics, along with how many requests
+were read from the replica or kept on the primary by a recent write.
+"""
+
+import threading
+import time
+
+from flask import current_app, g, has_request_context, request, session
+from flask_sqlalchemy import SQLAlchemy, SignallingSession, get_state
+from sqlalchemy import orm
+
+import instrumentation
+
+REPLICA_BIND = 'replica'
+
+READ_ENDPOINTS = {
+    'list_users',
+    'users_show',
+    'show_following',
+    'users_followers',
+    'show_likes',
+    'messages_show',
+}
+
+# session key: when this user last made a write request
+WRITE_KEY = 'db_written_at'
+
+READ_METHODS = {'GET', 'HEAD', 'OPTIONS'}
+
+_counts = {'replica': 0, 'sticky': 0}
+_counts_lock = threading.Lock()
+
+
+class RoutingSession(SignallingSession):
+    """A session that sends SELECTs to the replica when the request allows.
+
+    Once the session has used the primary for anything but a SELECT, it
+    stays there, so it reads back what it wrote.
+    """
+
+    _wrote = False
+
+    def get_bind(self, mapper=None, clause=None):
+        if not self._wrote and _reading_from_replica():
+            if getattr(clause, 'is_select', False) and not self._flushing:
+                return get_state(self.app).db.get_engine(self.app,
+                                                         bind=REPLICA_BIND)
+
+        if not getattr(clause, 'is_select', False):
+            self._wrote = True
+
+        return super().get_bind(mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    """Flask-SQLAlchemy with RoutingSession sessions."""
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+def _reading_from_replica():
+    return has_request_context() and g.get('_read_replica', False)
+
+
+def has_replica(app):
+    return REPLICA_BIND in (app.config.get('SQLALCHEMY_BINDS') or {})
+
+
+def _count(where):
+    with _counts_lock:
+        _counts[where] += 1
+
+
+def _route_request(app):
+    if request.method not in READ_METHODS or request.endpoint not in READ_ENDPOINTS:
+        return
+    if not has_replica(app):
+        return
+
+    written_at = session.get(WRITE_KEY)
+    if written_at and time.time() - written_at < app.config['REPLICA_STICKY_SECONDS']:
+        _count('sticky')
+        return
+
+    g._read_replica = True
+    _count('replica')
+
+
+def _note_write(response):
+    if request.method not in READ_METHODS and response.status_code < 400:
+        session[WRITE_KEY] = time.time()
+
+    return response
+
+
+def pool_stats(engine):
+    """The live state of `engine`'s connection pool."""
+
+    pool = engine.pool
+    report = {'pool': type(pool).__name__}
+
+    for name in ('size', 'checkedin', 'checkedout', 'overflow'):
+        method = getattr(pool, name, None)
+        if callable(method):
+            report[name] = method()
+
+    return report
+
+
+def init_app(app, db):
+    """Route `app`'s read pages to the replica bind, when there is one."""
+
+    app.before_request(lambda: _route_request(app))
+    app.after_request(_note_write)
+
+    def stats():
+        # the app serving /metrics, which needn't be the last one set up
+        app = current_app._get_current_object()
+        report = {
+            'engine_options': app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {}),
+            'primary': pool_stats(db.get_engine(app)),
+        }
+        if has_replica(app):
+            report['replica'] = pool_stats(db.get_engine(app, bind=REPLICA_BIND))
+        with _counts_lock:
+            report['read_requests'] = dict(_counts)
+        return report
+
+    instrumentation.register_metrics('database', stats)
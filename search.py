@@ -0,0 +1,300 @@
+"""Ranked search over users (username, bio) and messages (text).
+
+On PostgreSQL, pg_trgm GIN indexes serve substring and prefix matches on
+users.username and users.bio, and a tsvector GIN index serves message text.
+The database keeps those indexes current on its own.
+
+On SQLite, FTS5 tables (users_fts, messages_fts, rowid = the row's id) play
+the same role. They are updated incrementally by the write paths through
+index_user / unindex_user / index_message / unindex_message, which are
+no-ops on PostgreSQL.
+
+migrations/009_search_indexes.sql (or `flask init-search`) creates the
+indexes once per database; seed.py does this after loading. User search
+needs pg_trgm's similarity functions, so until the extension is installed
+it ranks with plain ILIKE matches instead of failing.
+"""
+
+import logging
+import re
+
+from sqlalchemy import (Float, Integer, column, func, literal_column, or_, select,
+                        table, text, tuple_)
+from sqlalchemy.orm import contains_eager
+
+from models import db, Message, User
+from pagination import Page, decode_cursor, encode_cursor, page_size
+
+logger = logging.getLogger('warbler.search')
+
+TS_CONFIG = 'english'
+
+# only the first few words of a query are used
+MAX_TERMS = 8
+
+TERM_RE = re.compile(r'\w+')
+
+POSTGRES_DDL = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX IF NOT EXISTS ix_users_username_trgm "
+    "ON users USING gin (username gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS ix_users_bio_trgm "
+    "ON users USING gin (bio gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS ix_messages_text_tsv "
+    f"ON messages USING gin (to_tsvector('{TS_CONFIG}', text))",
+]
+
+SQLITE_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS users_fts "
+    "USING fts5(username, bio, prefix='2 3')",
+    "CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts "
+    "USING fts5(text, prefix='2 3')",
+]
+
+users_fts = table('users_fts', column('rowid'), column('username'), column('bio'))
+messages_fts = table('messages_fts', column('rowid'), column('text'))
+
+# database URLs whose FTS5 tables are known to exist in this process
+_fts5_ready = set()
+
+# database URL -> whether it has pg_trgm, as first seen by this process
+_has_trgm = {}
+
+
+def _uses_fts5():
+    return db.engine.dialect.name == 'sqlite'
+
+
+def install():
+    """Create the search indexes (and fill them, on SQLite)."""
+
+    if _uses_fts5():
+        for statement in SQLITE_DDL:
+            db.session.execute(text(statement))
+        rebuild()
+    else:
+        for statement in POSTGRES_DDL:
+            db.session.execute(text(statement))
+        _has_trgm[str(db.engine.url)] = True
+
+
+def rebuild():
+    """Refill the SQLite FTS5 tables from `users` and `messages`."""
+
+    if not _uses_fts5():
+        return
+
+    db.session.execute(users_fts.delete())
+    db.session.execute(users_fts.insert().from_select(
+        ['rowid', 'username', 'bio'],
+        select(User.id, User.username, func.coalesce(User.bio, ''))))
+
+    db.session.execute(messages_fts.delete())
+    db.session.execute(messages_fts.insert().from_select(
+        ['rowid', 'text'],
+        select(Message.id, Message.text)))
+
+
+def _ensure_fts5():
+    """Create the FTS5 tables on first use in a fresh SQLite database."""
+
+    url = str(db.engine.url)
+    if url in _fts5_ready:
+        return
+
+    exists = db.session.execute(text(
+        "SELECT count(*) FROM sqlite_master WHERE name = 'users_fts'")).scalar()
+    if not exists:
+        install()
+
+    _fts5_ready.add(url)
+
+
+def index_user(user):
+    """Add or refresh `user` in the search index (flushed users only)."""
+
+    if not _uses_fts5():
+        return
+
+    _ensure_fts5()
+    unindex_user(user.id)
+    db.session.execute(users_fts.insert().values(
+        rowid=user.id, username=user.username, bio=user.bio or ''))
+
+
+def unindex_user(user_id):
+    """Remove a user from the search index."""
+
+    if not _uses_fts5():
+        return
+
+    _ensure_fts5()
+    db.session.execute(users_fts.delete().where(users_fts.c.rowid == user_id))
+
+
+def index_message(message):
+    """Add or refresh a flushed message in the search index."""
+
+    if not _uses_fts5():
+        return
+
+    _ensure_fts5()
+    unindex_message(message.id)
+    db.session.execute(messages_fts.insert().values(
+        rowid=message.id, text=message.text))
+
+
+def unindex_message(message_id):
+    """Remove a message from the search index."""
+
+    if not _uses_fts5():
+        return
+
+    _ensure_fts5()
+    db.session.execute(
+        messages_fts.delete().where(messages_fts.c.rowid == message_id))
+
+
+def forget_user(user_id):
+    """Remove a user and all their messages from the search index."""
+
+    if not _uses_fts5():
+        return
+
+    _ensure_fts5()
+    unindex_user(user_id)
+    db.session.execute(messages_fts.delete().where(
+        messages_fts.c.rowid.in_(
+            select(Message.id).where(Message.user_id == user_id))))
+
+
+def _uses_trgm():
+    """Is pg_trgm installed? Checked once per database and process."""
+
+    url = str(db.engine.url)
+    if url not in _has_trgm:
+        _has_trgm[url] = bool(db.session.execute(text(
+            "SELECT count(*) FROM pg_extension WHERE extname = 'pg_trgm'")).scalar())
+        if not _has_trgm[url]:
+            logger.warning("pg_trgm isn't installed; user search ranks by "
+                           "ILIKE matches (see migrations/009_search_indexes.sql)")
+
+    return _has_trgm[url]
+
+
+def _terms(query):
+    return TERM_RE.findall(query.lower())[:MAX_TERMS]
+
+
+def _fts5_match(terms):
+    """FTS5 query matching every term as a prefix."""
+
+    return ' '.join(f'"{term}"*' for term in terms)
+
+
+def _fts5_ranked(fts_table, terms):
+    """Subquery of (rowid, score) for an FTS5 match, best first."""
+
+    fts = literal_column(fts_table.name)
+    return (select(fts_table.c.rowid.label('id'),
+                   (-func.bm25(fts, type_=Float)).label('score'))
+            .where(fts.op('MATCH')(_fts5_match(terms)))
+            .subquery())
+
+
+def _like_pattern(query):
+    escaped = (query.replace('\\', '\\\\')
+                    .replace('%', '\\%')
+                    .replace('_', '\\_'))
+    return f'%{escaped}%'
+
+
+def _page(query, score, id_column, before):
+    """Keyset-paginate a query of (row, score) on (score, id), best first."""
+
+    columns = (score, id_column)
+    cursor = decode_cursor(before, columns)
+    if cursor is not None:
+        query = query.filter(tuple_(*columns) < tuple_(*cursor))
+
+    size = page_size()
+    rows = (query
+            .order_by(score.desc(), id_column.desc())
+            .limit(size + 1)
+            .all())
+
+    items = [row for row, _ in rows[:size]]
+    next_cursor = None
+    if len(rows) > size:
+        last, last_score = rows[size - 1]
+        next_cursor = encode_cursor((last_score, last.id))
+
+    return Page(items, next_cursor)
+
+
+def search_users(query, before=None):
+    """Page of users whose username or bio matches `query`, best first."""
+
+    terms = _terms(query)
+    if not terms:
+        return Page([], None)
+
+    if _uses_fts5():
+        _ensure_fts5()
+        ranked = _fts5_ranked(users_fts, terms)
+        score = ranked.c.score
+        matches = (db.session
+                   .query(User, score)
+                   .join(ranked, ranked.c.id == User.id)
+                   .filter(User.deleted_at.is_(None)))
+    else:
+        phrase = ' '.join(terms)
+        pattern = _like_pattern(phrase)
+        if _uses_trgm():
+            score = (func.similarity(User.username, phrase)
+                     + 0.5 * func.word_similarity(phrase,
+                                                  func.coalesce(User.bio, '')))
+        else:
+            score = (User.username.ilike(pattern).cast(Integer)
+                     + 0.5 * func.coalesce(User.bio.ilike(pattern), False)
+                     .cast(Integer))
+        score = score.cast(Float)
+        matches = (db.session
+                   .query(User, score)
+                   .filter(or_(User.username.ilike(pattern),
+                               User.bio.ilike(pattern)),
+                           User.deleted_at.is_(None)))
+
+    return _page(matches, score, User.id, before)
+
+
+def search_messages(query, before=None):
+    """Page of messages whose text matches `query`, best first."""
+
+    terms = _terms(query)
+    if not terms:
+        return Page([], None)
+
+    if _uses_fts5():
+        _ensure_fts5()
+        ranked = _fts5_ranked(messages_fts, terms)
+        score = ranked.c.score
+        matches = (db.session
+                   .query(Message, score)
+                   .join(ranked, ranked.c.id == Message.id))
+    else:
+        tsquery = func.to_tsquery(TS_CONFIG,
+                                  ' & '.join(f'{term}:*' for term in terms))
+        tsvector = func.to_tsvector(TS_CONFIG, Message.text)
+        score = func.ts_rank(tsvector, tsquery).cast(Float)
+        matches = (db.session
+                   .query(Message, score)
+                   .filter(tsvector.op('@@')(tsquery)))
+
+    # deleted accounts' messages are hidden before the purge reaches them
+    matches = (matches
+               .join(Message.user)
+               .options(contains_eager(Message.user))
+               .filter(User.deleted_at.is_(None)))
+
+    return _page(matches, score, Message.id, before)
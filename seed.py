@@ -1,19 +1,205 @@
-"""Seed database with sample data from CSV Files."""
+"""Seed database with sample data from CSV Files.
 
-from csv import DictReader
-from app import db
-from models import User, Message, Follows, Like
+    python seed.py                          # drop, recreate, load generator/
+    python seed.py --data-dir data/big --batch-size 100000
+    python seed.py --resume                 # carry on after an interruption
 
-db.drop_all()
-db.create_all()
+Each CSV (users, messages, follows and, if present, likes) is streamed in
+fixed-size batches, so memory use doesn't grow with the file. PostgreSQL
+batches go in with COPY FROM STDIN; other databases use executemany.
 
-with open('generator/users.csv') as users:
-    db.session.bulk_insert_mappings(User, DictReader(users))
+Every batch commits together with its row count in `seed_progress`, so a
+load that dies part way can be resumed with --resume. Users and messages
+get their CSV row number as id, which keeps the references in later files
+valid however often a load is restarted.
 
-with open('generator/messages.csv') as messages:
-    db.session.bulk_insert_mappings(Message, DictReader(messages))
+Secondary indexes are dropped before loading and rebuilt afterwards, and
+then the counters, home timelines and search indexes are computed.
+"""
 
-with open('generator/follows.csv') as follows:
-    db.session.bulk_insert_mappings(Follows, DictReader(follows))
+import argparse
+import csv
+import io
+import os
+import sys
+import time
+from itertools import islice
 
-db.session.commit()
+from sqlalchemy import Column, Integer, MetaData, String, Table, select, text
+
+from app import app, db
+from models import User, Message, Follows, Like, TimelineEntry
+import counters
+import search
+import timeline
+
+# (table, CSV file, whether rows get their row number as id), in load order
+SOURCES = [
+    (User.__table__, 'users.csv', True),
+    (Message.__table__, 'messages.csv', True),
+    (Follows.__table__, 'follows.csv', False),
+    (Like.__table__, 'likes.csv', False),
+]
+
+# tables whose secondary indexes are dropped during the load
+INDEXED_TABLES = [source[0] for source in SOURCES] + [TimelineEntry.__table__]
+
+progress_metadata = MetaData()
+
+seed_progress = Table(
+    'seed_progress', progress_metadata,
+    Column('table_name', String, primary_key=True),
+    Column('rows_loaded', Integer, nullable=False),
+)
+
+
+def report(table_name, loaded, started):
+    rate = loaded / max(time.monotonic() - started, 1e-9)
+    print(f"{table_name}: {loaded:,} rows ({rate:,.0f} rows/s)",
+          file=sys.stderr, flush=True)
+
+
+def batches(rows, size):
+    """Split an iterator of rows into lists of at most `size`."""
+
+    while True:
+        batch = list(islice(rows, size))
+        if not batch:
+            return
+        yield batch
+
+
+def placeholder():
+    """The DB-API parameter marker for the database driver."""
+
+    paramstyle = db.engine.dialect.dbapi.paramstyle
+    return '?' if paramstyle == 'qmark' else '%s'
+
+
+def copy_batch(cursor, table_name, columns, batch):
+    """Load one batch with PostgreSQL's COPY FROM STDIN."""
+
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(batch)
+    buffer.seek(0)
+
+    cursor.copy_expert(
+        f"COPY {table_name} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)",
+        buffer)
+
+
+def insert_batch(cursor, table_name, columns, batch, marker):
+    """Load one batch with executemany."""
+
+    cursor.executemany(
+        f"INSERT INTO {table_name} ({', '.join(columns)}) "
+        f"VALUES ({', '.join([marker] * len(columns))})",
+        batch)
+
+
+def load_table(table, path, numbered, batch_size, loaded):
+    """Stream one CSV into `table`, skipping the `loaded` rows already in."""
+
+    use_copy = db.engine.dialect.name == 'postgresql'
+    connection = db.engine.raw_connection()
+    marker = placeholder()
+    started = time.monotonic()
+
+    try:
+        cursor = connection.cursor()
+
+        with open(path, newline='') as source:
+            reader = csv.reader(source)
+            columns = next(reader)
+            if numbered:
+                columns = ['id'] + columns
+                reader = ([str(number)] + row
+                          for number, row in enumerate(reader, start=1))
+
+            rows = islice(reader, loaded, None)
+
+            for batch in batches(rows, batch_size):
+                if use_copy:
+                    copy_batch(cursor, table.name, columns, batch)
+                else:
+                    insert_batch(cursor, table.name, columns, batch, marker)
+
+                loaded += len(batch)
+                cursor.execute(
+                    f"UPDATE seed_progress SET rows_loaded = {marker} "
+                    f"WHERE table_name = {marker}",
+                    (loaded, table.name))
+                connection.commit()
+                report(table.name, loaded, started)
+    finally:
+        connection.close()
+
+
+def reset_sequences():
+    """Move id sequences past the ids loaded from the CSVs (PostgreSQL)."""
+
+    if db.engine.dialect.name != 'postgresql':
+        return
+
+    for table in (User.__table__, Message.__table__):
+        db.session.execute(text(
+            f"SELECT setval(pg_get_serial_sequence('{table.name}', 'id'), "
+            f"COALESCE((SELECT max(id) FROM {table.name}), 0) + 1, false)"))
+
+
+def seed(data_dir, batch_size, resume):
+    if not resume:
+        db.drop_all()
+        progress_metadata.drop_all(db.engine)
+        db.create_all()
+        progress_metadata.create_all(db.engine)
+
+        with db.engine.begin() as connection:
+            connection.execute(seed_progress.insert(), [
+                {'table_name': table.name, 'rows_loaded': 0}
+                for table, _, _ in SOURCES])
+
+    # indexes are much cheaper to build once over the loaded data
+    for table in INDEXED_TABLES:
+        for index in table.indexes:
+            index.drop(db.engine, checkfirst=True)
+
+    with db.engine.connect() as connection:
+        progress = dict(connection.execute(select(seed_progress)).all())
+
+    for table, filename, numbered in SOURCES:
+        path = os.path.join(data_dir, filename)
+        if os.path.exists(path):
+            load_table(table, path, numbered, batch_size,
+                       progress.get(table.name, 0))
+
+    print("creating indexes", file=sys.stderr, flush=True)
+    for table in INDEXED_TABLES:
+        for index in table.indexes:
+            index.create(db.engine, checkfirst=True)
+
+    # bulk loads skip the write paths, so compute the counters, build the
+    # home timelines and the search indexes here
+    print("computing counters, timelines and search", file=sys.stderr, flush=True)
+    with app.app_context():
+        reset_sequences()
+        counters.reconcile()
+        timeline.rebuild_timelines()
+        search.install()
+        db.session.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load Warbler CSV data.")
+    parser.add_argument('--data-dir', default='generator')
+    parser.add_argument('--batch-size', type=int, default=10000)
+    parser.add_argument('--resume', action='store_true',
+                        help="continue an interrupted load instead of "
+                             "starting from empty tables")
+    args = parser.parse_args()
+
+    seed(args.data_dir, args.batch_size, args.resume)
+
+
+if __name__ == '__main__':
+    main()
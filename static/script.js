@@ -1,68 +1,34 @@
 "use strict";
 
-let $likeIcon = $(".fa-star");
-const BASE_URL = "http://localhost:5000";
-
-async function addLike(msgId) {
-  console.debug("addLike");
-  try {
-    const resp = await axios({
-      url: BASE_URL + `/like/${msgId}`,
-      method: "POST",
-      headers: {
-        "Content-Type": "application/json",
-      },
-    });
-    console.debug("resp", resp);
-    return resp.data.result;
-  } catch (error) {
-    console.log("error", error);
-  }
-  // const resp = await axios({
-  //   url: BASE_URL + `/like/${msgId}`,
-  //   method: "POST",
-  // });
-
-  // return resp.data.result;
-}
-
-async function dislike(msgId) {
-  console.debug("dislike");
+/** Like or unlike a message without reloading the page.
+ *
+ * Each like star is a form posting to /messages/<id>/like, which still works
+ * without this script. Here we send PUT (like) or DELETE (unlike) to the JSON
+ * API instead and redraw just the star from the state it answers with.
+ */
+
+async function setLike(msgId, liked) {
   const resp = await axios({
-    url: BASE_URL + `/like/stop-liking/${msgId}`,
-    method: "POST",
+    url: `/api/messages/${msgId}/like`,
+    method: liked ? "PUT" : "DELETE",
   });
 
-  return resp.data.result;
-  //const resp await delete view
+  return resp.data;
 }
 
-async function togglelikeUI(evt) {
-  console.debug("toggleLikeUI");
-  // let msgStar = evt.target   msg star = solidstar
-  //msg =  solid star
-  //     dislike
-  // msg = emptystar
-  //     dislike
+async function toggleLikeUI(evt) {
+  evt.preventDefault();
 
-  let msgId = evt.target.id;
-  let starClass = $(evt.target).attr("class");
-  console.log(starClass);
-  console.log(msgId);
-  let resp;
-  if (starClass === "fa-star fas") {
-    resp = await dislike(msgId);
-  } else if (starClass === "fa-star far") {
-    resp = await addLike(msgId);
-  }
+  const $form = $(evt.currentTarget);
+  const $star = $form.find(".fa-star");
+  const msgId = $form.data("message-id");
 
-  if (resp === "like") {
-    $(evt.target).removeClass("far");
-    $(evt.target).addClass("fas");
-  } else if (resp === "dislike") {
-    $(evt.target).removeClass("fas");
-    $(evt.target).addClass("far");
+  try {
+    const { liked } = await setLike(msgId, !$star.hasClass("fas"));
+    $star.toggleClass("fas", liked).toggleClass("far", !liked);
+  } catch (error) {
+    console.error("like failed", error);
   }
 }
 
-$(".fa-star").on("click", togglelikeUI);
+$("#messages").on("submit", ".messages-like-bottom", toggleLikeUI);
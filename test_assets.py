@@ -0,0 +1,128 @@
+"""Static asset pipeline tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_assets.py
+
+
+import gzip
+import json
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from flask import g
+
+from app import create_app
+import assets
+import caching
+
+# Build an app of our own, serving assets built into a scratch directory
+
+build_dir = tempfile.TemporaryDirectory()
+
+app = create_app('testing', SQLALCHEMY_DATABASE_URI="postgresql:///warbler-test",
+                 ASSETS_DIR=build_dir.name)
+
+STYLESHEET = b"""
+body { background: url("/static/images/dot.png"); }
+.other { background: url('/static/images/missing.png'); }
+""" + b"/* padding so it compresses */\n" * 20
+
+
+class AssetsTestCase(TestCase):
+    """Test building assets and serving them."""
+
+    @classmethod
+    def setUpClass(cls):
+        with tempfile.TemporaryDirectory() as source:
+            os.makedirs(os.path.join(source, 'images'))
+            os.makedirs(os.path.join(source, 'stylesheets'))
+            shutil.copy(os.path.join(app.static_folder, 'images', 'nav-bg.png'),
+                        os.path.join(source, 'images', 'dot.png'))
+            with open(os.path.join(source, 'stylesheets', 'style.css'), 'wb') as file:
+                file.write(STYLESHEET)
+
+            cls.manifest = assets.build(source, build_dir.name, 1600)
+
+    def test_build(self):
+        """Are files fingerprinted, compressed and linked to each other?"""
+
+        css = self.manifest['stylesheets/style.css']
+        png = self.manifest['images/dot.png']
+
+        self.assertRegex(css['file'], r'^stylesheets/style\.[0-9a-f]{12}\.css$')
+        self.assertIn('gzip', css['encodings'])
+        self.assertEqual(png['encodings'], [])
+
+        with open(os.path.join(build_dir.name, css['file']), 'rb') as file:
+            built = file.read()
+        self.assertIn(f'url("/assets/{png["file"]}")'.encode(), built)
+        self.assertIn(b"url('/static/images/missing.png')", built)
+
+        with open(os.path.join(build_dir.name, css['file'] + '.gz'), 'rb') as file:
+            self.assertEqual(gzip.decompress(file.read()), built)
+
+        with open(os.path.join(build_dir.name, 'manifest.json')) as file:
+            self.assertEqual(json.load(file), self.manifest)
+
+    def test_static_url(self):
+        """Does static_url give built files' URLs, and others unchanged?"""
+
+        with app.test_request_context():
+            css = self.manifest['stylesheets/style.css']['file']
+            self.assertEqual(assets.static_url('stylesheets/style.css'),
+                             f"/assets/{css}")
+            self.assertEqual(assets.static_url('/static/images/dot.png'),
+                             f"/assets/{self.manifest['images/dot.png']['file']}")
+            self.assertEqual(assets.static_url('script.js'), "/static/script.js")
+            self.assertEqual(assets.static_url('https://example.com/a.png'),
+                             "https://example.com/a.png")
+
+    def test_serve(self):
+        """Are built files served immutable, compressed when accepted?"""
+
+        css = self.manifest['stylesheets/style.css']['file']
+        client = app.test_client()
+
+        resp = client.get(f"/assets/{css}", headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(resp.mimetype, 'text/css')
+        self.assertIn('Accept-Encoding', resp.headers['Vary'])
+        self.assertIn('immutable', resp.headers['Cache-Control'])
+        self.assertIn(f'max-age={assets.MAX_AGE}', resp.headers['Cache-Control'])
+        self.assertIn(b'url("/assets/', gzip.decompress(resp.get_data()))
+        resp.close()
+
+        resp = client.get(f"/assets/{css}")
+        self.assertNotIn('Content-Encoding', resp.headers)
+        self.assertIn(b'url("/assets/', resp.get_data())
+        resp.close()
+
+        self.assertEqual(client.get("/assets/stylesheets/nope.css").status_code, 404)
+
+    def test_etag_follows_build(self):
+        """Do page ETags change when the asset build does?"""
+
+        def etag():
+            with app.test_request_context('/users/1'):
+                g.user = None
+                caching.check_etag('same page')
+                return g._etag
+
+        built = etag()
+
+        # a deploy whose build has other files (here: none at all)
+        with tempfile.TemporaryDirectory() as empty:
+            saved = app.config['ASSETS_DIR'], dict(app.extensions['assets'])
+            app.config['ASSETS_DIR'] = empty
+            app.extensions['assets'].clear()
+            try:
+                self.assertNotEqual(etag(), built)
+            finally:
+                app.config['ASSETS_DIR'] = saved[0]
+                app.extensions['assets'].update(saved[1])
+
+        self.assertEqual(etag(), built)
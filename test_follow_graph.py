@@ -0,0 +1,122 @@
+"""Follow graph tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_follow_graph.py
+
+
+from unittest import TestCase
+
+from flask import session
+
+from models import db, User, Follows
+
+from app import create_app
+import graph
+
+# Build an app of our own against a different database for tests
+
+app = create_app('testing', SQLALCHEMY_DATABASE_URI="postgresql:///warbler-test")
+
+db.create_all()
+
+
+class FollowGraphTestCase(TestCase):
+    """Test the in-memory follow graph against the follows table."""
+
+    def setUp(self):
+        """Create four users: 1 and 2 follow each other, 1 and 3 follow 4."""
+
+        Follows.query.delete()
+        User.query.delete()
+
+        users = [User(username=f"user{n}", email=f"user{n}@test.com",
+                      password="HASHED_PASSWORD")
+                 for n in range(4)]
+        db.session.add_all(users)
+        db.session.commit()
+
+        self.ids = [user.id for user in users]
+        one, two, three, four = self.ids
+
+        db.session.add_all([
+            Follows(user_following_id=one, user_being_followed_id=two),
+            Follows(user_following_id=two, user_being_followed_id=one),
+            Follows(user_following_id=one, user_being_followed_id=four),
+            Follows(user_following_id=three, user_being_followed_id=four),
+        ])
+        db.session.commit()
+
+        self.graph, _ = graph.build(db.engine, budget=60)
+
+    def tearDown(self):
+        """Clean up any fouled transaction."""
+
+        db.session.rollback()
+
+    def test_build(self):
+        """Does the graph answer membership, degree and mutual follows?"""
+
+        one, two, three, four = self.ids
+
+        self.assertTrue(self.graph.is_following(one, two))
+        self.assertFalse(self.graph.is_following(four, one))
+        self.assertEqual(self.graph.following_ids(one, [two, three, four]),
+                         {two, four})
+        self.assertEqual(self.graph.following_count(one), 2)
+        self.assertEqual(self.graph.follower_count(four), 2)
+        self.assertEqual(self.graph.mutual_ids(one), [two])
+        self.assertEqual(self.graph.edge_count(), 4)
+
+        # users newer than the graph are simply unknown
+        self.assertFalse(self.graph.is_following(four + 100, one))
+        self.assertEqual(self.graph.follower_count(four + 100), 0)
+
+    def test_overlay(self):
+        """Are follows and unfollows reflected before the next rebuild?"""
+
+        one, two, three, four = self.ids
+
+        self.graph.add(four, one)
+        self.graph.remove(one, two)
+
+        self.assertTrue(self.graph.is_following(four, one))
+        self.assertFalse(self.graph.is_following(one, two))
+        self.assertEqual(self.graph.following_count(one), 1)
+        self.assertEqual(self.graph.follower_count(one), 2)
+        self.assertEqual(self.graph.mutual_ids(one), [four])
+        self.assertEqual(self.graph.edge_count(), 4)
+
+        # a rebuild keeps changes made while it was reading
+        rebuilt, _ = graph.build(db.engine, budget=60)
+        rebuilt.adopt_changes(self.graph, since=0)
+
+        self.assertTrue(rebuilt.is_following(four, one))
+        self.assertFalse(rebuilt.is_following(one, two))
+
+        self.graph.forget_user(four)
+
+        self.assertFalse(self.graph.is_following(one, four))
+        self.assertEqual(self.graph.follower_count(four), 0)
+
+    def test_own_changes_use_sql(self):
+        """Do a user's lookups go to SQL once they changed their follows
+        after the index was read, and only then?"""
+
+        self.addCleanup(setattr, graph, '_graph', graph._graph)
+        graph._graph = self.graph
+
+        with app.test_request_context():
+            self.assertIs(graph.current(), self.graph)
+
+            session[graph.FOLLOW_WRITE_KEY] = self.graph.read_at - 1
+            self.assertIs(graph.current(), self.graph)
+
+            graph.follow(*self.ids[2:4])
+            self.assertIsNone(graph.current())
+
+    def test_budget(self):
+        """Is a build that overruns its budget abandoned?"""
+
+        with self.assertRaises(graph.BuildBudgetExceeded):
+            graph.build(db.engine, budget=-1)
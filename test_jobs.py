@@ -0,0 +1,140 @@
+"""Background job tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_jobs.py
+
+
+from datetime import datetime
+from unittest import TestCase
+
+from models import db, Job
+
+from app import create_app
+import jobs
+
+# Build an app of our own against a different database for tests
+
+app = create_app('testing', SQLALCHEMY_DATABASE_URI="postgresql:///warbler-test")
+
+db.create_all()
+
+# counts at which the test handler fails, once each
+fail_at = []
+
+
+@jobs.handler('count_to_three')
+def count_to_three(job):
+    """Count up one per step, until three."""
+
+    count = job.progress.get('count', 0)
+    if count in fail_at:
+        fail_at.remove(count)
+        raise RuntimeError("flaky")
+
+    job.progress = {'count': count + 1}
+    return count + 1 == 3
+
+
+@jobs.handler('taken_over')
+def taken_over(job):
+    """Count a step, while (as if its lease ran out) another worker claims
+    the job."""
+
+    with db.engine.begin() as connection:
+        connection.execute(Job.__table__.update()
+                           .where(Job.__table__.c.id == job.id)
+                           .values(locked_by='other-worker'))
+
+    job.progress = {'count': job.progress.get('count', 0) + 1}
+    return job.progress['count'] == 2
+
+
+class JobsTestCase(TestCase):
+    """Test queueing, running and retrying jobs."""
+
+    def setUp(self):
+        Job.query.delete()
+        db.session.commit()
+        fail_at.clear()
+
+        self.context = app.app_context()
+        self.context.push()
+
+    def tearDown(self):
+        db.session.rollback()
+        self.context.pop()
+
+    def test_run_in_steps(self):
+        """Is a job run step by step until its handler says it's done?"""
+
+        job = jobs.enqueue('count_to_three')
+        db.session.commit()
+
+        self.assertEqual(jobs.run_pending(), 1)
+
+        job = Job.query.get(job.id)
+        self.assertEqual(job.state, 'done')
+        self.assertEqual(job.progress, {'count': 3})
+        self.assertEqual(job.attempts, 1)
+
+        # nothing left to do
+        self.assertEqual(jobs.run_pending(), 0)
+
+    def test_retry(self):
+        """Is a failed step retried later, carrying on from its progress?"""
+
+        job = jobs.enqueue('count_to_three')
+        db.session.commit()
+
+        # the first step works, the second fails
+        fail_at.append(1)
+        jobs.run_pending()
+
+        job = Job.query.get(job.id)
+        self.assertEqual(job.state, 'queued')
+        self.assertEqual(job.progress, {'count': 1})
+        self.assertIn('flaky', job.last_error)
+        self.assertGreater(job.run_at, datetime.utcnow())
+
+        # not due yet
+        self.assertEqual(jobs.run_pending(), 0)
+
+        job.run_at = datetime.utcnow()
+        db.session.commit()
+        self.assertEqual(jobs.run_pending(), 1)
+
+        job = Job.query.get(job.id)
+        self.assertEqual(job.state, 'done')
+        self.assertEqual(job.attempts, 2)
+
+    def test_give_up(self):
+        """Is a job that keeps failing marked failed?"""
+
+        job = jobs.enqueue('count_to_three')
+        db.session.commit()
+
+        for attempt in range(app.config['JOB_MAX_ATTEMPTS']):
+            fail_at.append(0)
+            Job.query.get(job.id).run_at = datetime.utcnow()
+            db.session.commit()
+            jobs.run_pending()
+
+        job = Job.query.get(job.id)
+        self.assertEqual(job.state, 'failed')
+        self.assertEqual(job.attempts, app.config['JOB_MAX_ATTEMPTS'])
+        self.assertIsNotNone(job.finished_at)
+
+    def test_lease_lost(self):
+        """Does a worker whose job was claimed by another drop its step?"""
+
+        job = jobs.enqueue('taken_over')
+        db.session.commit()
+
+        self.assertEqual(jobs.run_pending(limit=1), 1)
+
+        db.session.expire_all()
+        job = Job.query.get(job.id)
+        self.assertEqual(job.locked_by, 'other-worker')
+        self.assertEqual(job.state, 'running')
+        self.assertEqual(job.progress, {})
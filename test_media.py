@@ -0,0 +1,131 @@
+"""Uploaded picture tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_media.py
+
+
+import io
+import os
+import tempfile
+from unittest import TestCase, skipUnless
+
+from models import db, Job, Message, User
+
+from app import create_app, CURR_USER_KEY
+import jobs
+import media
+
+try:
+    import PIL
+except ImportError:
+    PIL = None
+
+# Build an app of our own against a different database for tests, keeping
+# uploads in a scratch directory
+
+media_root = tempfile.TemporaryDirectory()
+
+app = create_app('testing', SQLALCHEMY_DATABASE_URI="postgresql:///warbler-test",
+                 MEDIA_ROOT=media_root.name)
+
+db.create_all()
+
+app.config['CURRENT_USER_CACHE_TTL'] = 0
+app.config['FOLLOW_GRAPH_ENABLED'] = False
+
+with open(os.path.join(app.static_folder, 'images', 'warbler-logo.png'), 'rb') as file:
+    PICTURE = file.read()
+
+
+class MediaTestCase(TestCase):
+    """Test uploading avatars and making their variants."""
+
+    def setUp(self):
+        Job.query.delete()
+        Message.query.delete()
+        User.query.delete()
+
+        self.client = app.test_client()
+
+        user = User.signup(username="testuser", email="test@test.com",
+                           password="testuser", image_url=None)
+        db.session.commit()
+        self.user_id = user.id
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def upload(self, data, filename='me.png'):
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.user_id
+
+            return c.post('/users/profile',
+                          data={'username': 'testuser',
+                                'email': 'test@test.com',
+                                'password': 'testuser',
+                                'image_file': (io.BytesIO(data), filename)},
+                          content_type='multipart/form-data',
+                          follow_redirects=True)
+
+    def test_upload_queues_variants(self):
+        """Is an upload stored and its variants left to a job?"""
+
+        resp = self.upload(PICTURE)
+        self.assertIn("Your new picture will show in a moment.",
+                      resp.get_data(as_text=True))
+
+        job = Job.query.one()
+        self.assertEqual(job.kind, 'media_variants')
+        self.assertEqual(job.payload['picture'], 'avatar')
+
+        key = job.payload['key']
+        self.assertTrue(key.startswith(f"avatar/{self.user_id}/"))
+        with app.app_context():
+            self.assertEqual(media.store().get(f"{key}/original"), PICTURE)
+
+        # the old picture shows until the variants are made
+        self.assertIsNone(User.query.get(self.user_id).image_key)
+
+    def test_rejects_non_images(self):
+        """Is an upload that isn't a picture turned away?"""
+
+        resp = self.upload(b"just some text", filename='me.png')
+        self.assertIn("Pictures must be JPEG, PNG, GIF or WebP images.",
+                      resp.get_data(as_text=True))
+        self.assertEqual(Job.query.count(), 0)
+
+    @skipUnless(PIL, "making variants needs Pillow")
+    def test_variants(self):
+        """Are the variants made, shown and served, and replaced uploads
+        removed?"""
+
+        self.upload(PICTURE)
+        with app.app_context():
+            jobs.run_pending()
+
+        user = User.query.get(self.user_id)
+        first_key = user.image_key
+        self.assertIsNotNone(first_key)
+
+        with app.test_request_context():
+            url = media.avatar_url(user)
+        self.assertEqual(url, f"/media/{first_key}/thumb.jpg")
+
+        resp = self.client.get(url)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.mimetype, 'image/jpeg')
+        self.assertIn('immutable', resp.headers['Cache-Control'])
+        resp.close()
+
+        self.assertEqual(
+            self.client.get(f"/media/{first_key}/original.jpg").status_code, 404)
+
+        # a different picture replaces the first, whose files go
+        self.upload(PICTURE + b'\0')
+        with app.app_context():
+            jobs.run_pending()
+
+        self.assertNotEqual(User.query.get(self.user_id).image_key, first_key)
+        self.assertEqual(self.client.get(url).status_code, 404)
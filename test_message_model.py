@@ -5,22 +5,18 @@
 #    python -m unittest test_user_model.py
 
 
-from app import app,  CURR_USER_KEY
-import os
 from unittest import TestCase
 # from sqlalchemy.exc import IntegrityError
 
 from models import db, User, Message, Follows
 
-# BEFORE we import our app, let's set an environmental variable
-# to use a different database for tests (we need to do this
-# before we import our app, since that will have already
-# connected to the database
+from app import create_app
 
-os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
-PASSWORD = "HASHED_PASSWORD"
+# Build an app of our own against a different database for tests
+
+app = create_app('testing', SQLALCHEMY_DATABASE_URI="postgresql:///warbler-test")
 
-# Now we can import app
+PASSWORD = "HASHED_PASSWORD"
 
 # Create our tables (we do this here, so we only create the tables
 # once for all tests --- in each test, we'll delete the data
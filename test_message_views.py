@@ -2,26 +2,28 @@
 
 # run these tests like:
 #
-#    FLASK_ENV=production python -m unittest test_message_views.py
+#    python -m unittest test_message_views.py
 
 
-import os
+import json
+from datetime import datetime
 from unittest import TestCase
 
 from sqlalchemy.sql.operators import as_
 
-from models import db, connect_db, Message, User
+import fragments
+import likes
+import trending
+from instrumentation import count_queries
+from models import db, connect_db, Like, Message, User, TimelineEntry
 
-# BEFORE we import our app, let's set an environmental variable
-# to use a different database for tests (we need to do this
-# before we import our app, since that will have already
-# connected to the database
+from app import create_app, CURR_USER_KEY
 
-os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+# Build an app of our own against a different database for tests (the
+# testing profile also turns off CSRF, which is a pain to test, and the
+# trending refresh thread)
 
-# Now we can import app
-
-from app import app, CURR_USER_KEY
+app = create_app('testing', SQLALCHEMY_DATABASE_URI="postgresql:///warbler-test")
 
 # Create our tables (we do this here, so we only create the tables
 # once for all tests --- in each test, we'll delete the data
@@ -29,10 +31,13 @@ from app import app, CURR_USER_KEY
 
 db.create_all()
 
-# Don't have WTForms use CSRF at all, since it's a pain to test
+# Tests rewrite users behind the app's back, so don't cache logged-in users
+
+app.config['CURRENT_USER_CACHE_TTL'] = 0
 
-app.config['WTF_CSRF_ENABLED'] = False
+# ... or follows, so don't index the follow graph in memory either
 
+app.config['FOLLOW_GRAPH_ENABLED'] = False
 
 
 class MessageViewTestCase(TestCase):
@@ -41,6 +46,7 @@ class MessageViewTestCase(TestCase):
     def setUp(self):
         """Create test client, add sample data."""
 
+        TimelineEntry.query.delete()
         User.query.delete()
         Message.query.delete()
 
@@ -58,6 +64,7 @@ class MessageViewTestCase(TestCase):
 
         db.session.commit()
         self.testmessage_id = self.testmessage.id
+        self.testuser_id = self.testuser.id
         
     def tearDown(self):
         """Clean up any fouled transaction."""
@@ -151,4 +158,398 @@ class MessageViewTestCase(TestCase):
             #  too verbose. if someone makes an edit to the html the test will failed
             self.assertIn(f'<p class="single-message">{self.testmessage.text}</p>', html)
 
+    def test_view_message_etag(self):
+        """Is a message page revalidated with its ETag, and static files
+        cached?"""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser_id
+
+            resp = c.get(f'/messages/{self.testmessage_id}')
+            etag = resp.headers['ETag']
+
+            resp = c.get(f'/messages/{self.testmessage_id}',
+                         headers={'If-None-Match': etag})
+            self.assertEqual(resp.status_code, 304)
+
+            # the author changing their profile changes the page
+            user = User.query.get(self.testuser_id)
+            user.bio = "New bio"
+            db.session.commit()
+
+            resp = c.get(f'/messages/{self.testmessage_id}',
+                         headers={'If-None-Match': etag})
+            self.assertEqual(resp.status_code, 200)
+
+            resp = c.get('/messages/new')
+            self.assertEqual(resp.headers['Cache-Control'], 'no-store')
+
+            resp = c.get('/static/stylesheets/style.css')
+            self.assertIn('max-age', resp.headers['Cache-Control'])
+            resp.close()
+
+    def test_message_card_cache(self):
+        """Are message cards reused, and redrawn once the author changes?"""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser_id
+
+            c.get(f'/users/{self.testuser_id}')
+            hits = fragments.stats()['hits']
+            c.get(f'/users/{self.testuser_id}')
+
+            self.assertEqual(fragments.stats()['hits'], hits + 1)
+
+            user = User.query.get(self.testuser_id)
+            user.username = "renamed"
+            db.session.commit()
+
+            html = c.get(f'/users/{self.testuser_id}').get_data(as_text=True)
+
+            self.assertIn(f'<a href="/users/{self.testuser_id}">@renamed</a>', html)
+
+    def test_counters(self):
+        """Do posting, following and liking keep the counters in step?"""
+
+        other = User.signup(username="other",
+                            email="other@test.com",
+                            password="otheruser",
+                            image_url=None)
+        db.session.commit()
+        other_id = other.id
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = other_id
+
+            c.post("/messages/new", data={"text": "Counted"})
+            c.post(f"/users/follow/{self.testuser_id}")
+            c.post(f"/messages/{self.testmessage_id}/like")
+
+            other = User.query.get(other_id)
+            testuser = User.query.get(self.testuser_id)
+            self.assertEqual(other.message_count, 1)
+            self.assertEqual(other.following_count, 1)
+            self.assertEqual(other.liked_count, 1)
+            self.assertEqual(testuser.follower_count, 1)
+            self.assertEqual(Message.query.get(self.testmessage_id).like_count, 1)
+
+            c.post(f"/messages/{self.testmessage_id}/like")
+            c.post(f"/users/stop-following/{self.testuser_id}")
+
+            db.session.expire_all()
+            self.assertEqual(User.query.get(other_id).following_count, 0)
+            self.assertEqual(User.query.get(other_id).liked_count, 0)
+            self.assertEqual(User.query.get(self.testuser_id).follower_count, 0)
+            self.assertEqual(Message.query.get(self.testmessage_id).like_count, 0)
+
+    def test_trending(self):
+        """Do likes make a message trend, and unlikes take it back?"""
+
+        other = User.signup(username="other",
+                            email="other@test.com",
+                            password="otheruser",
+                            image_url=None)
+        db.session.commit()
+        other_id = other.id
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = other_id
+
+            c.post(f"/messages/{self.testmessage_id}/like")
+            self.assertGreaterEqual(
+                Message.query.get(self.testmessage_id).trend_score, 1)
+
+            trending.compute_app(app, db.engine)
+            trending.refresh(db.engine)
+            self.assertEqual(trending.current_ids(), [self.testmessage_id])
+
+            with c.session_transaction() as sess:
+                del sess[CURR_USER_KEY]
+            self.assertIn("Goodbye", c.get("/").get_data(as_text=True))
+
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = other_id
+            c.post(f"/messages/{self.testmessage_id}/like")
+
+            db.session.expire_all()
+            self.assertAlmostEqual(
+                Message.query.get(self.testmessage_id).trend_score, 0)
+
+            trending.compute_app(app, db.engine)
+            trending.refresh(db.engine)
+            self.assertEqual(trending.current_ids(), [])
+
+    def test_api_like(self):
+        """Is the like API idempotent, and does it answer with the count?"""
+
+        other = User.signup(username="other",
+                            email="other@test.com",
+                            password="otheruser",
+                            image_url=None)
+        db.session.commit()
+        other_id = other.id
+        url = f"/api/messages/{self.testmessage_id}/like"
+
+        with self.client as c:
+            self.assertEqual(c.put(url).status_code, 401)
+
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = other_id
+
+            for _ in range(2):
+                resp = c.put(url)
+                self.assertEqual(resp.status_code, 200)
+                self.assertEqual(resp.json, {"message_id": self.testmessage_id,
+                                             "liked": True,
+                                             "like_count": 1})
+
+            self.assertEqual(User.query.get(other_id).liked_count, 1)
+
+            for _ in range(2):
+                resp = c.delete(url)
+                self.assertEqual(resp.json["liked"], False)
+                self.assertEqual(resp.json["like_count"], 0)
+
+            self.assertEqual(c.put("/api/messages/0/like").status_code, 404)
+
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser_id
+            self.assertEqual(c.put(url).status_code, 403)
+
+    def test_like_batch(self):
+        """Does one batch apply many users' likes, last change winning?"""
+
+        users = [User.signup(username=f"liker{n}",
+                             email=f"liker{n}@test.com",
+                             password="likerpass",
+                             image_url=None)
+                 for n in range(3)]
+        db.session.commit()
+        message = Message.query.get(self.testmessage_id)
+
+        changes = [likes.LikeChange(user.id, message.id, message.timestamp, True)
+                   for user in users]
+        changes.append(likes.LikeChange(users[0].id, message.id,
+                                        message.timestamp, False))
+        likes.flush(db.engine, changes, app.config['TRENDING_HALF_LIFE'])
+
+        self.assertEqual([change.result for change in changes],
+                         [(False, 2), (True, 2), (True, 2), (False, 2)])
+
+        db.session.expire_all()
+        self.assertEqual(Message.query.get(self.testmessage_id).like_count, 2)
+        self.assertEqual(Like.query.filter_by(message_id=message.id).count(), 2)
+        self.assertEqual(User.query.get(users[0].id).liked_count, 0)
+        self.assertEqual(User.query.get(users[1].id).liked_count, 1)
+
+    def test_like_batch_conflicts(self):
+        """Are deadlocks and serialization failures retried like conflicts,
+        and other database errors not?"""
+
+        from sqlalchemy.exc import OperationalError
+
+        class DatabaseError(Exception):
+            def __init__(self, pgcode):
+                self.pgcode = pgcode
+
+        def error(pgcode):
+            return OperationalError("UPDATE messages ...", {}, DatabaseError(pgcode))
+
+        self.assertTrue(likes._conflicted(error('40P01')))
+        self.assertTrue(likes._conflicted(error('40001')))
+        self.assertFalse(likes._conflicted(error('57P01')))
+
+    def test_search_messages(self):
+        """Are new messages found by prefix search, and others not?"""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser_id
+
+            c.post("/messages/new", data={"text": "Searchable warble"})
+
+            resp = c.get("/search?kind=messages&q=searcha")
+            html = resp.get_data(as_text=True)
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn("<p>Searchable warble</p>", html)
+            self.assertNotIn("<p>Goodbye</p>", html)
+
+    def test_timeline_fan_out(self):
+        """Does a new message reach the home page of the author's followers?"""
+
+        follower = User.signup(username="follower",
+                               email="follower@test.com",
+                               password="follower",
+                               image_url=None)
+        follower.following.append(self.testuser)
+        db.session.commit()
+        follower_id = follower.id
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser.id
+
+            c.post("/messages/new", data={"text": "Fanned out"})
+
+            entries = TimelineEntry.query.filter_by(user_id=follower_id).all()
+            self.assertEqual(len(entries), 1)
+
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = follower_id
+
+            resp = c.get("/")
+            html = resp.get_data(as_text=True)
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn("<p>Fanned out</p>", html)
+            # older messages were posted before the follow and not backfilled
+            self.assertNotIn("<p>Goodbye</p>", html)
+
+    def delete_testuser(self):
+        """Mark testuser deleted, as /users/delete does before the purge."""
+
+        User.query.get(self.testuser_id).deleted_at = datetime.utcnow()
+        db.session.commit()
+
+    def test_search_hides_deleted_authors(self):
+        """Are a deleted account's messages gone from search at once?"""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser_id
+            c.post("/messages/new", data={"text": "Searchable warble"})
+
+            self.delete_testuser()
+
+            html = c.get("/search?kind=messages&q=searcha").get_data(as_text=True)
+            self.assertNotIn("<p>Searchable warble</p>", html)
+
+    def test_timeline_hides_deleted_authors(self):
+        """Are a deleted account's messages gone from followers' homes?"""
+
+        follower = User.signup(username="follower",
+                               email="follower@test.com",
+                               password="follower",
+                               image_url=None)
+        follower.following.append(self.testuser)
+        db.session.commit()
+        follower_id = follower.id
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser_id
+            c.post("/messages/new", data={"text": "Fanned out"})
+
+            self.delete_testuser()
+
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = follower_id
+            html = c.get("/").get_data(as_text=True)
+
+            # the inbox entry is still there until the purge removes it
+            self.assertEqual(
+                TimelineEntry.query.filter_by(user_id=follower_id).count(), 1)
+            self.assertNotIn("<p>Fanned out</p>", html)
+
+    def test_trending_hides_deleted_authors(self):
+        """Are a deleted account's messages gone from trending at once?"""
+
+        Message.query.get(self.testmessage_id).trend_score = 5
+        db.session.commit()
+        trending.compute_app(app, db.engine)
+        trending.refresh(db.engine)
+
+        self.assertIn("Goodbye",
+                      self.client.get("/messages/trending").get_data(as_text=True))
+
+        self.delete_testuser()
+
+        # still in the list until the next refresh, but not shown
+        self.assertEqual(trending.current_ids(), [self.testmessage_id])
+        self.assertNotIn("Goodbye",
+                         self.client.get("/messages/trending").get_data(as_text=True))
+
+    def test_api_messages(self):
+        """Are a user's messages served as JSON pages and as NDJSON?"""
+
+        with self.client as c:
+            resp = c.get(f"/api/users/{self.testuser_id}/messages")
+            self.assertEqual(resp.status_code, 401)
+
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser_id
+
+            for n in range(2):
+                c.post("/messages/new", data={"text": f"Warble {n}"})
+
+            app.config['PAGE_SIZE'] = 2
+            try:
+                resp = c.get(f"/api/users/{self.testuser_id}/messages")
+                body = resp.get_json()
+
+                self.assertEqual([msg["text"] for msg in body["messages"]],
+                                 ["Warble 1", "Warble 0"])
+                self.assertEqual(body["messages"][0]["user"]["username"],
+                                 "testuser")
+
+                resp = c.get(f"/api/users/{self.testuser_id}/messages",
+                             query_string={"before": body["next_cursor"]})
+                body = resp.get_json()
+
+                self.assertEqual([msg["text"] for msg in body["messages"]],
+                                 ["Goodbye"])
+                self.assertIsNone(body["next_cursor"])
+            finally:
+                app.config['PAGE_SIZE'] = 100
+
+            resp = c.get("/api/timeline?format=ndjson")
+            lines = resp.get_data(as_text=True).splitlines()
+
+            # "Goodbye" was added behind the app's back, so never fanned out
+            self.assertEqual(resp.mimetype, "application/x-ndjson")
+            self.assertEqual([json.loads(line)["text"] for line in lines],
+                             ["Warble 1", "Warble 0"])
+
+    def test_homepage_query_budget(self):
+        """Does the home page query a fixed number of times however many
+        authors and messages it shows?"""
+
+        follower = User.signup(username="follower",
+                               email="follower@test.com",
+                               password="follower",
+                               image_url=None)
+        other = User.signup(username="other",
+                            email="other@test.com",
+                            password="other",
+                            image_url=None)
+        follower.following.extend([self.testuser, other])
+        db.session.commit()
+        follower_id = follower.id
+        other_id = other.id
+
+        with self.client as c:
+            for author_id in (self.testuser_id, other_id):
+                with c.session_transaction() as sess:
+                    sess[CURR_USER_KEY] = author_id
+                for n in range(3):
+                    c.post("/messages/new", data={"text": f"Warble {n}"})
+
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = follower_id
+
+            with count_queries() as stats:
+                resp = c.get("/")
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(resp.get_data(as_text=True).count("<p>Warble "), 6)
+            # user, fan-in authors, timeline, likes, suggestions, counters
+            self.assertLessEqual(stats.count, 6)
+            self.assertEqual(stats.repeated(limit=1), [])
+            self.assertEqual(resp.headers["X-Query-Count"], str(stats.count))
+
 # test to view message that doesnt exist
\ No newline at end of file
@@ -0,0 +1,109 @@
+"""Read replica routing tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_read_replica.py
+
+
+from unittest import TestCase
+
+from models import db, User, Follows
+
+from app import create_app, CURR_USER_KEY
+
+# Build an app of our own against a different database for tests (the
+# testing profile also turns off CSRF, which is a pain to test, and the
+# trending refresh thread)
+
+app = create_app('testing', SQLALCHEMY_DATABASE_URI="postgresql:///warbler-test")
+
+db.create_all()
+
+app.config['CURRENT_USER_CACHE_TTL'] = 0
+app.config['FOLLOW_GRAPH_ENABLED'] = False
+
+# A second database stands in for the replica; the tests copy rows into it
+# by hand, so it lags the primary whenever they want
+
+REPLICA_DATABASE_URL = "postgresql:///warbler-test-replica"
+
+
+class ReadReplicaTestCase(TestCase):
+    """Test which database read pages are served from."""
+
+    def setUp(self):
+        """Create two users on the primary, replicate them, then rename the
+        second's bio on the primary only."""
+
+        app.config['SQLALCHEMY_BINDS'] = {'replica': REPLICA_DATABASE_URL}
+        self.replica = db.get_engine(app, bind='replica')
+        db.Model.metadata.create_all(self.replica)
+
+        Follows.query.delete()
+        User.query.delete()
+
+        self.client = app.test_client()
+
+        viewer = User.signup(username="viewer", email="viewer@test.com",
+                             password="viewerpass", image_url=None)
+        other = User.signup(username="other", email="other@test.com",
+                            password="otherpass", image_url=None)
+        other.bio = "Replicated bio"
+        db.session.commit()
+
+        self.viewer_id = viewer.id
+        self.other_id = other.id
+
+        users = User.__table__
+        rows = [dict(row._mapping) for row in db.session.execute(users.select())]
+        with self.replica.begin() as connection:
+            connection.execute(users.delete())
+            connection.execute(users.insert(), rows)
+
+        other.bio = "Fresh bio"
+        db.session.commit()
+
+    def tearDown(self):
+        """Clean up any fouled transaction, and go back to one database."""
+
+        db.session.rollback()
+        app.config['SQLALCHEMY_BINDS'] = None
+
+    def test_read_pages_use_replica(self):
+        """Are read pages served from the replica, until the user writes?"""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.viewer_id
+
+            html = c.get(f"/users/{self.other_id}").get_data(as_text=True)
+            self.assertIn("Replicated bio", html)
+
+            # the follow is written to the primary...
+            c.post(f"/users/follow/{self.other_id}")
+            self.assertEqual(Follows.query.count(), 1)
+
+            # ... and for a while afterwards this user reads from it too
+            html = c.get(f"/users/{self.other_id}").get_data(as_text=True)
+            self.assertIn("Fresh bio", html)
+
+            # /metrics is only for holders of the token
+            self.assertEqual(c.get("/metrics").status_code, 404)
+            app.config['METRICS_TOKEN'] = 'secret'
+            self.addCleanup(app.config.__setitem__, 'METRICS_TOKEN', None)
+            metrics = c.get("/metrics", headers={'Authorization': 'Bearer secret'}
+                            ).json["database"]
+            self.assertGreaterEqual(metrics["read_requests"]["sticky"], 1)
+            self.assertIn("replica", metrics)
+
+    def test_without_replica(self):
+        """Do read pages use the primary when there is no replica?"""
+
+        app.config['SQLALCHEMY_BINDS'] = None
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.viewer_id
+
+            html = c.get(f"/users/{self.other_id}").get_data(as_text=True)
+            self.assertIn("Fresh bio", html)
@@ -5,22 +5,18 @@
 #    python -m unittest test_user_model.py
 
 
-from app import app,  CURR_USER_KEY
-import os
 from unittest import TestCase
 from sqlalchemy.exc import IntegrityError, SQLAlchemyError
 
-from models import db, User, Message, Follows
+from models import db, User, Message, Follows, Like
 
-# BEFORE we import our app, let's set an environmental variable
-# to use a different database for tests (we need to do this
-# before we import our app, since that will have already
-# connected to the database
+from app import create_app, CURR_USER_KEY
 
-os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
-PASSWORD = "HASHED_PASSWORD"
+# Build an app of our own against a different database for tests
+
+app = create_app('testing', SQLALCHEMY_DATABASE_URI="postgresql:///warbler-test")
 
-# Now we can import app
+PASSWORD = "HASHED_PASSWORD"
 
 
 # Create our tables (we do this here, so we only create the tables
@@ -126,6 +122,35 @@ class UserModelTestCase(TestCase):
             self.assertIs(user3.is_followed_by(user1), False)
     
 
+    def test_lookup_sets(self):
+        """Do following_ids and liked_message_ids return matching id sets?"""
+
+        user2 = User(username="testuser2",
+                     email="test2@test.com",
+                     password="testuser2")
+        user3 = User(username="testuser3",
+                     email="test3@test.com",
+                     password="testuser3")
+        db.session.add_all([user2, user3])
+        db.session.commit()
+
+        msg2 = Message(text="liked", user_id=user2.id)
+        msg3 = Message(text="not liked", user_id=user3.id)
+        db.session.add_all([msg2, msg3])
+        db.session.commit()
+
+        self.test_user1.following.append(user2)
+        db.session.add(Like(user_id=self.test_user1.id, message_id=msg2.id))
+        db.session.commit()
+
+        self.assertEqual(self.test_user1.following_ids([user2.id, user3.id]),
+                         {user2.id})
+        self.assertEqual(self.test_user1.liked_message_ids([msg2.id, msg3.id]),
+                         {msg2.id})
+        self.assertEqual(self.test_user1.liked_message_ids([]), set())
+        self.assertIs(self.test_user1.is_like(msg2), True)
+        self.assertIs(self.test_user1.is_like(msg3), False)
+
     def test_user_signup(self):
         """Successfully create a new user given valid credentials?"""
 
@@ -186,8 +211,16 @@ class UserModelTestCase(TestCase):
         user = User.authenticate("wrong_username", PASSWORD)
         self.assertIs(user, False)
 
+    def test_rehash_on_login(self):
+        """Is a hash made at an old cost factor upgraded on login?"""
 
-        
+        with app.app_context():
+            app.config['BCRYPT_LOG_ROUNDS'] = 4
+            self.addCleanup(app.config.__setitem__, 'BCRYPT_LOG_ROUNDS', 12)
 
-    
-    
+            user = User.authenticate(self.test_user1.username, PASSWORD)
+            db.session.commit()
+
+            self.assertTrue(user.password.startswith("$2b$04$"))
+            self.assertEqual(User.authenticate(self.test_user1.username, PASSWORD),
+                             user)
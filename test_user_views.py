@@ -1,20 +1,22 @@
 """User View tests."""
 
 import os
+import re
 from unittest import TestCase
 
-from models import db, connect_db, Message, User
+import counters
+import jobs
+import passwords
+import search
+from models import db, connect_db, Job, Message, User, Suggestion
 
-# BEFORE we import our app, let's set an environmental variable
-# to use a different database for tests (we need to do this
-# before we import our app, since that will have already
-# connected to the database
+from app import create_app, CURR_USER_KEY
 
-os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+# Build an app of our own against a different database for tests (the
+# testing profile also turns off CSRF, which is a pain to test, and the
+# trending refresh thread)
 
-# Now we can import app
-
-from app import app, CURR_USER_KEY
+app = create_app('testing', SQLALCHEMY_DATABASE_URI="postgresql:///warbler-test")
 
 # Create our tables (we do this here, so we only create the tables
 # once for all tests --- in each test, we'll delete the data
@@ -22,9 +24,13 @@ from app import app, CURR_USER_KEY
 
 db.create_all()
 
-# Don't have WTForms use CSRF at all, since it's a pain to test
+# Tests rewrite users behind the app's back, so don't cache logged-in users
+
+app.config['CURRENT_USER_CACHE_TTL'] = 0
+
+# ... or follows, so don't index the follow graph in memory either
 
-app.config['WTF_CSRF_ENABLED'] = False
+app.config['FOLLOW_GRAPH_ENABLED'] = False
 
 
 class UserViewTestCase(TestCase):
@@ -33,6 +39,8 @@ class UserViewTestCase(TestCase):
     def setUp(self):
         """Create test client, add sample data."""
 
+        Job.query.delete()
+        Suggestion.query.delete()
         User.query.delete()
         Message.query.delete()
 
@@ -78,6 +86,56 @@ class UserViewTestCase(TestCase):
             self.assertEqual(resp.status_code, 200)
             self.assertIn(f'<p>@{self.testuser.username}</p>', html)
 
+    def use_password_pool(self, **settings):
+        """Hash in a fresh pool of one process with `settings`."""
+
+        settings = dict(BCRYPT_POOL_SIZE=1, **settings)
+        saved = {name: app.config[name] for name in settings}
+        app.config.update(settings)
+        passwords.shutdown()
+
+        self.addCleanup(passwords.shutdown)
+        self.addCleanup(app.config.update, saved)
+
+    def login(self):
+        return self.client.post('/login', data={"username": "testuser",
+                                                "password": "testuser"})
+
+    def test_login_pool_saturated(self):
+        """Is a login turned away with a 503 while the pool is full?"""
+
+        self.use_password_pool(BCRYPT_MAX_PENDING=1)
+
+        with app.app_context():
+            passwords._get_pool()
+        passwords._pending.acquire()
+        self.addCleanup(passwords._pending.release)
+
+        resp = self.login()
+        self.assertEqual(resp.status_code, 503)
+        self.assertIn("please try again in a moment", resp.get_data(as_text=True))
+
+    def test_login_hash_timeout(self):
+        """Is a login whose hash takes too long turned away with a 503?"""
+
+        self.use_password_pool(BCRYPT_TIMEOUT=0.001)
+
+        resp = self.login()
+        self.assertEqual(resp.status_code, 503)
+        self.assertIn("please try again in a moment", resp.get_data(as_text=True))
+
+    def test_login_pool_broken(self):
+        """Is a crashed pool a 503, and replaced for the next login?"""
+
+        self.use_password_pool()
+
+        with app.app_context():
+            with self.assertRaises(passwords.PasswordHasherBusy):
+                passwords._run(os._exit, 1)
+
+        resp = self.login()
+        self.assertEqual(resp.status_code, 302)
+
 
     def test_view_home_page(self):
         """Can logged in user view home page?"""
@@ -121,6 +179,10 @@ class UserViewTestCase(TestCase):
     def test_profile(self):
         """Can logged in user view and edit profile?"""
 
+        # editing must invalidate the cached identity of the logged-in user
+        app.config['CURRENT_USER_CACHE_TTL'] = 10
+        self.addCleanup(app.config.__setitem__, 'CURRENT_USER_CACHE_TTL', 0)
+
         with self.client as c:
             with c.session_transaction() as sess:
                 sess[CURR_USER_KEY] = self.testuser.id
@@ -159,7 +221,134 @@ class UserViewTestCase(TestCase):
 
             self.assertEqual(resp.status_code, 200)
             self.assertIn('<div class="col-sm-9">', html)
+
+    def test_paginate_messages(self):
+        """Are a user's messages split into pages with an Older link?"""
+
+        for text in ["first", "second", "third"]:
+            self.testuser.messages.append(Message(text=text))
+            db.session.commit()
+
+        app.config['PAGE_SIZE'] = 2
+
+        try:
+            with self.client as c:
+                with c.session_transaction() as sess:
+                    sess[CURR_USER_KEY] = self.testuser_id
+
+                resp = c.get(f"/users/{self.testuser_id}")
+                html = resp.get_data(as_text=True)
+
+                self.assertEqual(resp.status_code, 200)
+                self.assertIn("<p>third</p>", html)
+                self.assertIn("<p>second</p>", html)
+                self.assertNotIn("<p>first</p>", html)
+                self.assertIn("older-link", html)
+
+                older = re.search(r'href="([^"]+)"[^>]*older-link', html)
+                resp = c.get(older.group(1).replace("&amp;", "&"))
+                html = resp.get_data(as_text=True)
+
+                self.assertIn("<p>first</p>", html)
+                self.assertNotIn("<p>third</p>", html)
+                self.assertNotIn("older-link", html)
+
+                resp = c.get(f"/users/{self.testuser_id}?before=garbage")
+                self.assertEqual(resp.status_code, 400)
+        finally:
+            app.config['PAGE_SIZE'] = 100
     
+    def test_user_page_etag(self):
+        """Is an unchanged profile answered with 304, and a changed one not?"""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser_id
+
+            resp = c.get(f"/users/{self.testuser2_id}")
+            etag = resp.headers["ETag"]
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn("no-cache", resp.headers["Cache-Control"])
+
+            resp = c.get(f"/users/{self.testuser2_id}",
+                         headers={"If-None-Match": etag})
+
+            self.assertEqual(resp.status_code, 304)
+            self.assertEqual(resp.get_data(), b"")
+
+            c.post(f"/users/follow/{self.testuser2_id}")
+            resp = c.get(f"/users/{self.testuser2_id}",
+                         headers={"If-None-Match": etag})
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn("Unfollow", resp.get_data(as_text=True))
+
+    def test_search_users(self):
+        """Are users found by username, and others not?"""
+
+        # setUp makes users behind the write paths, which index them
+        with app.app_context():
+            search.rebuild()
+            db.session.commit()
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser_id
+
+            resp = c.get("/users?q=testuser2")
+            html = resp.get_data(as_text=True)
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn("@testuser2", html)
+            self.assertNotRegex(html, r"@testuser\b")
+
+            html = c.get("/search?q=testu").get_data(as_text=True)
+            self.assertRegex(html, r"@testuser\b")
+            self.assertIn("@testuser2", html)
+
+            html = c.get("/users?q=nobody").get_data(as_text=True)
+            self.assertNotIn("@testuser", html)
+
+    def test_suggestions(self):
+        """Are friends of friends suggested, and followed users left out?"""
+
+        import recommendations
+
+        third = User.signup(username="testuser3",
+                            email="test3@test.com",
+                            password="testuser",
+                            image_url=None)
+        self.testuser.following.append(self.testuser2)
+        self.testuser2.following.append(third)
+        db.session.commit()
+
+        recommendations.compute_all(db.engine)
+
+        self.assertEqual(Suggestion.query.get(self.testuser_id).user_ids,
+                         [third.id])
+        self.assertIsNone(Suggestion.query.get(self.testuser2_id))
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser_id
+
+            resp = c.get(f"/users/{self.testuser_id}/suggestions")
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn("@testuser3", resp.get_data(as_text=True))
+
+            resp = c.get("/")
+            self.assertIn("Who to follow", resp.get_data(as_text=True))
+
+            # they are for that user's eyes only
+            resp = c.get(f"/users/{self.testuser2_id}/suggestions")
+            self.assertEqual(resp.status_code, 302)
+            self.assertEqual(c.get("/users/0/suggestions").status_code, 404)
+
+            # once followed, they are no longer suggested
+            c.post(f"/users/follow/{third.id}")
+            resp = c.get(f"/users/{self.testuser_id}/suggestions")
+            self.assertNotIn("@testuser3", resp.get_data(as_text=True))
+
     def test_unfollow(self):
         """Can user unfollow someone?"""
         with self.client as c:
@@ -181,15 +370,47 @@ class UserViewTestCase(TestCase):
     def test_delete_user(self):
         """Can a User delete their profile?"""
 
+        self.testuser.following.append(self.testuser2)
+        self.testuser2.messages.append(Message(text="Liked"))
+        db.session.commit()
+        self.testuser.liked_messages.append(self.testuser2.messages[0])
+        self.testuser.messages.append(Message(text="Doomed"))
+        db.session.commit()
+        counters.reconcile()
+        db.session.commit()
+
         with self.client as c:
             with c.session_transaction() as sess:
                 sess[CURR_USER_KEY] = self.testuser.id
 
             resp = c.post("/users/delete", follow_redirects = True )
-            users =  User.query.all()
-
             self.assertEqual(resp.status_code, 200)
+
+            # hidden at once...
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser2_id
+            resp = c.get(f"/users/{self.testuser_id}")
+            self.assertEqual(resp.status_code, 404)
+            self.assertNotIn("@testuser<",
+                             c.get("/users").get_data(as_text=True))
+
+            # ... and purged by the job queue
+            self.assertEqual(User.query.count(), 2)
+            self.assertEqual(jobs.run_pending(), 1)
+
+            db.session.expire_all()
+            users =  User.query.all()
             self.assertEqual(len(users), 1 )
+            self.assertEqual(Message.query.count(), 1)
+            self.assertEqual(users[0].follower_count, 0)
+            self.assertEqual(Message.query.one().like_count, 0)
+
+            job = Job.query.one()
+            self.assertEqual(job.state, "done")
+            self.assertEqual(job.progress["deleted"],
+                             {"messages": 1, "likes": 1, "following": 1,
+                              "followers": 0, "timeline": 0, "media": 0,
+                              "account": 1})
 
 
 # add like tests
@@ -0,0 +1,158 @@
+"""Materialized home timelines.
+
+Every user has an inbox of message ids in `timeline_entries`. Posting a
+message pushes it into the inbox of the author and each of their followers,
+following someone backfills their recent messages and unfollowing prunes
+them. The home page is then one indexed range read on (user_id, timestamp).
+
+Authors with more than TIMELINE_FANOUT_LIMIT followers are not fanned out;
+their followers pull those messages at read time instead.
+"""
+
+from flask import current_app
+from sqlalchemy import literal, or_, select
+from sqlalchemy.orm import contains_eager
+
+from models import db, Follows, Message, TimelineEntry, User
+from pagination import keyset
+
+ENTRY_COLUMNS = ['user_id', 'message_id', 'timestamp']
+
+
+def is_high_fanout(user):
+    """Does this user have too many followers to fan out on write?"""
+
+    return user.follower_count > current_app.config['TIMELINE_FANOUT_LIMIT']
+
+
+def fan_out_message(message):
+    """Deliver a newly flushed message to its author's and followers' inboxes."""
+
+    db.session.add(TimelineEntry(user_id=message.user_id,
+                                 message_id=message.id,
+                                 timestamp=message.timestamp))
+
+    author = message.user
+    author.fanout_on_read = is_high_fanout(author)
+    if author.fanout_on_read:
+        return
+
+    followers = (select(Follows.user_following_id,
+                        literal(message.id),
+                        literal(message.timestamp))
+                 .where(Follows.user_being_followed_id == author.id))
+
+    db.session.execute(
+        TimelineEntry.__table__.insert().from_select(ENTRY_COLUMNS, followers))
+
+
+def backfill_follow(user, followed_user):
+    """Copy the recent messages of a newly followed user into `user`'s inbox."""
+
+    if followed_user.fanout_on_read:
+        return
+
+    recent = (select(literal(user.id), Message.id, Message.timestamp)
+              .where(Message.user_id == followed_user.id)
+              .order_by(Message.timestamp.desc())
+              .limit(current_app.config['TIMELINE_BACKFILL']))
+
+    db.session.execute(
+        TimelineEntry.__table__.insert().from_select(ENTRY_COLUMNS, recent))
+
+
+def prune_follow(user, followed_user):
+    """Remove an unfollowed user's messages from `user`'s inbox."""
+
+    followed_messages = select(Message.id).where(
+        Message.user_id == followed_user.id)
+
+    (TimelineEntry
+     .query
+     .filter(TimelineEntry.user_id == user.id,
+             TimelineEntry.message_id.in_(followed_messages))
+     .delete(synchronize_session=False))
+
+
+def home_timeline(user, limit=100, before=None):
+    """Newest `limit` messages for `user`'s home page.
+
+    `before` is an optional (timestamp, message id) keyset cursor.
+    """
+
+    return timeline_query(user, before, limit).limit(limit).all()
+
+
+def timeline_query(user, before=None, limit=None):
+    """Query for `user`'s home timeline, newest first, from `before` on.
+
+    Reads the inbox, merging in messages from any followed high-fanout
+    authors (whose messages were never pushed). If the caller will only
+    take `limit` rows, passing it lets the merge read less of the inbox.
+    """
+
+    pull_author_ids = [
+        user_id for (user_id,) in (db.session
+                                   .query(Follows.user_being_followed_id)
+                                   .join(User, User.id == Follows.user_being_followed_id)
+                                   .filter(Follows.user_following_id == user.id,
+                                           User.fanout_on_read,
+                                           User.deleted_at.is_(None)))
+    ]
+
+    # deleted accounts' messages leave timelines at once, not when the
+    # purge gets to their inbox entries
+    if not pull_author_ids:
+        inbox = (Message
+                 .query
+                 .join(Message.user)
+                 .options(contains_eager(Message.user))
+                 .join(TimelineEntry, TimelineEntry.message_id == Message.id)
+                 .filter(TimelineEntry.user_id == user.id,
+                         User.deleted_at.is_(None)))
+
+        return keyset(inbox,
+                      (TimelineEntry.timestamp, TimelineEntry.message_id),
+                      before)
+
+    inbox = keyset(
+        TimelineEntry.query.with_entities(TimelineEntry.message_id)
+                           .filter(TimelineEntry.user_id == user.id),
+        (TimelineEntry.timestamp, TimelineEntry.message_id),
+        before).limit(limit).subquery()
+
+    merged = (Message
+              .query
+              .join(Message.user)
+              .options(contains_eager(Message.user))
+              .filter(or_(Message.id.in_(select(inbox.c.message_id)),
+                          Message.user_id.in_(pull_author_ids)),
+                      User.deleted_at.is_(None)))
+
+    return keyset(merged, (Message.timestamp, Message.id), before)
+
+
+def rebuild_timelines():
+    """Recompute every inbox from `messages` and `follows`.
+
+    Used after bulk loads (see seed.py) that bypass the write paths;
+    expects follower counts to be up to date (counters.reconcile()).
+    """
+
+    limit = current_app.config['TIMELINE_FANOUT_LIMIT']
+
+    User.query.update({User.fanout_on_read: User.follower_count > limit},
+                      synchronize_session=False)
+
+    TimelineEntry.query.delete(synchronize_session=False)
+
+    own = select(Message.user_id, Message.id, Message.timestamp)
+
+    followed = (select(Follows.user_following_id, Message.id, Message.timestamp)
+                .join(Message, Message.user_id == Follows.user_being_followed_id)
+                .join(User, User.id == Follows.user_being_followed_id)
+                .where(User.fanout_on_read.is_(False)))
+
+    table = TimelineEntry.__table__
+    db.session.execute(table.insert().from_select(ENTRY_COLUMNS, own))
+    db.session.execute(table.insert().from_select(ENTRY_COLUMNS, followed))
@@ -0,0 +1,226 @@
+"""Trending messages: likes with exponential time decay.
+
+A like counts for 1 when it is made, 1/2 after TRENDING_HALF_LIFE seconds,
+1/4 after two half-lives and so on. Rather than re-summing every like's
+decayed weight, each message keeps a forward-decayed `trend_score`: a like
+made `age` seconds after the message was posted adds 2 ** (age / half life)
+to it, once, in the same transaction as the like (and an unlike subtracts
+what its like added). Weights only grow with time, so no row ever has to
+be updated just because time passed.
+
+At any moment t, a message's decayed like total is
+
+    trend_score * 2 ** -((t - posted) / half life)
+
+and since the 2 ** (-t / half life) factor is shared, messages rank by
+
+    log2(trend_score) + posted / half life
+
+The job worker (worker.py) ranks the messages posted in the last
+TRENDING_WINDOW seconds and stores the best TRENDING_SIZE ids in
+`trending_messages`, at most once every TRENDING_REFRESH seconds however
+many workers run: each skips the scan while the stored list is younger
+than that. Every TRENDING_REFRESH seconds a background thread in each web
+worker reads just those rows and keeps the ids in memory; pages then show
+them with one primary-key lookup, however many likes there are. Refresh
+stats are reported in /metrics.
+"""
+
+import heapq
+import logging
+import math
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, select, text
+
+import instrumentation
+from models import TrendingMessage
+
+logger = logging.getLogger('warbler.trending')
+
+# a like's weight stops growing this many half-lives after the message was
+# posted, keeping scores well inside float range; later likes count as if
+# they had come then
+MAX_WEIGHT_EXPONENT = 256
+
+trending_messages = TrendingMessage.__table__
+
+_top_ids = []
+_stats = {'state': 'not started', 'refreshes': 0, 'failures': 0,
+          'candidates': None, 'refresh_seconds': None, 'refreshed_at': None,
+          'computed_at': None}
+_started = False
+_start_lock = threading.Lock()
+
+
+def like_weight(posted, liked, half_life):
+    """What a like made at `liked` adds to the score of a message posted at
+    `posted` (both naive UTC datetimes)."""
+
+    exponent = (liked - posted).total_seconds() / half_life
+    return 2.0 ** min(max(exponent, 0.0), MAX_WEIGHT_EXPONENT)
+
+
+def rank_key(posted, score, half_life):
+    """Sort key for a message; greater is hotter, comparable at any time."""
+
+    return math.log2(score) + posted.timestamp() / half_life
+
+
+def _to_datetime(value):
+    # SQLite hands back text for raw-SQL datetime columns
+    if isinstance(value, str):
+        return datetime.fromisoformat(value)
+    return value
+
+
+def top_ids(engine, size, half_life, window, now=None):
+    """Ids of the `size` hottest messages posted within `window` seconds."""
+
+    since = (now or datetime.utcnow()) - timedelta(seconds=window)
+
+    with engine.connect() as connection:
+        rows = connection.execute(text("""
+            SELECT id, timestamp, trend_score FROM messages
+            WHERE timestamp >= :since AND trend_score > 0"""), {'since': since})
+
+        scored = ((rank_key(_to_datetime(posted), score, half_life), message_id)
+                  for message_id, posted, score in rows)
+        best = heapq.nlargest(size, scored)
+
+    return [message_id for _, message_id in best]
+
+
+def compute(engine, size, half_life, window, max_age=0):
+    """Rank the recent messages and store the list for the web workers.
+
+    Does nothing if the stored list is less than `max_age` seconds old, so
+    several workers between them compute it about once per `max_age`.
+    Returns the stored ids, or None if it skipped.
+    """
+
+    now = datetime.utcnow()
+
+    with engine.connect() as connection:
+        computed_at = connection.execute(
+            select(func.max(trending_messages.c.computed_at))).scalar()
+
+    if (computed_at is not None and
+            now - _to_datetime(computed_at) < timedelta(seconds=max_age)):
+        return None
+
+    started = time.monotonic()
+    ids = top_ids(engine, size, half_life, window, now)
+
+    with engine.begin() as connection:
+        connection.execute(trending_messages.delete())
+        if ids:
+            connection.execute(trending_messages.insert(), [
+                {'position': position, 'message_id': message_id,
+                 'computed_at': now}
+                for position, message_id in enumerate(ids)])
+
+    logger.info("trending list computed: %d messages in %.3fs",
+                len(ids), time.monotonic() - started)
+    return ids
+
+
+def compute_app(app, engine, max_age=0):
+    """Compute and store the trending list with `app`'s settings."""
+
+    return compute(engine,
+                   app.config['TRENDING_SIZE'],
+                   app.config['TRENDING_HALF_LIFE'],
+                   app.config['TRENDING_WINDOW'],
+                   max_age)
+
+
+def compute_forever(app, engine):
+    """Keep the stored trending list fresh; run by the job worker."""
+
+    interval = app.config['TRENDING_REFRESH']
+
+    while True:
+        try:
+            compute_app(app, engine, max_age=interval)
+        except Exception:
+            logger.exception("computing the trending list failed")
+        time.sleep(interval)
+
+
+def refresh(engine):
+    """Load the stored trending list, keeping the old one if that fails."""
+
+    global _top_ids
+
+    started = time.monotonic()
+
+    try:
+        with engine.connect() as connection:
+            rows = connection.execute(
+                select(trending_messages.c.message_id,
+                       trending_messages.c.computed_at)
+                .order_by(trending_messages.c.position)).all()
+    except Exception:
+        _stats['failures'] += 1
+        logger.exception("trending refresh failed")
+        return
+
+    _top_ids = [message_id for message_id, _ in rows]
+    _stats.update(state='ready', refreshes=_stats['refreshes'] + 1,
+                  candidates=len(rows),
+                  refresh_seconds=round(time.monotonic() - started, 3),
+                  refreshed_at=time.time(),
+                  computed_at=(_to_datetime(rows[0][1]).isoformat()
+                               if rows else None))
+
+
+def _refresh_forever(engine, interval):
+    while True:
+        refresh(engine)
+        time.sleep(interval)
+
+
+def start(app, engine):
+    """Start loading the trending list for this web worker, once."""
+
+    global _started
+
+    with _start_lock:
+        if _started:
+            return
+        _started = True
+
+    _stats['state'] = 'building'
+    thread = threading.Thread(
+        target=_refresh_forever,
+        args=(engine, app.config['TRENDING_REFRESH']),
+        name='trending',
+        daemon=True)
+    thread.start()
+
+
+def current_ids(limit=None):
+    """The trending message ids, hottest first (may include deleted ones)."""
+
+    return _top_ids[:limit]
+
+
+def stats():
+    return dict(_stats)
+
+
+def init_app(app, engine_getter):
+    """Start the refresh thread when `app` serves its first request.
+
+    TRENDING_REFRESH of 0 disables the thread; call `refresh` instead.
+    """
+
+    def start_on_first_request():
+        if app.config['TRENDING_REFRESH'] > 0:
+            start(app, engine_getter())
+
+    app.before_request(start_on_first_request)
+    instrumentation.register_metrics('trending', stats)
@@ -0,0 +1,36 @@
+"""Background job worker (see jobs.py).
+
+    python worker.py
+
+Runs jobs as they come due until stopped. Start as many as the queue needs;
+they share the work through the jobs table. Alongside, a thread keeps the
+stored trending list fresh (see trending.py).
+"""
+
+import logging
+import threading
+
+from app import create_app
+from models import db
+import jobs
+import trending
+
+
+def main():
+    logging.basicConfig(level=logging.INFO,
+                        format="%(asctime)s %(name)s %(levelname)s %(message)s")
+
+    app = create_app()
+
+    with app.app_context():
+        if app.config['TRENDING_REFRESH'] > 0:
+            threading.Thread(target=trending.compute_forever,
+                             args=(app, db.engine),
+                             name='trending',
+                             daemon=True).start()
+
+        jobs.work_forever()
+
+
+if __name__ == '__main__':
+    main()